@@ -0,0 +1,277 @@
+#! /usr/bin/env python3
+
+# Benchmark the DDM detection pipeline against recorded fixtures
+#
+# A fixture is a directory that looks like the root of a system:
+#   commands.json      Recorded output of the commands DDM runs (lspci, uname, ...)
+#   var/log/           Xorg and syslog logs
+#   var/lib/dpkg/      dpkg status file (replayed as apt-cache policy)
+#   sys/class/dmi/id/  DMI information
+#
+# Commands are replayed by small shell scripts that are put in front of PATH,
+# so the pipelines (and forks) DDM runs are measured as they are.
+# Logs are padded to the requested sizes with the relevant lines at the start,
+# which is the worst case for the log scanners.
+#
+# Usage:
+#   bench/benchmark.py
+#   bench/benchmark.py --sizes 1M,100M,1G --repeat 5
+#   bench/benchmark.py --compare bench/results/previous.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from os.path import join, abspath, dirname, exists, isdir
+
+benchDir = abspath(dirname(__file__))
+sys.path.insert(1, join(benchDir, '../usr/lib/ddm'))
+
+from logger import Logger
+from hardware import HardwareDetector
+
+STAGES = ['get_supported_hardware', 'get_loaded_graphical_driver',
+          'get_loaded_wireless_driver', 'fillTreeview']
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+XORG_FILLER = "[    18.900] (II) NVIDIA(0): Setting mode \"DFP-0:nvidia-auto-select\"\n"
+SYSLOG_FILLER = "Jul 13 07:12:00 solydx kernel: [   71.123456] usb 2-1.4: new high-speed USB device number 5 using ehci-pci\n"
+
+
+# Count the subprocesses spawned while running a stage
+class CountingPopen(subprocess.Popen):
+    count = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.count += 1
+        super(CountingPopen, self).__init__(*args, **kwargs)
+
+
+def parse_size(size):
+    size = size.strip().upper()
+    if size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+# Return dict with package: version from a dpkg status file
+def read_dpkg_status(path):
+    packages = {}
+    package = ''
+    with open(path) as f:
+        for line in f:
+            if line.startswith('Package:'):
+                package = line.split(':', 1)[1].strip()
+            elif line.startswith('Version:') and package:
+                packages[package] = line.split(':', 1)[1].strip()
+    return packages
+
+
+def shell_quote(text):
+    return "'{}'".format(text.replace("'", "'\\''"))
+
+
+# Write replay scripts for the recorded commands to binDir
+def write_shims(fixtureDir, binDir):
+    with open(join(fixtureDir, 'commands.json')) as f:
+        commands = json.load(f)
+
+    # lspci -d filters are derived from the full lspci -nn listing
+    lspci = commands.get('lspci -nn', '')
+    for line in lspci.splitlines():
+        vendor = line.rsplit('[', 1)[-1].split(':')[0]
+        key = "lspci -nn -d {}:".format(vendor)
+        commands[key] = commands.get(key, '') + line + '\n'
+
+    # apt-cache policy is derived from the dpkg status file
+    statusPath = join(fixtureDir, 'var/lib/dpkg/status')
+    if exists(statusPath):
+        for package, version in read_dpkg_status(statusPath).items():
+            commands["apt-cache policy {}".format(package)] = \
+                "{0}:\n  Installed: {1}\n  Candidate: {1}\n".format(package, version)
+
+    tools = {}
+    for command, output in commands.items():
+        tool, _, args = command.partition(' ')
+        tools.setdefault(tool, []).append((args, output))
+
+    os.makedirs(binDir, exist_ok=True)
+    for tool, cases in tools.items():
+        script = ['#!/bin/sh', 'case "$*" in']
+        for args, output in sorted(cases):
+            script.append("  {}) printf '%s' {} ;;".format(shell_quote(args), shell_quote(output)))
+        if tool == 'apt-cache':
+            script.append('  policy*) printf "%s:\\n  Installed: (none)\\n  Candidate: (none)\\n" "$2" ;;')
+        script.append('esac')
+        path = join(binDir, tool)
+        with open(path, 'w') as f:
+            f.write('\n'.join(script) + '\n')
+        os.chmod(path, 0o755)
+
+
+# Write a log of the given size: the original log followed by filler lines
+def write_padded_log(source, target, size, filler):
+    with open(source, 'rb') as f:
+        head = f.read()
+    filler = filler.encode()
+    block = filler * max(1, (1024 * 1024) // len(filler))
+    with open(target, 'wb') as f:
+        f.write(head)
+        written = len(head)
+        while written + len(block) <= size:
+            f.write(block)
+            written += len(block)
+        while written + len(filler) <= size:
+            f.write(filler)
+            written += len(filler)
+
+
+# Create a root directory for the fixture with logs of the given size
+def prepare_root(fixtureDir, workDir, size):
+    rootDir = join(workDir, 'root-{}'.format(size))
+    if not isdir(rootDir):
+        shutil.copytree(fixtureDir, rootDir)
+        logDir = join(rootDir, 'var/log')
+        for name, filler in [('Xorg.0.log', XORG_FILLER), ('syslog', SYSLOG_FILLER)]:
+            source = join(fixtureDir, 'var/log', name)
+            if exists(source):
+                write_padded_log(source, join(logDir, name), size, filler)
+    return rootDir
+
+
+def run_stage(stage, rootDir, logPath):
+    log = Logger(logPath, addLogTime=False)
+    detector = HardwareDetector(log, rootDir=rootDir)
+    if stage == 'fillTreeview':
+        import gi
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk
+        from treeview import TreeViewHandler
+        hardware = detector.get_supported_hardware()
+        rows = [['Install', '', 'Device', 'key']] + [[hw.selected, hw.logo, hw.description, hw.key] for hw in hardware]
+        handler = TreeViewHandler(Gtk.TreeView())
+        start = time.monotonic()
+        handler.fillTreeview(contentList=rows, columnTypesList=['bool', 'GdkPixbuf.Pixbuf', 'str', 'str'], firstItemIsColName=True, fontSize=12000)
+        return time.monotonic() - start, len(hardware)
+    start = time.monotonic()
+    result = getattr(detector, stage)()
+    return time.monotonic() - start, result
+
+
+# Run a single stage in a child process to measure its own forks and peak RSS
+def stage_worker(stage, rootDir, binDir, logPath, conn):
+    os.environ['PATH'] = "{}:{}".format(binDir, os.environ.get('PATH', ''))
+    subprocess.Popen = CountingPopen
+    rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        seconds, result = run_stage(stage, rootDir, logPath)
+    except Exception as detail:
+        conn.send({'error': "{}: {}".format(type(detail).__name__, detail)})
+        return
+    if isinstance(result, list):
+        # Number of devices found
+        result = len(result)
+    conn.send({'seconds': seconds,
+               'forks': CountingPopen.count,
+               'rss_before_kb': rssBefore,
+               'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               'result': result})
+
+
+def measure(stage, rootDir, binDir, logPath):
+    ctx = multiprocessing.get_context('fork')
+    parentConn, childConn = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=stage_worker, args=(stage, rootDir, binDir, logPath, childConn))
+    p.start()
+    childConn.close()
+    try:
+        ret = parentConn.recv()
+    except EOFError:
+        # The exit code is only known after join
+        p.join()
+        ret = {'error': 'stage exited with code {}'.format(p.exitcode)}
+    p.join()
+    return ret
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def compare(results, previousPath):
+    with open(previousPath) as f:
+        previous = json.load(f)
+    old = {(r['stage'], r['size']): r for r in previous['results'] if 'seconds' in r}
+    print("\nCompared with {}:".format(previousPath))
+    for r in results:
+        o = old.get((r['stage'], r['size']))
+        if o is None or 'seconds' not in r:
+            continue
+        delta = (r['seconds'] - o['seconds']) / o['seconds'] * 100 if o['seconds'] else 0
+        print("{:<30}{:>8}  {:>+8.1f}% time  {:>+4d} forks  {:>+8d} KB peak RSS".format(
+              r['stage'], r['size'], delta, r['forks'] - o['forks'], r['peak_rss_kb'] - o['peak_rss_kb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DDM detection pipeline")
+    parser.add_argument('--fixture', default=join(benchDir, 'fixtures/desktop'), help='Fixture directory')
+    parser.add_argument('--sizes', default='1M,100M', help='Comma separated log sizes (e.g. 1M,100M,1G)')
+    parser.add_argument('--stages', default=','.join(STAGES), help='Comma separated stages to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per stage')
+    parser.add_argument('--workdir', default=join(benchDir, 'work'), help='Directory for the generated logs')
+    parser.add_argument('--output', help='JSON result file (default: bench/results/<date>.json)')
+    parser.add_argument('--compare', help='Previous JSON result file to compare with')
+    args = parser.parse_args()
+
+    fixtureDir = abspath(args.fixture)
+    workDir = join(abspath(args.workdir), os.path.basename(fixtureDir.rstrip('/')))
+    binDir = join(workDir, 'bin')
+    logPath = join(workDir, 'ddm.log')
+    write_shims(fixtureDir, binDir)
+
+    results = []
+    for size in args.sizes.split(','):
+        rootDir = prepare_root(fixtureDir, workDir, parse_size(size))
+        for stage in args.stages.split(','):
+            runs = [measure(stage, rootDir, binDir, logPath) for i in range(args.repeat)]
+            errors = [r['error'] for r in runs if 'error' in r]
+            if errors:
+                r = {'stage': stage, 'size': size, 'error': errors[0]}
+                print("{:<30}{:>8}  skipped: {}".format(stage, size, errors[0]))
+            else:
+                seconds = [r['seconds'] for r in runs]
+                r = {'stage': stage, 'size': size,
+                     'seconds': median(seconds), 'min_seconds': min(seconds),
+                     'forks': runs[0]['forks'],
+                     'rss_before_kb': runs[0]['rss_before_kb'],
+                     'peak_rss_kb': max(r['peak_rss_kb'] for r in runs),
+                     'result': runs[0]['result']}
+                print("{:<30}{:>8}  {:>9.4f}s  {:>3d} forks  {:>8d} KB peak RSS  result={!r}".format(
+                      stage, size, r['seconds'], r['forks'], r['peak_rss_kb'], r['result']))
+            results.append(r)
+
+    output = args.output
+    if not output:
+        output = join(benchDir, 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(dirname(abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'fixture': os.path.basename(fixtureDir.rstrip('/')),
+                   'repeat': args.repeat,
+                   'results': results}, f, indent=2)
+    print("\nResults written to {}".format(output))
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
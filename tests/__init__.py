@@ -0,0 +1,10 @@
+# Unit tests for the modules in usr/lib/ddm
+#
+# Run from the top directory: python3 -m unittest discover -s tests -t .
+# The tests do not need root, GTK or the network.
+
+import sys
+from os.path import join, abspath, dirname
+
+DDM_DIR = join(dirname(dirname(abspath(__file__))), 'usr', 'lib', 'ddm')
+sys.path.insert(1, DDM_DIR)
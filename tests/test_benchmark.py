@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+from os.path import join, abspath, dirname
+
+sys.path.insert(1, join(dirname(dirname(abspath(__file__))), 'bench'))
+import benchmark
+
+
+def crash(stage, rootDir, logPath):
+    os._exit(3)
+
+
+def fail(stage, rootDir, logPath):
+    raise RuntimeError("no lspci")
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def test_parse_size(self):
+        self.assertEqual(benchmark.parse_size('1k'), 1024)
+        self.assertEqual(benchmark.parse_size(' 1.5M'), 1536 * 1024)
+        self.assertEqual(benchmark.parse_size('100'), 100)
+
+    def test_padded_log(self):
+        source = join(self.workDir, 'syslog')
+        target = join(self.workDir, 'syslog.padded')
+        with open(source, 'w') as f:
+            f.write("first line\n")
+        benchmark.write_padded_log(source, target, 4096, benchmark.SYSLOG_FILLER)
+        with open(target) as f:
+            text = f.read()
+        self.assertTrue(text.startswith("first line\n"))
+        self.assertLessEqual(len(text), 4096)
+        self.assertGreater(len(text), 4096 - len(benchmark.SYSLOG_FILLER))
+
+    def test_shims(self):
+        fixtureDir = join(self.workDir, 'fixture')
+        binDir = join(self.workDir, 'bin')
+        os.makedirs(join(fixtureDir, 'var/lib/dpkg'))
+        lspci = "01:00.0 VGA compatible controller [0300]: NVIDIA Corporation GT218 [10de:0a65] (rev a2)\n"
+        with open(join(fixtureDir, 'commands.json'), 'w') as f:
+            json.dump({'lspci -nn': lspci, 'uname -r': "4.9.0-8-amd64\n"}, f)
+        with open(join(fixtureDir, 'var/lib/dpkg/status'), 'w') as f:
+            f.write("Package: nvidia-driver\nStatus: install ok installed\nVersion: 390.87-2\n")
+        benchmark.write_shims(fixtureDir, binDir)
+
+        def shim(*args):
+            return subprocess.run([join(binDir, args[0])] + list(args[1:]), stdout=subprocess.PIPE,
+                                  universal_newlines=True).stdout
+
+        self.assertEqual(shim('uname', '-r'), "4.9.0-8-amd64\n")
+        # The lspci -d listing is derived from lspci -nn
+        self.assertEqual(shim('lspci', '-nn', '-d', '10de:'), lspci)
+        self.assertIn("Installed: 390.87-2", shim('apt-cache', 'policy', 'nvidia-driver'))
+        self.assertIn("Installed: (none)", shim('apt-cache', 'policy', 'xserver-xorg'))
+
+    # A stage that crashes or fails is reported, the benchmark goes on
+    def test_measure_crash(self):
+        with mock.patch.object(benchmark, 'run_stage', crash):
+            result = benchmark.measure('get_supported_hardware', self.workDir, self.workDir, os.devnull)
+        self.assertEqual(result, {'error': 'stage exited with code 3'})
+        with mock.patch.object(benchmark, 'run_stage', fail):
+            result = benchmark.measure('get_supported_hardware', self.workDir, self.workDir, os.devnull)
+        self.assertEqual(result, {'error': 'RuntimeError: no lspci'})
+
+
+if __name__ == '__main__':
+    unittest.main()
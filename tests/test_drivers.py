@@ -0,0 +1,66 @@
+import unittest
+
+from drivers import DriverRules, VGA, DISPLAY_3D
+
+ID_LISTS = {'B43': '|4307|4311|', 'B43LEGACY': '|4301|', 'WLDEBIAN': '|4727|',
+            'BRCMDEBIAN': '|4313|', 'UNKNOWN': '|4320|'}
+
+
+class DriverRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = DriverRules(idLists=ID_LISTS)
+
+    def match(self, description, vendor, deviceId, cls):
+        return self.rules.match([description, vendor, deviceId, cls])
+
+    def test_ati(self):
+        rule, matchObj = self.match('Advanced Micro Devices [AMD/ATI] Cedar [Radeon HD 5450]', '1002', '68f9', VGA)
+        self.assertEqual(rule['driver'], 'fglrx')
+        self.assertEqual(matchObj.group(0).strip(), 'Radeon HD 5450')
+        self.assertEqual(rule['minSeries'], 5000)
+        # Cards that do not match the names are listed as not supported
+        rule, matchObj = self.match('Advanced Micro Devices [AMD/ATI] Navi 10', '1002', '731f', VGA)
+        self.assertFalse(rule['supported'])
+        # Audio function of the card
+        self.assertEqual(self.match('AMD/ATI Cedar HDMI Audio', '1002', 'aa68', '0403'), (None, None))
+
+    def test_firepro_warning(self):
+        rule, matchObj = self.match('AMD/ATI Bonaire [FirePro W5100]', '1002', '6649', VGA)
+        self.assertEqual(rule['driver'], 'fglrx')
+        self.assertTrue(rule['warning'][0].search('AMD/ATI Bonaire [FirePro W5100]'))
+
+    def test_nvidia(self):
+        for cls in (VGA, DISPLAY_3D):
+            rule, matchObj = self.match('NVIDIA Corporation GT218 [GeForce 210]', '10de', '0a65', cls)
+            self.assertEqual(rule['resolver'], 'get_nvidia_driver')
+
+    def test_broadcom_device_lists(self):
+        self.assertEqual(self.match('BCM4311 802.11b/g', '14e4', '4311', '0280')[0]['driver'], 'b43')
+        self.assertEqual(self.match('BCM4301 802.11b', '14e4', '4301', '0280')[0]['driver'], 'b43legacy')
+        self.assertEqual(self.match('BCM4313 802.11bgn', '14e4', '4313', '0280')[0]['module'], 'brcmsmac')
+        self.assertFalse(self.match('BCM4320', '14e4', '4320', '0280')[0]['supported'])
+        # Not in any list: no rule (the Broadcom ethernet controllers)
+        self.assertEqual(self.match('NetXtreme BCM5761', '14e4', '1681', '0200'), (None, None))
+
+    def test_ranges(self):
+        rules = DriverRules([{'vendor': '8086', 'ranges': [('0a60', '0a62')], 'driver': 'test'}])
+        self.assertEqual(rules.match(['', '8086', '0a61', VGA])[0]['driver'], 'test')
+        self.assertEqual(rules.match(['', '8086', '0a63', VGA]), (None, None))
+
+    def test_packages_and_backends(self):
+        self.assertEqual(self.rules.get_package('fglrx'), 'fglrx-driver')
+        self.assertEqual(self.rules.get_package('wldebian'), 'broadcom-sta-dkms')
+        # Resolved Nvidia drivers are packages themselves
+        self.assertEqual(self.rules.get_package('nvidia-legacy-340xx-driver'), 'nvidia-legacy-340xx-driver')
+        self.assertEqual(self.rules.get_backend('14e4'), 'broadcom')
+        self.assertEqual(self.rules.get_backend('8086'), '')
+
+    def test_arguments(self):
+        changes = [(False, True, '10de'), (True, False, '14e4'), (True, True, '1002'),
+                   (False, True, '10de'), (False, True, '8086')]
+        self.assertEqual(self.rules.get_arguments(changes), ['-i nvidia', '-p broadcom'])
+
+
+if __name__ == '__main__':
+    unittest.main()
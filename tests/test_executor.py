@@ -0,0 +1,80 @@
+import time
+import unittest
+
+import executor
+from executor import CommandExecutor
+
+
+class ExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = CommandExecutor(maxWorkers=2)
+
+    def tearDown(self):
+        self.executor.shutdown(cancel=True)
+
+    def test_result(self):
+        lines = []
+        future = self.executor.submit("echo one; echo two >&2; exit 3", onLine=lines.append)
+        result = future.result(5)
+        self.assertEqual(result.returncode, 3)
+        self.assertEqual(result.output, ['one', 'two'])
+        self.assertEqual(lines, ['one', 'two'])
+        self.assertFalse(result.timedOut or result.cancelled)
+
+    def test_map(self):
+        results = self.executor.map(["echo {}".format(i) for i in range(5)])
+        self.assertEqual([r.output for r in results], [[str(i)] for i in range(5)])
+
+    def test_callback(self):
+        results = []
+        dispatched = []
+
+        def dispatch(func, *args):
+            dispatched.append(func)
+            func(*args)
+
+        future = self.executor.submit("true", callback=lambda f: results.append(f.result().returncode),
+                                      dispatch=dispatch)
+        future.result(5)
+        self.assertEqual(results, [0])
+        self.assertEqual(len(dispatched), 1)
+
+    # The whole process group is killed, not only the shell
+    def test_timeout(self):
+        start = time.monotonic()
+        result = self.executor.submit("sleep 30 | cat", timeout=0.2).result(10)
+        self.assertTrue(result.timedOut)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_cancel_waiting(self):
+        self.executor = CommandExecutor(maxWorkers=1)
+        running = self.executor.submit("sleep 30")
+        waiting = self.executor.submit("echo never")
+        self.assertTrue(self.executor.cancel(waiting))
+        self.assertTrue(waiting.cancelled())
+        self.executor.cancel(running)
+        self.assertTrue(running.result(10).cancelled)
+
+    # A child that ignores SIGTERM is killed after KILL_DELAY, also when the shell has exited
+    def test_force_kill(self):
+        delay = executor.KILL_DELAY
+        executor.KILL_DELAY = 0.2
+        try:
+            future = self.executor.submit("sh -c 'trap \"\" TERM; sleep 30' & sleep 30")
+            time.sleep(0.3)
+            start = time.monotonic()
+            self.executor.cancel(future)
+            result = future.result(10)
+        finally:
+            executor.KILL_DELAY = delay
+        self.assertTrue(result.cancelled)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_submit_call(self):
+        future = self.executor.submit_call(lambda a, b: a + b, 2, 3)
+        self.assertEqual(future.result(5), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import gzip
+import lzma
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+import logsearch
+from logsearch import LogSearch, get_generation
+from patterns import WIRELESS_DRIVER, XORG_MODULE
+
+
+class LogSearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.logDir = tempfile.mkdtemp()
+        self.logSearch = LogSearch()
+
+    def tearDown(self):
+        shutil.rmtree(self.logDir)
+
+    def write_log(self, name, lines):
+        path = join(self.logDir, name)
+        opener = {'.gz': gzip.open, '.xz': lzma.open}.get(os.path.splitext(name)[1], open)
+        with opener(path, 'wt') as f:
+            f.write('\n'.join(lines) + '\n')
+        return path
+
+    def get_driver(self, paths, last=True):
+        matchObj = self.logSearch.search(WIRELESS_DRIVER, paths, last)
+        return matchObj.group('networkmanager') if matchObj else None
+
+    def test_generation(self):
+        self.assertEqual(get_generation('/var/log/syslog'), 0)
+        self.assertEqual(get_generation('/var/log/syslog.1'), 1)
+        self.assertEqual(get_generation('/var/log/syslog.12.gz'), 12)
+        self.assertEqual(get_generation('/var/log/Xorg.0.log.old'), 1)
+        self.assertEqual(get_generation('/var/log/Xorg.0.log'), 0)
+
+    # The newest generation with a match wins, whatever the order of the paths
+    def test_newest_first(self):
+        paths = [self.write_log('syslog.2.gz', ["(wlan0): driver: 'b43'"]),
+                 self.write_log('syslog.1', ["(wlan0): driver: 'wl'"]),
+                 self.write_log('syslog', ['nothing here'])]
+        self.assertEqual(self.get_driver(paths), 'wl')
+        os.remove(paths[1])
+        self.assertEqual(self.get_driver(paths), 'b43')
+
+    def test_compressed(self):
+        paths = [self.write_log('syslog.3.xz', ["(wlan0): driver: 'brcmsmac'"]),
+                 self.write_log('syslog.4.gz', ["(wlan0): driver: 'b43'"])]
+        self.assertEqual(self.get_driver(paths), 'brcmsmac')
+
+    # The last match is the most recent line, also across the blocks of a large log
+    def test_last_match(self):
+        lines = ["(wlan0): driver: 'b43'"] + ['filler line {}'.format(i) for i in range(40000)] + \
+                ["(wlan0): driver: 'wl'", 'after']
+        for name in ('syslog', 'syslog.1.gz'):
+            self.logSearch = LogSearch()
+            path = self.write_log(name, lines)
+            self.assertGreater(os.path.getsize(join(self.logDir, 'syslog')), logsearch.CHUNK_SIZE)
+            self.assertEqual(self.get_driver([path]), 'wl')
+            self.assertEqual(self.get_driver([path], last=False), 'b43')
+
+    # A match only keeps its own line, not the block it was found in
+    def test_match_line(self):
+        path = self.write_log('Xorg.0.log', ['[    18.900] (II) Loading extension GLX'] * 2000 +
+                              ['[    19.000] (**) NVIDIA(0): Depth 24, (--) framebuffer bpp 32'])
+        matchObj = self.logSearch.search(XORG_MODULE, [path])
+        self.assertEqual(matchObj.group(1), 'NVIDIA')
+        self.assertEqual(matchObj.string, '[    19.000] (**) NVIDIA(0): Depth 24, (--) framebuffer bpp 32')
+
+    # A changed log is read again and the results of its old contents are dropped
+    def test_changed_log(self):
+        path = self.write_log('syslog', ["(wlan0): driver: 'wl'"])
+        self.assertEqual(self.get_driver([path]), 'wl')
+        self.assertEqual(self.get_driver([path], last=False), 'wl')
+        stat = os.stat(path)
+        with open(path, 'a') as f:
+            f.write("(wlan0): driver: 'b43'\n")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.get_driver([path]), 'b43')
+        self.assertEqual(list(self.logSearch.cache), [(stat.st_dev, stat.st_ino, stat.st_mtime_ns + 10 ** 9,
+                                                      WIRELESS_DRIVER.pattern, True)])
+
+    # A generation is read once: logrotate renames it without changing inode or mtime
+    def test_cached_result(self):
+        path = self.write_log('syslog.1', ["(wlan0): driver: 'wl'"])
+        self.assertEqual(self.get_driver([path]), 'wl')
+        stat = os.stat(path)
+        with open(path, 'w') as f:
+            f.write("(wlan0): driver: 'b43'\n")
+        # Same inode and mtime: the cached result
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.get_driver([path]), 'wl')
+
+    def test_no_match(self):
+        path = self.write_log('syslog', ['nothing here'])
+        self.assertIsNone(self.get_driver([path, join(self.logDir, 'missing')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
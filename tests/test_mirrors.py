@@ -0,0 +1,115 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+from os.path import join
+
+import mirrors
+from mirrors import Probe, get_sources, parse_release, is_same_archive, rank_mirrors, write_override
+
+RELEASE = """Origin: Debian
+Label: Debian
+Suite: stable
+Codename: stretch
+Components: main contrib non-free
+SHA256:
+ 0123 1234 main/binary-amd64/Packages
+"""
+DEBIAN = {'Origin': 'Debian', 'Label': 'Debian', 'Components': 'main contrib non-free'}
+
+
+class MirrorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.sourcesList = join(self.workDir, 'sources.list')
+        with open(self.sourcesList, 'w') as f:
+            f.write("# comment\n"
+                    "deb http://ftp.nl.debian.org/debian/ stretch main contrib  # local mirror\n"
+                    "deb-src http://ftp.nl.debian.org/debian stretch main\n"
+                    "deb [arch=amd64 signed-by=/usr/share/keyrings/x.gpg] http://repo.example/apt stretch main\n"
+                    "deb-foo http://ignored.example/debian stretch main\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def test_sources(self):
+        sources = get_sources([self.sourcesList, join(self.workDir, 'missing.list')])
+        self.assertEqual([(s.uri, s.suite, s.components) for s in sources],
+                         [('http://ftp.nl.debian.org/debian', 'stretch', ['main', 'contrib']),
+                          ('http://ftp.nl.debian.org/debian', 'stretch', ['main']),
+                          ('http://repo.example/apt', 'stretch', ['main'])])
+        # Options are kept when the mirror changes
+        self.assertEqual(sources[2].with_uri('http://other/apt'),
+                         "deb [arch=amd64 signed-by=/usr/share/keyrings/x.gpg] http://other/apt stretch main")
+
+    def test_parse_release(self):
+        release = parse_release(RELEASE)
+        self.assertEqual(release['Codename'], 'stretch')
+        self.assertEqual(release['Components'], 'main contrib non-free')
+        self.assertNotIn('SHA256', release)
+
+    def test_same_archive(self):
+        self.assertTrue(is_same_archive(DEBIAN, DEBIAN, ['main', 'contrib']))
+        self.assertFalse(is_same_archive(dict(DEBIAN, Origin='Ubuntu'), DEBIAN, ['main']))
+        # The candidate must carry all components of the source
+        self.assertFalse(is_same_archive(dict(DEBIAN, Components='main'), DEBIAN, ['main', 'contrib']))
+        self.assertFalse(is_same_archive({}, DEBIAN, ['main']))
+        self.assertFalse(is_same_archive(DEBIAN, {}, ['main']))
+
+    # Candidates are ranked by score and only replace a source with the same archive
+    def test_rank_mirrors(self):
+        probes = {'http://ftp.nl.debian.org/debian': Probe('http://ftp.nl.debian.org/debian', 0.05, 100000, DEBIAN),
+                  'http://fast.example/debian': Probe('http://fast.example/debian', 0.01, 10000000, DEBIAN),
+                  'http://other.example/ubuntu': Probe('http://other.example/ubuntu', 0.01, 10000000,
+                                                       dict(DEBIAN, Origin='Ubuntu')),
+                  'http://down.example/debian': Probe('http://down.example/debian'),
+                  'http://repo.example/apt': Probe('http://repo.example/apt', 0.02, 50000, {'Origin': 'Example'})}
+        sources = get_sources([self.sourcesList])
+        with mock.patch.object(mirrors, 'probe', lambda uri, suite: probes[uri]), redirect_stdout(io.StringIO()):
+            ranking = rank_mirrors(sources, ['http://fast.example/debian/', 'http://other.example/ubuntu',
+                                             'http://down.example/debian'])
+        self.assertEqual(ranking[('http://ftp.nl.debian.org/debian', 'stretch')],
+                         ['http://fast.example/debian', 'http://ftp.nl.debian.org/debian'])
+        self.assertEqual(ranking[('http://repo.example/apt', 'stretch')], ['http://repo.example/apt'])
+
+    def test_ranking_cache(self):
+        cacheFile = join(self.workDir, 'cache', 'mirrors.json')
+        ranking = {('http://a/debian', 'stretch'): ['http://b/debian', 'http://a/debian']}
+        mirrors.save_ranking(cacheFile, ['key'], ranking)
+        self.assertEqual(mirrors.load_ranking(cacheFile, 60, ['key']), ranking)
+        self.assertIsNone(mirrors.load_ranking(cacheFile, 60, ['other key']))
+        self.assertIsNone(mirrors.load_ranking(cacheFile, -1, ['key']))
+        self.assertIsNone(mirrors.load_ranking(join(self.workDir, 'missing.json'), 60, ['key']))
+
+    def test_write_override(self):
+        sourcesParts = join(self.workDir, 'sources.list.d')
+        os.makedirs(sourcesParts)
+        with open(join(sourcesParts, 'debian.sources'), 'w') as f:
+            f.write("Types: deb\nURIs: http://deb.debian.org/debian\nSuites: stretch\nComponents: main\n")
+        with open(join(sourcesParts, 'other.list'), 'w') as f:
+            f.write("deb http://other/debian stretch main\n")
+        sources = get_sources([self.sourcesList])
+        outputDir = join(self.workDir, 'output')
+        os.makedirs(outputDir)
+        with mock.patch.object(mirrors, 'SOURCES_PARTS', sourcesParts), redirect_stdout(io.StringIO()):
+            self.assertFalse(write_override(outputDir, sources, {}))
+            ranking = {('http://ftp.nl.debian.org/debian', 'stretch'): ['http://fast.example/debian']}
+            self.assertTrue(write_override(outputDir, sources, ranking))
+        with open(join(outputDir, 'sources.list')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], "deb http://fast.example/debian stretch main contrib")
+        self.assertEqual(lines[1], "deb-src http://fast.example/debian stretch main")
+        self.assertEqual(lines[2], "deb [arch=amd64 signed-by=/usr/share/keyrings/x.gpg] http://repo.example/apt stretch main")
+        # Only the .sources files are used next to the override
+        self.assertEqual(os.listdir(join(outputDir, 'sources.list.d')), ['debian.sources'])
+        with open(join(outputDir, 'apt.conf')) as f:
+            conf = f.read()
+        self.assertIn('Dir::Etc::SourceParts "{}";'.format(join(outputDir, 'sources.list.d')), conf)
+
+
+if __name__ == '__main__':
+    unittest.main()
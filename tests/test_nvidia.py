@@ -0,0 +1,99 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+import nvidia
+from hardware import HardwareDetector
+from nvidia import NvidiaResolver, series_order, normalize_id, get_package_name
+
+
+class NvidiaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.idsDir = join(self.workDir, 'nvidia')
+        self.cachePath = join(self.workDir, 'cache', 'nvidia.json')
+        os.makedirs(self.idsDir)
+        self.write_ids('nvidia.ids', ['10de1c82', '10de0fc6'])
+        self.write_ids('nvidia-legacy-340xx.ids', ['10DE:0A65', '0fc6  # also current'])
+        self.write_ids('nvidia-legacy-304xx.ids', ['0a65', '0244'])
+        self.commands = []
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def write_ids(self, name, ids):
+        with open(join(self.idsDir, name), 'w') as f:
+            f.write('\n'.join(ids) + '\n')
+
+    def run_command(self, command):
+        self.commands.append(command)
+        return ['nvidia-legacy-173xx-driver']
+
+    def get_resolver(self, cachePath=None):
+        return NvidiaResolver(None, self.idsDir, cachePath, self.run_command)
+
+    def test_series_order(self):
+        paths = ['nvidia-legacy-304xx.ids', 'nvidia-legacy-340xx.ids', 'nvidia.ids', 'nvidia-legacy-96xx.ids']
+        self.assertEqual(sorted(paths, key=series_order),
+                         ['nvidia.ids', 'nvidia-legacy-340xx.ids', 'nvidia-legacy-304xx.ids', 'nvidia-legacy-96xx.ids'])
+
+    def test_normalize_id(self):
+        self.assertEqual(normalize_id('10de0a65'), '0a65')
+        self.assertEqual(normalize_id('10DE:0A65'), '0a65')
+        self.assertEqual(normalize_id(' 0a65\n'), '0a65')
+        self.assertEqual(normalize_id('8086:0a65'), '')
+        self.assertEqual(get_package_name('/usr/share/nvidia/nvidia-legacy-340xx.ids'), 'nvidia-legacy-340xx-driver')
+
+    # The newest series that lists a device wins
+    def test_index(self):
+        resolver = self.get_resolver()
+        self.assertEqual(resolver.get_driver('0FC6'), 'nvidia-driver')
+        self.assertEqual(resolver.get_driver('0a65'), 'nvidia-legacy-340xx-driver')
+        self.assertEqual(resolver.get_driver('0244'), 'nvidia-legacy-304xx-driver')
+        self.assertEqual(self.commands, [])
+
+    # nvidia-detect is only asked once for an unknown device
+    def test_unknown_device(self):
+        resolver = self.get_resolver(self.cachePath)
+        self.assertEqual(resolver.get_driver('0110'), 'nvidia-legacy-173xx-driver')
+        self.assertEqual(resolver.get_driver('0110'), 'nvidia-legacy-173xx-driver')
+        self.assertEqual(len(self.commands), 1)
+        # Also not by the next process
+        self.assertEqual(self.get_resolver(self.cachePath).get_driver('0110'), 'nvidia-legacy-173xx-driver')
+        self.assertEqual(len(self.commands), 1)
+
+    def test_cache(self):
+        self.get_resolver(self.cachePath).get_driver('0a65')
+        with open(self.cachePath) as f:
+            cache = json.load(f)
+        self.assertEqual(cache['index']['1c82'], 'nvidia-driver')
+        # A changed id list rebuilds the index
+        self.write_ids('nvidia-legacy-390xx.ids', ['0a65'])
+        self.assertEqual(self.get_resolver(self.cachePath).get_driver('0a65'), 'nvidia-legacy-390xx-driver')
+
+    # Without a cache path (replays) nothing is written
+    def test_no_cache_path(self):
+        resolver = self.get_resolver()
+        self.assertEqual(resolver.get_driver('0110'), 'nvidia-legacy-173xx-driver')
+        self.assertEqual(os.listdir(self.workDir), ['nvidia'])
+
+    # A replayed tree (benchmark fixture, snapshot) gets no cache
+    def test_replay_root(self):
+        os.makedirs(join(self.workDir, 'usr/share'))
+        shutil.move(self.idsDir, join(self.workDir, 'usr/share/nvidia'))
+        detector = HardwareDetector(None, rootDir=self.workDir)
+        detector.run = self.run_command
+        self.assertEqual(detector.get_nvidia_driver(['GT218', '10de', '0a65'], False, ''),
+                         ('nvidia-legacy-340xx-driver', False, 'GT218'))
+        self.assertIsNone(detector.nvidiaResolver.cachePath)
+        self.assertFalse(os.path.exists(join(self.workDir, 'var')))
+        self.assertEqual(HardwareDetector(None).rootDir, '/')
+        self.assertEqual(nvidia.CACHE_PATH, '/var/cache/ddm/nvidia.json')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from subprocess import CompletedProcess
+from unittest import mock
+from os.path import join, exists
+
+import rollback
+from rollback import Snapshot, hook, plan, get_installed, EXIT_OK, EXIT_NOTHING
+
+HOOK = """VERSION 3
+APT::Architecture=amd64
+DPkg::Pre-Install-Pkgs::=/usr/lib/ddm/rollback.py hook
+
+nvidia-driver 375.82-1 amd64 same > 384.111-1 amd64 same **CONFIGURE**
+nvidia-driver 375.82-1 amd64 same > 384.111-1 amd64 same /var/cache/apt/archives/nvidia-driver_384.111-1_amd64.deb
+libgl1-nvidia-glx 375.82-1 i386 same > 384.111-1 i386 same /var/cache/apt/archives/libgl1-nvidia-glx_384.111-1_i386.deb
+nvidia-kernel-dkms - - none < 384.111-1 amd64 same /var/cache/apt/archives/nvidia-kernel-dkms_384.111-1_amd64.deb
+xserver-xorg-video-nouveau 1:1.0.13-3 amd64 foreign > - - none **REMOVE**
+nvidia-driver 384.111-1 amd64 same > 390.48-1 amd64 same /var/cache/apt/archives/nvidia-driver_390.48-1_amd64.deb
+"""
+
+
+# dpkg-query -W -f='${Package} ${Architecture} ${Version} ${db:Status-Abbrev}\n' for the installed packages
+def fake_dpkg_query(installed):
+    def run(args, **kwargs):
+        lines = ["{} {} {} ii ".format(*fields) for fields in installed]
+        return CompletedProcess(args, 0, '\n'.join(lines) + '\n', '')
+    return run
+
+
+class RollbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.archives = join(self.workDir, 'archives')
+        os.makedirs(self.archives)
+        for name in ('nvidia-driver_375.82-1_amd64.deb', 'libgl1-nvidia-glx_375.82-1_i386.deb',
+                     'xserver-xorg-video-nouveau_1%3a1.0.13-3_amd64.deb'):
+            open(join(self.archives, name), 'w').close()
+        patches = [mock.patch.object(rollback, 'get_native_arch', lambda: 'amd64'),
+                   mock.patch.object(rollback, 'ARCHIVES', self.archives)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.snapshot = Snapshot(join(self.workDir, 'snapshot'))
+        os.makedirs(self.snapshot.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def test_key(self):
+        self.assertEqual(rollback.get_key('nvidia-driver', 'amd64'), 'nvidia-driver')
+        self.assertEqual(rollback.get_key('nvidia-driver', 'all'), 'nvidia-driver')
+        self.assertEqual(rollback.get_key('libgl1-nvidia-glx', 'i386'), 'libgl1-nvidia-glx:i386')
+
+    # Only the first version of a package is recorded and the replaced package files are kept
+    def test_hook(self):
+        hook(self.snapshot, io.StringIO(HOOK))
+        info = Snapshot(self.snapshot.path).info
+        self.assertEqual(info['packages'], {'nvidia-driver': '375.82-1',
+                                            'libgl1-nvidia-glx:i386': '375.82-1',
+                                            'nvidia-kernel-dkms': None,
+                                            'xserver-xorg-video-nouveau': '1:1.0.13-3'})
+        self.assertEqual(sorted(os.listdir(self.snapshot.debsDir)),
+                         ['libgl1-nvidia-glx_375.82-1_i386.deb', 'nvidia-driver_375.82-1_amd64.deb',
+                          'xserver-xorg-video-nouveau_1%3a1.0.13-3_amd64.deb'])
+
+    def test_hook_version2(self):
+        lines = ["VERSION 2", "", "nvidia-driver 375.82-1 > 384.111-1 /tmp/nvidia-driver.deb",
+                 "nvidia-kernel-dkms - < 384.111-1 /tmp/nvidia-kernel-dkms.deb"]
+        hook(self.snapshot, lines)
+        self.assertEqual(self.snapshot.info['packages'], {'nvidia-driver': '375.82-1', 'nvidia-kernel-dkms': None})
+
+    # Multi-Arch: same packages are named like get_key, also when they are native
+    def test_installed(self):
+        installed = [('nvidia-driver', 'amd64', '384.111-1'), ('libgl1-nvidia-glx', 'amd64', '384.111-1'),
+                     ('libgl1-nvidia-glx', 'i386', '384.111-1'), ('nvidia-kernel-dkms', 'amd64', '384.111-1')]
+        with mock.patch.object(rollback, 'run', fake_dpkg_query(installed)):
+            self.assertEqual(get_installed(['nvidia-driver', 'libgl1-nvidia-glx', 'libgl1-nvidia-glx:i386']),
+                             {'nvidia-driver': '384.111-1', 'libgl1-nvidia-glx': '384.111-1',
+                              'libgl1-nvidia-glx:i386': '384.111-1', 'nvidia-kernel-dkms': '384.111-1'})
+        self.assertEqual(get_installed([]), {})
+
+    def test_plan(self):
+        hook(self.snapshot, io.StringIO(HOOK))
+        installed = [('nvidia-driver', 'amd64', '390.48-1'), ('libgl1-nvidia-glx', 'i386', '384.111-1'),
+                     ('nvidia-kernel-dkms', 'amd64', '384.111-1')]
+        output = io.StringIO()
+        with mock.patch.object(rollback, 'run', fake_dpkg_query(installed)), redirect_stdout(output):
+            self.assertEqual(plan(self.snapshot), EXIT_OK)
+        debs = self.snapshot.debsDir
+        self.assertEqual(output.getvalue().splitlines(),
+                         [join(debs, 'libgl1-nvidia-glx_375.82-1_i386.deb'),
+                          join(debs, 'nvidia-driver_375.82-1_amd64.deb'),
+                          'nvidia-kernel-dkms-',
+                          join(debs, 'xserver-xorg-video-nouveau_1%3a1.0.13-3_amd64.deb')])
+
+    # A rolled back package is not touched again
+    def test_plan_restored(self):
+        hook(self.snapshot, io.StringIO(HOOK))
+        installed = [('nvidia-driver', 'amd64', '375.82-1'), ('libgl1-nvidia-glx', 'i386', '375.82-1'),
+                     ('xserver-xorg-video-nouveau', 'amd64', '1:1.0.13-3')]
+        output = io.StringIO()
+        with mock.patch.object(rollback, 'run', fake_dpkg_query(installed)), redirect_stdout(output):
+            self.assertEqual(plan(self.snapshot), EXIT_OK)
+        self.assertEqual(output.getvalue().strip(), '')
+
+    def test_plan_missing(self):
+        hook(self.snapshot, io.StringIO(HOOK))
+        os.remove(self.snapshot.info['debs']['nvidia-driver'])
+        output = io.StringIO()
+        with mock.patch.object(rollback, 'run', fake_dpkg_query([])), redirect_stdout(output):
+            self.assertEqual(plan(self.snapshot), EXIT_NOTHING)
+        self.assertIn('nvidia-driver 375.82-1', output.getvalue())
+        self.assertTrue(exists(self.snapshot.info['debs']['libgl1-nvidia-glx:i386']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from os.path import join, abspath, dirname, exists
+
+from snapshot import ReplayDetector, extract_snapshot, parse_policy, read_dpkg_status
+
+FIXTURE_DIR = join(dirname(dirname(abspath(__file__))), 'bench', 'fixtures', 'desktop')
+
+
+# Logger that keeps the messages
+class ListLog(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message, *args, **kwargs):
+        self.messages.append(message)
+
+
+def get_files(directory):
+    return sorted(join(root, name)[len(directory):] for root, dirs, names in os.walk(directory) for name in names)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def check_replay(self, snapshotPath):
+        detector = ReplayDetector(ListLog(), snapshotPath)
+        hardware = detector.get_supported_hardware()
+        self.assertEqual([(hw.slot, hw.driver, hw.selected) for hw in hardware],
+                         [('01:00.0', 'nvidia-legacy-340xx-driver', True), ('02:00.0', 'wldebian', True)])
+        self.assertEqual(detector.get_loaded_graphical_driver(), 'nvidia')
+        self.assertEqual(detector.get_loaded_wireless_driver(), 'wl')
+
+    # The replay reads the fixture and writes nothing into it
+    def test_replay_directory(self):
+        files = get_files(FIXTURE_DIR)
+        self.check_replay(FIXTURE_DIR)
+        self.assertEqual(get_files(FIXTURE_DIR), files)
+
+    def test_replay_archive(self):
+        snapshotPath = join(self.workDir, 'ddm-snapshot.tar.gz')
+        with tarfile.open(snapshotPath, 'w:gz') as tar:
+            tar.add(FIXTURE_DIR, arcname='.')
+        self.check_replay(snapshotPath)
+
+    # Paths outside the target and links are not extracted
+    def test_extract_snapshot(self):
+        snapshotPath = join(self.workDir, 'evil.tar.gz')
+        with tarfile.open(snapshotPath, 'w:gz') as tar:
+            for name in ['commands.json', '../outside', '/etc/absolute']:
+                info = tarfile.TarInfo(name)
+                info.size = 2
+                tar.addfile(info, io.BytesIO(b'{}'))
+            link = tarfile.TarInfo('var/log/syslog')
+            link.type = tarfile.SYMTYPE
+            link.linkname = '/etc/shadow'
+            tar.addfile(link)
+        targetDir = join(self.workDir, 'root')
+        os.makedirs(targetDir)
+        extract_snapshot(snapshotPath, targetDir)
+        self.assertEqual(get_files(targetDir), ['/commands.json'])
+        self.assertFalse(exists(join(self.workDir, 'outside')))
+
+    def test_parse_policy(self):
+        lines = ['nvidia-driver:', '  Installed: (none)', '  Candidate: 390.87-2']
+        self.assertEqual(parse_policy(lines), '')
+        self.assertEqual(parse_policy(lines, candidate=True), '390.87-2')
+
+    def test_read_dpkg_status(self):
+        statusPath = join(self.workDir, 'status')
+        with open(statusPath, 'w') as f:
+            f.write("Package: dkms\nStatus: install ok installed\nVersion: 2.3-2\n\n"
+                    "Package: bumblebee\nStatus: deinstall ok config-files\nVersion: 3.2.1-17\n")
+        self.assertEqual(read_dpkg_status(statusPath), {'dkms': '2.3-2'})
+
+
+if __name__ == '__main__':
+    unittest.main()
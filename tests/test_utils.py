@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from unittest import mock
+
+import utils
+
+
+class DmiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dmiDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dmiDir)
+
+    def write_dmi(self, **values):
+        for key, value in values.items():
+            with open(os.path.join(self.dmiDir, key), 'w') as f:
+                f.write(value + '\n')
+
+    def test_sysfs(self):
+        self.write_dmi(sys_vendor='innotek GmbH', product_name='VirtualBox')
+        dmi = utils.getDmiInfo(self.dmiDir)
+        self.assertEqual(dmi['sys_vendor'], 'innotek GmbH')
+        self.assertEqual(dmi['product_name'], 'VirtualBox')
+        # Missing files are empty strings
+        self.assertEqual(dmi['bios_version'], '')
+        self.assertEqual(utils.getHypervisor(self.dmiDir), 'VirtualBox')
+
+    def test_bare_metal(self):
+        self.write_dmi(sys_vendor='Dell Inc.', product_name='OptiPlex 7050', board_name='0NW6H5')
+        self.assertEqual(utils.getHypervisor(self.dmiDir), '')
+
+    def test_dmidecode_fallback(self):
+        output = ['BIOS Information', '\tVersion: VirtualBox',
+                  'System Information', '\tManufacturer: QEMU', '\tProduct Name: Standard PC (Q35 + ICH9, 2009)']
+        with mock.patch.object(utils, 'getoutput', return_value=output) as getoutput:
+            dmi = utils.getDmiInfo(os.path.join(self.dmiDir, 'missing'))
+        getoutput.assert_called_once()
+        self.assertEqual(dmi['sys_vendor'], 'QEMU')
+        self.assertEqual(dmi['product_name'], 'Standard PC (Q35 + ICH9, 2009)')
+        self.assertEqual(dmi['bios_version'], 'VirtualBox')
+
+
+# Clock for the TTL: utils.time.monotonic()
+class FakeTime(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class MemoizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def square(self, x, offset=0):
+        self.calls.append((x, offset))
+        return x * x + offset
+
+    def test_cache(self):
+        square = utils.memoize(self.square)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(3), 9)
+        # Keyword arguments are part of the key
+        self.assertEqual(square(3, offset=1), 10)
+        self.assertEqual(self.calls, [(3, 0), (3, 1)])
+        self.assertEqual(square.cache_info(), {'hits': 1, 'misses': 2, 'invalidations': 0, 'size': 2})
+        square.cache_clear()
+        square(3)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_lru(self):
+        square = utils.memoize(maxsize=2)(self.square)
+        square(1)
+        square(2)
+        # 1 is used again: 2 is the least recently used
+        square(1)
+        square(3)
+        self.assertEqual(square.cache_info()['size'], 2)
+        square(1)
+        square(2)
+        self.assertEqual(self.calls, [(1, 0), (2, 0), (3, 0), (2, 0)])
+
+    def test_ttl(self):
+        clock = FakeTime()
+        with mock.patch.object(utils, 'time', clock):
+            square = utils.memoize(ttl=60)(self.square)
+            square(2)
+            clock.now += 59
+            square(2)
+            self.assertEqual(len(self.calls), 1)
+            clock.now += 2
+            square(2)
+            self.assertEqual(len(self.calls), 2)
+
+    def test_invalidate(self):
+        with tempfile.NamedTemporaryFile() as f:
+            square = utils.memoize(invalidate=utils.mtimes(f.name))(self.square)
+            square(2)
+            square(2)
+            stat = os.stat(f.name)
+            os.utime(f.name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            square(2)
+            self.assertEqual(len(self.calls), 2)
+            self.assertEqual(square.cache_info()['invalidations'], 1)
+        # A missing file is a key too
+        self.assertEqual(utils.mtimes(f.name)(), (None,))
+
+    # Concurrent callers all get the result; a slow call does not block other arguments
+    def test_threads(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(x):
+            if x == 'slow':
+                started.set()
+                release.wait(5)
+            return x
+
+        slow = utils.memoize(slow)
+        thread = threading.Thread(target=slow, args=('slow',))
+        thread.start()
+        self.assertTrue(started.wait(5))
+        self.assertEqual(slow('fast'), 'fast')
+        release.set()
+        thread.join()
+        self.assertEqual(slow('slow'), 'slow')
+        self.assertEqual(slow.cache_info()['size'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
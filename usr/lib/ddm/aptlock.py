@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+# Wait until no other process holds the apt and dpkg locks
+#
+# The lock files are probed with fcntl(F_GETLK), which returns the process
+# holding the lock without taking it. While a lock is held the holder is
+# printed and probed again with an increasing delay (backoff). When the
+# holder is a local process its exit ends the wait at once (pidfd).
+#
+# Exit codes
+# 0 - The locks are free
+# 8 - The locks are still held after --max-wait seconds
+
+import os
+import sys
+import time
+import fcntl
+import struct
+import select
+import argparse
+
+LOCKS = ['/var/lib/dpkg/lock-frontend', '/var/lib/dpkg/lock',
+         '/var/lib/apt/lists/lock', '/var/cache/apt/archives/lock']
+# struct flock: l_type, l_whence, l_start, l_len, l_pid (padded by the kernel)
+FLOCK = 'hhqqi'
+FLOCK_SIZE = 64
+EXIT_FREE = 0
+EXIT_LOCKED = 8
+
+
+# Return the pid of the process that holds a lock file, 0 when it is free
+def get_lock_holder(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return 0
+    try:
+        probe = struct.pack(FLOCK, fcntl.F_WRLCK, os.SEEK_SET, 0, 0, 0).ljust(FLOCK_SIZE, b'\0')
+        result = fcntl.fcntl(fd, fcntl.F_GETLK, probe)
+        lockType, whence, start, length, pid = struct.unpack(FLOCK, result[:struct.calcsize(FLOCK)])
+    except OSError:
+        return 0
+    finally:
+        os.close(fd)
+    return pid if lockType != fcntl.F_UNLCK else 0
+
+
+# Return [(lock path, pid)] of the held locks
+def get_lock_holders(locks=LOCKS):
+    holders = []
+    for path in locks:
+        pid = get_lock_holder(path)
+        if pid:
+            holders.append((path, pid))
+    return holders
+
+
+def get_process_name(pid):
+    try:
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as f:
+            cmdline = f.read().replace(b'\0', b' ').decode('utf-8', errors='replace').strip()
+            return cmdline[:80] or str(pid)
+    except (IOError, OSError):
+        return str(pid)
+
+
+# Sleep until the process exits or the delay is over
+def wait_for_process(pid, delay):
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        time.sleep(delay)
+        return
+    try:
+        select.select([pidfd], [], [], delay)
+    finally:
+        os.close(pidfd)
+
+
+# Return True when the locks are free within maxWait seconds
+def wait_for_locks(maxWait, backoff=1, maxBackoff=10, locks=LOCKS, report=print):
+    start = time.monotonic()
+    delay = backoff
+    reported = None
+    while True:
+        holders = get_lock_holders(locks)
+        if not holders:
+            return True
+        waited = time.monotonic() - start
+        if waited >= maxWait:
+            return False
+        path, pid = holders[0]
+        if (path, pid) != reported:
+            report("Waiting for {} (pid {}) to release {}".format(get_process_name(pid), pid, path))
+            reported = (path, pid)
+        wait_for_process(pid, min(delay, maxWait - waited))
+        delay = min(delay * 2, maxBackoff)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wait for the apt and dpkg locks")
+    parser.add_argument('--max-wait', type=float, default=1800, help='Seconds to wait at most (default: 1800)')
+    parser.add_argument('--backoff', type=float, default=1, help='First delay between probes in seconds (default: 1)')
+    parser.add_argument('--max-backoff', type=float, default=10, help='Longest delay between probes in seconds (default: 10)')
+    args = parser.parse_args()
+
+    def report(message):
+        print(message)
+        sys.stdout.flush()
+
+    if wait_for_locks(args.max_wait, args.backoff, args.max_backoff, report=report):
+        return EXIT_FREE
+    return EXIT_LOCKED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
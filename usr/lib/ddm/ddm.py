@@ -5,17 +5,23 @@ import gi
 gi.require_version('Gtk', '3.0')
 
 # from gi.repository import Gtk, GdkPixbuf, GObject, Pango, Gdk, GLib
-from gi.repository import Gtk, GObject
+from gi.repository import Gtk, GLib, GdkPixbuf
 from os.path import join, abspath, dirname, basename, isdir
-from utils import ExecuteThreadedCommands, hasInternetConnection, \
-                  getoutput, getPackageVersion, has_backports, shell_exec
+from utils import getoutput, has_backports, shell_exec, logCacheStats
 import os
-import re
-from glob import glob
+import threading
 from dialogs import MessageDialog, WarningDialog, ErrorDialog, QuestionDialog
 from treeview import TreeViewHandler
-from queue import Queue
-from logger import Logger
+from concurrent.futures import CancelledError
+from executor import get_executor
+from patterns import DKMS_BUILD
+from preflight import Preflight, parse_arguments, get_report, ERROR
+from logger import Logger, tracer
+from hardware import HardwareDetector
+from hotplug import UeventMonitor
+
+# Milliseconds to wait for the other uevents of a hot-plugged device
+HOTPLUG_DELAY = 500
 
 # i18n: http://docs.python.org/3/library/gettext.html
 import gettext
@@ -26,9 +32,11 @@ gettext.textdomain('ddm')
 #class for the main window
 class DDM(object):
 
-    def __init__(self, test=False):
+    def __init__(self, test=False, replay=None, bus=None):
         # Testing
         self.test = test
+        # Snapshot to show instead of this system's hardware (--replay)
+        self.replay = replay
         # Set to true for testing Optimus
         self.test_optimus = False
 
@@ -46,6 +54,7 @@ class DDM(object):
         self.btnSave = go("btnSave")
         self.btnHelp = go("btnHelp")
         self.btnQuit = go("btnQuit")
+        self.btnCancel = go("btnCancel")
         self.pbDDM = go("pbDDM")
         self.chkBackports = go("chkBackports")
 
@@ -53,11 +62,15 @@ class DDM(object):
         self.btnSave.set_label(_("Install"))
         self.btnHelp.set_label(_("Help"))
         self.btnQuit.set_label(_("Quit"))
+        self.btnCancel.set_label(_("Cancel"))
         self.chkBackports.set_label(_("Use Backports"))
 
         # Initiate variables
-        self.queue = Queue(-1)
-        self.threads = {}
+        self.executor = get_executor()
+        self.commandFuture = None
+        # Results of the DKMS builds of the running command: {(module, kernel): status}
+        self.dkmsBuilds = {}
+        self.service = None
         self.hardware = []
         self.loadedDrivers = []
         self.notSupported = []
@@ -66,7 +79,21 @@ class DDM(object):
         self.helpFile = join(self.get_language_dir(), "help.html")
         log = getoutput("cat /usr/bin/ddm | grep 'LOG=' | cut -d'=' -f 2")
         self.logFile = log[0]
+        if not os.access(self.logFile if os.path.exists(self.logFile) else dirname(self.logFile), os.W_OK):
+            # Not root: the helper service logs the scan and the install
+            self.logFile = ''
         self.log = Logger(self.logFile, addLogTime=False, maxSizeKB=5120)
+        if self.replay:
+            from snapshot import ReplayDetector
+            self.detector = ReplayDetector(self.log, self.replay)
+            self.window.set_title("{} - {}".format(_("Device Driver Manager"), basename(self.replay)))
+        elif bus or os.geteuid() != 0:
+            # Not root: scan and install through the privileged helper service
+            from service import ServiceDetector, connect
+            self.detector = ServiceDetector(self.log, connect(bus))
+            self.service = self.detector
+        else:
+            self.detector = HardwareDetector(self.log, self.test, self.test_optimus)
         self.tvDDMHandler = TreeViewHandler(self.tvDDM)
         self.tvDDMHandler.connect('checkbox-toggled', self.tv_checkbox_toggled)
 
@@ -75,14 +102,25 @@ class DDM(object):
         self.window.show_all()
 
         # Fill treeview
+        tracer.reset()
         self.fill_treeview_ddm()
 
         # Check backports
-        if len(self.hardware) < 2 or not has_backports():
+        if not self.hardware or not has_backports():
             self.chkBackports.hide()
 
-        self.get_loaded_graphical_driver()
-        self.get_loaded_wireless_driver()
+        self.detector.get_loaded_graphical_driver()
+        self.detector.get_loaded_wireless_driver()
+
+        # Log where the time of the hardware scan went
+        tracer.finish(self.log)
+        logCacheStats(self.log)
+
+        # Rescan hot-plugged devices (not for snapshots)
+        self.hotplugMonitor = None
+        self.hotplugSlots = set()
+        if not self.replay:
+            self.start_hotplug_monitor()
 
     # ===============================================
     # Language specific functions
@@ -115,81 +153,90 @@ class DDM(object):
 
     def on_btnSave_clicked(self, widget):
         # Save selected hardware
-        arguments = []
+        changes = []
 
         model = self.tvDDM.get_model()
         itr = model.get_iter_first()
         while itr is not None:
-            action = 'no change'
             selected = model.get_value(itr, 0)
-            device = model.get_value(itr, 2)
-            manufacturerId = ''
+            hw = self.detector.hardwareIndex.get(model.get_value(itr, 3))
 
             # Check currently selected state with initial state
             # This decides whether we should install or purge the drivers
-            for hw in self.hardware:
-                self.log.write("Device = {} in {}".format(device, hw[2]), 'on_btnSave_clicked')
-                if device in hw[2]:
-                    manufacturerId = hw[4]
-                    if hw[0] and not selected:
-                        action = 'purge'
-                    elif not hw[0] and selected:
-                        action = 'install'
-                    break
-
-            self.log.write("{}: {} ({})".format(action, device, manufacturerId), 'on_btnSave_clicked')
-
-            # Install/purge selected driver
-            option = ""
-            if action == 'install':
-                option = "-i"
-            elif action == 'purge':
-                option = "-p"
-
-            if option:
-                driver = ''
-                # Run the manufacturer specific bash script
-                if manufacturerId == '1002':
-                    driver = 'ati'
-                elif manufacturerId == '10de':
-                    driver = 'nvidia '
-                elif manufacturerId == '14e4':
-                    driver = 'broadcom '
-                elif 'pae' in manufacturerId:
-                    driver = 'pae '
-                if driver:
-                    arguments.append("{} {}".format(option, driver))
+            if hw is not None:
+                changes.append((hw.selected, selected, hw.manufacturerId))
+                self.log.write("Selected: {} -> {}: {} ({})".format(hw.selected, selected, hw.description, hw.manufacturerId), 'on_btnSave_clicked')
 
             # Get the next in line
             itr = model.iter_next(itr)
 
-        # Execute the command
+        # Install/purge arguments for the changed drivers
+        arguments = self.detector.get_driver_rules().get_arguments(changes)
+
+        # Execute the command when the preflight check passes
         if arguments:
-            if '-i' in arguments and not hasInternetConnection():
-                title = _("No internet connection")
-                msg = _("You need an internet connection to install the additional software.\n"
-                        "Please, connect to the internet and try again.")
-                WarningDialog(title, msg)
-            else:
-                # Warn for use of Backports
-                if self.chkBackports.get_active():
-                    answer = QuestionDialog(self.chkBackports.get_label(),
-                            _("You have selected to install drivers from the backports repository whenever they are available.\n\n"
-                              "Although you can run more up to date software using the backports repository,\n"
-                              "you introduce a greater risk of breakage doing so.\n\n"
-                              "Are you sure you want to continue?"))
-                    if not answer:
-                        self.chkBackports.set_active(False)
-                        return True
-                    arguments.append("-b")
-
-                # Testing
-                if self.test:
-                    arguments.append("-t")
-
-                command = "ddm {}".format(" ".join(arguments))
-                self.log.write("Command to execute: {}".format(command), 'on_btnSave_clicked')
-                self.exec_command(command)
+            self.check_preflight(arguments, self.save_drivers)
+
+    def save_drivers(self, arguments):
+        # Warn for use of Backports
+        if self.chkBackports.get_active():
+            # Download the packages while the user answers the question
+            self.prefetch(arguments + ["-b"])
+            answer = QuestionDialog(self.chkBackports.get_label(),
+                    _("You have selected to install drivers from the backports repository whenever they are available.\n\n"
+                      "Although you can run more up to date software using the backports repository,\n"
+                      "you introduce a greater risk of breakage doing so.\n\n"
+                      "Are you sure you want to continue?"))
+            if not answer:
+                self.chkBackports.set_active(False)
+                return
+            arguments.append("-b")
+
+        # Testing
+        if self.test:
+            arguments.append("-t")
+
+        command = "ddm {}".format(" ".join(arguments))
+        self.log.write("Command to execute: {}".format(command), 'save_drivers')
+        if self.replay:
+            # Never change this system for the hardware of a snapshot
+            MessageDialog(_("Device Driver Manager"), command)
+            return
+        self.exec_command(arguments)
+
+    # Check whether the install can succeed, outside the main loop (up to preflight.DEADLINE)
+    # callback(arguments) is called in the main loop when nothing blocks the install
+    def check_preflight(self, arguments, callback):
+        install, purge = parse_arguments(arguments)
+        self.set_buttons_state(False)
+
+        def run():
+            results = Preflight(install, purge, self.test).run()
+            GLib.idle_add(self.on_preflight_done, arguments, results, callback)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # Block the install with the reason when a check failed
+    def on_preflight_done(self, arguments, results, callback):
+        self.set_buttons_state(True)
+        self.log.write("Preflight:\n{}".format(get_report(results)), 'check_preflight')
+        errors = [r.message for r in results if r.status == ERROR]
+        if errors:
+            ErrorDialog(self.btnSave.get_label(), "{}\n\n{}".format(_("The drivers cannot be installed:"), '\n'.join(errors)))
+        else:
+            callback(arguments)
+        # Only once (GLib.idle_add)
+        return False
+
+    # Download the packages of the drivers to install in the background (ddm -d)
+    # The backend waits for this download before it installs anything
+    def prefetch(self, arguments):
+        if not any(argument.startswith('-i') for argument in arguments):
+            return
+        if self.test:
+            arguments = arguments + ["-t"]
+        self.log.write("Prefetch: ddm -d {}".format(" ".join(arguments)), 'prefetch')
+        self.submit_backend(["-d"] + arguments)
 
     def on_btnQuit_clicked(self, widget):
         self.on_ddmWindow_destroy(widget)
@@ -200,25 +247,22 @@ class DDM(object):
 
     def get_supported_hardware(self):
         # Fill self.hardware
-        self.hardware = []
+        self.hardware = self.detector.get_supported_hardware()
+        self.notSupported = self.detector.notSupported
+        self.paeBooted = self.detector.paeBooted
 
-        # First row are column names
-        self.hardware.append([_("Install"), '', _("Device"), 'driver', 'manid', 'deviceid'])
-
-        # Get hardware information
-        self.get_ati()
-        self.get_nvidia()
-        self.get_broadcom()
-        self.get_pae()
+        # Show the warnings collected during the hardware scan
+        for title, msg in self.detector.warnings:
+            WarningDialog(title, msg)
 
     # This method is fired by the TreeView.checkbox-toggled event
     def tv_checkbox_toggled(self, obj, path, colNr, toggleValue):
         path = int(path)
         model = self.tvDDM.get_model()
         itr = model.get_iter(path)
-        description = model[itr][2].lower()
+        key = model[itr][3]
 
-        if 'pae' in description and not toggleValue and self.paeBooted:
+        if key == 'pae' and not toggleValue and self.paeBooted:
             title = _("Remove kernel")
             msg = _("You cannot remove a booted kernel.\nPlease, boot another kernel and try again.")
             self.log.write(msg, 'tv_checkbox_toggled')
@@ -229,43 +273,98 @@ class DDM(object):
         # Fill a list with supported hardware
         self.get_supported_hardware()
 
-        # columns: checkbox, image (logo), device, driver
-        columnTypes = ['bool', 'GdkPixbuf.Pixbuf', 'str']
+        # columns: checkbox, image (logo), device, key (hidden)
+        columnTypes = ['bool', 'GdkPixbuf.Pixbuf', 'str', 'str']
 
         # Keep some info from the user
-        showHw = []
+        showHw = [[_("Install"), '', _("Device"), 'key']]
         for hw in self.hardware:
-            showHw.append([hw[0], hw[1], hw[2]])
+            showHw.append([hw.selected, hw.logo, hw.description, hw.key])
 
         # Fill treeview
-        self.tvDDMHandler.fillTreeview(contentList=showHw, columnTypesList=columnTypes, firstItemIsColName=True, fontSize=12000)
+        with tracer.span('fillTreeview', 'treeview'):
+            self.tvDDMHandler.fillTreeview(contentList=showHw, columnTypesList=columnTypes, firstItemIsColName=True, fontSize=12000)
+        # The key is only used to find the hardware entry of a row
+        self.tvDDM.get_column(3).set_visible(False)
 
         # Show message if nothing is found or hardware is not supported
         title = _("Hardware scan")
         if self.notSupported:
-            if len(self.hardware) < 2:
+            if not self.hardware:
                 self.set_buttons_state(False)
             msg = _("There are no available drivers for your hardware:")
             msg = "{}\n\n{}".format(msg, '\n'.join(self.notSupported))
             self.log.write(msg, 'fill_treeview_ddm')
             WarningDialog(title, msg)
-        elif len(self.hardware) < 2:
+        elif not self.hardware:
             self.set_buttons_state(False)
             msg = _("DDM did not find any supported hardware.")
             self.log.write(msg, 'fill_treeview_ddm')
             MessageDialog(title, msg)
 
-    def exec_command(self, command):
+    # ===============================================
+    # Hot-plug
+    # ===============================================
+
+    # Watch the kernel uevents in the main loop
+    def start_hotplug_monitor(self):
+        monitor = UeventMonitor()
+        try:
+            monitor.open()
+        except (OSError, AttributeError) as detail:
+            self.log.write("Hot-plug not available: {}".format(detail), 'start_hotplug_monitor')
+            return
+        self.hotplugMonitor = monitor
+        GLib.io_add_watch(monitor.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self.on_uevent)
+
+    def on_uevent(self, fd, condition):
+        for event in self.hotplugMonitor.read_events():
+            self.log.write("Uevent: {} {} ({})".format(event.get('ACTION'), event['slot'], event['SUBSYSTEM']), 'on_uevent')
+            # A device sends several events (add, bind, net): rescan once
+            if not self.hotplugSlots:
+                GLib.timeout_add(HOTPLUG_DELAY, self.rescan_hotplug_devices)
+            self.hotplugSlots.add(event['slot'])
+        return True
+
+    def rescan_hotplug_devices(self):
+        tracer.reset()
+        slots = self.hotplugSlots
+        self.hotplugSlots = set()
+        for slot in slots:
+            self.update_treeview_row(slot, self.detector.scan_device(slot))
+        tracer.finish(self.log)
+        # Nothing to install when the last device is removed
+        self.set_buttons_state(bool(self.hardware))
+        return False
+
+    # Update, add or remove the row of a single device
+    def update_treeview_row(self, key, hw):
+        model = self.tvDDM.get_model()
+        itr = model.get_iter_first()
+        while itr is not None and model.get_value(itr, 3) != key:
+            itr = model.iter_next(itr)
+        if hw is None:
+            if itr is not None:
+                model.remove(itr)
+            return
+        self.log.write("Device updated: {} ({})".format(hw.description, hw.driver), 'update_treeview_row')
+        row = [hw.selected, GdkPixbuf.Pixbuf.new_from_file(hw.logo), hw.description, hw.key]
+        if itr is None:
+            # Default weight and font size of fill_treeview_ddm
+            model.append(row + [400, 12000])
+        else:
+            for column, value in enumerate(row):
+                model.set_value(itr, column, value)
+
+    def exec_command(self, arguments):
         try:
-            # Run the command in a separate thread
+            # The result comes back in the main loop
             self.set_buttons_state(False)
-            name = 'cmd'
-            t = ExecuteThreadedCommands([command], self.queue)
-            self.threads[name] = t
-            t.daemon = True
-            t.start()
-            self.queue.join()
-            GObject.timeout_add(250, self.check_thread, name)
+            self.btnCancel.show()
+            self.pbDDM.set_show_text(True)
+            self.dkmsBuilds = {}
+            self.commandFuture = self.submit_backend(arguments, self.on_command_done, self.on_command_output)
+            GLib.timeout_add(250, self.pulse_progress)
 
         except Exception as detail:
             ErrorDialog(self.btnSave.get_label(), detail)
@@ -279,356 +378,79 @@ class DDM(object):
             self.btnSave.set_sensitive(True)
             self.pbDDM.set_fraction(0)
 
-    def check_thread(self, name):
-        if self.threads[name].is_alive():
-            self.pbDDM.pulse()
-            if not self.queue.empty():
-                ret = self.queue.get()
-                self.log.write("Queue returns: {}".format(ret), 'check_thread')
-                self.queue.task_done()
-                self.show_message(ret)
-            return True
-
-        # Thread is done
-        self.log.write(">> Thread is done", 'check_thread')
-        if not self.queue.empty():
-            ret = self.queue.get()
-            self.queue.task_done()
-            self.show_message(ret)
-        del self.threads[name]
-
+    # Run the backend (ddm arguments): in the helper service when the GUI is not root
+    def submit_backend(self, arguments, callback=None, onLine=None):
+        if self.service is not None:
+            return self.service.submit(arguments, callback, onLine)
+        command = "ddm {}".format(" ".join(arguments))
+        return self.executor.submit(command, callback=callback, onLine=onLine, dispatch=GLib.idle_add)
+
+    def pulse_progress(self):
+        if self.commandFuture is None:
+            return False
+        self.pbDDM.pulse()
+        return True
+
+    # Show the last output line of the backend in the progress bar
+    def on_command_output(self, line):
+        line = line.strip()
+        if line:
+            self.pbDDM.set_text(line[:100])
+            matchObj = DKMS_BUILD.search(line)
+            if matchObj:
+                self.dkmsBuilds[(matchObj.group(1), matchObj.group(2))] = matchObj.group(3)
+
+    # Return the DKMS builds per kernel as text
+    def get_dkms_report(self):
+        lines = []
+        for (module, kernel), status in sorted(self.dkmsBuilds.items()):
+            status = _("built") if status == 'ok' else _("failed")
+            lines.append("{} ({}): {}".format(module, kernel, status))
+        if not lines:
+            return ''
+        return "\n\n{}\n{}".format(_("Kernel modules:"), '\n'.join(lines))
+
+    def on_command_done(self, future):
+        self.commandFuture = None
+        self.btnCancel.hide()
+        self.pbDDM.set_show_text(False)
         self.set_buttons_state(True)
-
-        return False
+        try:
+            result = future.result()
+        except CancelledError:
+            result = None
+        except Exception as detail:
+            ErrorDialog(self.btnSave.get_label(), detail)
+            return
+        if result is None or result.cancelled:
+            msg = _("The installation was cancelled.")
+            self.log.write(msg, 'on_command_done')
+            MessageDialog(self.btnSave.get_label(), msg)
+            return
+        self.show_message(result.returncode)
+
+    def on_btnCancel_clicked(self, widget):
+        if self.commandFuture is None:
+            return
+        answer = QuestionDialog(self.btnCancel.get_label(),
+                                _("Cancelling can leave the drivers partly installed.\n\n"
+                                  "Are you sure you want to cancel?"))
+        if answer:
+            self.log.write("Cancel: {}".format(self.commandFuture), 'on_btnCancel_clicked')
+            if self.service is not None:
+                self.service.cancel(self.commandFuture)
+            else:
+                self.executor.cancel(self.commandFuture)
 
     # Close the gui
     def on_ddmWindow_destroy(self, widget):
+        if self.hotplugMonitor is not None:
+            self.hotplugMonitor.close()
+        # Running commands are not killed: an install finishes before the process exits
+        self.executor.shutdown(wait=False)
         # Close the app
         Gtk.main_quit()
 
-    # ===============================================
-    # Hardware functions
-    # ===============================================
-
-    def get_ati(self):
-        # Debian Wiki: https://wiki.debian.org/ATIProprietary
-        # Supported devices 14.9 (Jessie): http://support.amd.com/en-us/kb-articles/Pages/AMDCatalyst14-9LINReleaseNotes.aspx
-
-        manufacturerId = '1002'
-        startSeries = 5000
-        deviceArray = self.get_lspci_info(manufacturerId, 'VGA')
-
-        if self.test:
-            #deviceArray = [['Advanced Micro Devices [AMD] nee ATI Manhattan [Mobility Radeon HD 5400 Series]', manufacturerId, '68e0']]
-            #deviceArray = [['Advanced Micro Devices, Inc. [AMD/ATI] RV710 [Radeon HD 4350/4550]', manufacturerId, '68e0']]
-            #deviceArray = [['Advanced Micro Devices [AMD/ATI] RS880 [Radeon HD 4290]', manufacturerId, '68e0']]
-            #deviceArray = [['Advanced Micro Devices, Inc. [AMD/ATI] Tonga PRO [Radeon R9 285]', manufacturerId, '6939']]
-            deviceArray = [['Advanced Micro Devices, Inc. [AMD/ATI] Bonaire [FirePro W5100]', manufacturerId, '6649']]
-
-        if deviceArray:
-            self.log.write("Device(s): {}".format(deviceArray), 'get_ati')
-            # Check if fglrx is loaded
-            # If it is: checkbox is selected
-            loadedDrv = self.get_loaded_graphical_driver()
-            self.log.write("Loaded graphical driver: {}".format(loadedDrv), 'get_ati')
-
-            # Get the manufacturer's logo
-            logo = join(self.mediaDir, 'images/ati.png')
-
-            # Fill the hardware array
-            for device in deviceArray:
-                self.log.write("ATI device found: {}".format(device[0]), 'get_ati')
-                # Check for supported cards
-                matchObj = re.search('radeon\s+[0-9a-z ]+|fire[a-z]+\s+[0-9a-z -]+', device[0], flags=re.IGNORECASE)
-                if matchObj:
-                    if " hd " in matchObj.group(0).lower():
-                        # Check if ATI series is above 5000
-                        matchObjSeries = re.search('[0-9]{4}', matchObj.group(0))
-                        if matchObjSeries:
-                            series = int(matchObjSeries.group(0))
-                            # Don't show older ATI Radeon HD cards
-                            if series < startSeries:
-                                break
-                    elif 'fire' in matchObj.group(0).lower():
-                        title = _("ATI FirePro/Gl card found")
-                        msg = _("Installing the proprietary driver for an ATI FirePro/Gl card may render your system unbootable.\n\n"
-                                "Proceed at your own risk.")
-                        self.log.write(msg, 'get_ati')
-                        WarningDialog(title, msg)
-
-                    self.log.write("ATI series: {}".format(matchObj.group(0)), 'get_ati')
-
-                    # Check if the available driver is already loaded
-                    selected = False
-                    driver = 'fglrx'
-                    if loadedDrv == driver:
-                        selected = True
-
-                    # Fill self.hardware
-                    #shortDevice = self.shorten_long_string(device[0], 100)
-                    self.hardware.append([selected, logo, device[0], driver, device[1], device[2]])
-                else:
-                    self.notSupported.append(device[0])
-
-    def get_nvidia(self):
-        manufacturerId = '10de'
-        deviceArray = self.get_lspci_info(manufacturerId, 'VGA')
-
-        if self.test:
-            deviceArray = [['NVIDIA Corporation GT218 [GeForce G210M]', manufacturerId, '0a74']]
-            if self.test_optimus:
-                deviceArray = [['Intel Corporation Haswell-ULT Integrated Graphics Controller', '8086', '0a16'], \
-                                ['NVIDIA Corporation GK107M [GeForce GT 750M]', manufacturerId, '0fe4']]
-
-        if deviceArray:
-            optimus = False
-            devices = []
-
-            self.log.write("Device(s): {}".format(deviceArray), 'get_nvidia')
-
-            # Check if nvidia is loaded
-            # If it is: checkbox is selected
-            loadedDrv = self.get_loaded_graphical_driver()
-            self.log.write("Loaded graphical driver: {}".format(loadedDrv), 'get_nvidia')
-
-            # Get the manufacturer's logo
-            logo = join(self.mediaDir, 'images/nvidia.png')
-
-            # Fill the hardware array
-            for device in deviceArray:
-                if device[1] == '8086':
-                    optimus = True
-                else:
-                    devices.append(device)
-
-            for device in devices:
-                self.log.write("Nvidia device found: {}".format(device[0]), 'get_nvidia')
-                optimusString = ""
-                if optimus:
-                    optimusString = "(Optimus) "
-
-                # Check if the available driver is already loaded
-                selected = False
-                if optimus:
-                    if loadedDrv == 'nvidia' or loadedDrv == 'intel':
-                        bbversion = getPackageVersion("bumblebee-nvidia")
-                        self.log.write("bumblebee-nvidia version: {}".format(bbversion), 'get_nvidia')
-                        if bbversion != '':
-                            selected = True
-                elif loadedDrv == 'nvidia':
-                    selected = True
-
-                driver = ""
-                if optimus:
-                    driver = "bumblebee-nvidia"
-                else:
-                    if self.test:
-                        driver = 'nvidia-driver'
-                    else:
-                        nvidiaDetect = getoutput("nvidia-detect | grep nvidia- | tr -d ' '")
-                        if nvidiaDetect:
-                            driver = nvidiaDetect[0]
-
-                self.log.write("Nvidia driver to use: {}".format(driver), 'get_nvidia')
-
-                # Fill self.hardware
-                if driver != "":
-                    #shortDevice = "{0}{1}".format(optimusString, self.shorten_long_string(device[0], 100))
-                    self.hardware.append([selected, logo, "{0}{1}".format(optimusString, device[0]), driver, device[1], device[2]])
-
-    def get_broadcom_ids(self, driver_name):
-        driver_name = driver_name.upper()
-        ids = getoutput("cat /usr/bin/ddm | grep '{}=' | cut -d'=' -f 2".format(driver_name))
-        if len(ids) > 0:
-            return ids[0].split('|')
-        return []
-
-    def get_broadcom(self):
-        ## Hardware list (device ids)
-        ## http://linuxwireless.org/en/users/Drivers/b43
-        deviceIds = {}
-        deviceIds['b43'] = self.get_broadcom_ids('b43')
-        deviceIds['b43legacy'] = self.get_broadcom_ids('b43legacy')
-        deviceIds['wldebian'] = self.get_broadcom_ids('wldebian')
-        deviceIds['brcmdebian'] = self.get_broadcom_ids('brcmdebian')
-        deviceIds['unknown'] = self.get_broadcom_ids('unknown')
-
-        self.log.write("Broadcom deviceIds = {}".format(deviceIds))
-
-        manufacturerId = '14e4'
-
-        deviceArray = self.get_lspci_info(manufacturerId)
-
-        if self.test:
-            deviceArray = [['Broadcom Corporation BCM43142 802.11a/b/g', manufacturerId, '4365']]
-
-        if deviceArray:
-            self.log.write("Device(s): {}".format(deviceArray), 'get_broadcom')
-            # Check if broadcom is loaded
-            # If it is: checkbox is selected
-            loadedDrv = self.get_loaded_wireless_driver()
-            self.log.write("Loaded wireless driver: {}".format(loadedDrv), 'get_broadcom')
-
-            # Get the manufacturer's logo
-            logo = join(self.mediaDir, 'images/broadcom.png')
-
-            # Fill the hardware array
-            for device in deviceArray:
-                self.log.write("Broadcom device found: {}".format(device[0]), 'get_broadcom')
-                driver = ''
-                for key, did in list(deviceIds.items()):
-                    #print(("{}:{} in {}:{}".format(device[0], device[2], key, did)))
-                    if device[2] in did:
-                        driver = key
-                        break
-
-                if driver != '':
-                    if driver == 'unknown':
-                        self.notSupported.append(device[0])
-                        self.log.write("Broadcom device not supported: {}".format(device[0]), 'get_broadcom')
-                    else:
-                        self.log.write("Broadcom driver to use: {}".format(driver), 'get_broadcom')
-                        # Check if the available driver is already loaded
-                        selected = False
-                        if loadedDrv == driver:
-                            selected = True
-
-                        # Fill self.hardware
-                        #shortDevice = self.shorten_long_string(device[0], 100)
-                        self.hardware.append([selected, logo, device[0], driver, device[1], device[2]])
-
-    def get_pae(self):
-        machine = getoutput('uname -m')[0]
-        release = getoutput('uname -r')[0]
-
-        if self.test:
-            machine = 'i686'
-            release = '3.16.0-4-586'
-
-        self.log.write("PAE check: machine={} / release={}".format(machine, release), 'get_pae')
-
-        if machine == 'i686':
-            # Check if PAE is installed and running
-            selected = False
-            if 'pae' in release:
-                self.paeBooted = True
-                selected = True
-            else:
-                if getPackageVersion('linux-image-686-pae') != '':
-                    selected = True
-
-            # Get the logo
-            logo = join(self.mediaDir, 'images/pae.png')
-
-            # Fill self.hardware
-            paeDescription = _("PAE capable system")
-            self.hardware.append([selected, logo, paeDescription, '', 'pae', ''])
-
-    def get_lspci_info(self, manufacturerId, filterString=''):
-        deviceArray = []
-        output = []
-
-        # Check for Optimus
-        if manufacturerId == '10de':
-            output = getoutput("lspci -vnn | grep '\[030[02]\]'")
-
-            if self.test_optimus:
-                output = ['00:02.0 VGA compatible controller [0300]: Intel Corporation Haswell-ULT Integrated Graphics Controller [8086:0a16] (rev 09) (prog-if 00 [VGA controller])', \
-                          '01:00.0 3D controller [0302]: NVIDIA Corporation GK107M [GeForce GT 750M] [10de:0fe4] (rev a1)']
-
-        # Optimus will return 2 devices
-        # If there are less than 2 devices, do regular check
-        if len(output) < 2:
-            if filterString != '':
-                filterString = " | grep {}".format(filterString)
-            output = getoutput("lspci -nn -d {}:{}".format(manufacturerId, filterString))
-
-        if output:
-            self.log.write("lspci output = {}".format(output), 'get_lspci_info')
-
-        for line in output:
-            matchObj = re.search(':\W(.*)\W\[(.+):(.+)\]', line)
-            if matchObj:
-                deviceArray.append([matchObj.group(1), matchObj.group(2), matchObj.group(3)])
-        return deviceArray
-
-    def shorten_long_string(self, longString, charLen, breakOnWord=True):
-        tmpArr = []
-        if breakOnWord:
-            stringArr = longString.split(' ')
-            nrChrs = 0
-            for s in stringArr:
-                nrChrs += len(s) + 1
-                if nrChrs < charLen:
-                    tmpArr.append(s)
-                else:
-                    break
-        else:
-            if len(longString) > charLen:
-                tmpArr.append("{}...".format(longString[0:charLen]))
-            else:
-                tmpArr.append(longString)
-        return ' '.join(tmpArr)
-
-    # Return graphics module used by X.org
-    # TODO: is lsmod an alternative?
-    def get_loaded_graphical_driver(self):
-        # sort on the most recent X.org log
-        module = ''
-        log = ''
-        logDir = '/var/log/'
-        logPath = None
-        logs = glob(os.path.join(logDir, 'Xorg.*.log*'))
-        logs.sort()
-
-        for logPath in logs:
-            # Search for "depth" in each line and check the used module
-            # Sometimes these logs are saved as binary: open as read-only binary
-            # When opening as ascii, read() will throw error: "UnicodeDecodeError: 'utf-8' codec can't decode byte 0x80"
-            with open(logPath, 'rb') as f:
-                # replace utf-8 binary read errors (with ?)
-                log = f.read().decode(encoding='utf-8', errors='replace')
-                #print((log))
-
-            matchObj = re.search('([a-zA-Z]*)\(\d+\):\s+depth.*framebuffer', log, flags=re.IGNORECASE)
-            if matchObj:
-                module = matchObj.group(1).lower()
-                self.log.write("Log module={}".format(module))
-                break
-
-        return module
-
-    # Return used wireless driver
-    def get_loaded_wireless_driver(self):
-        driver = ''
-        logDir = '/var/log/'
-        for logPath in glob(os.path.join(logDir, 'syslog*')):
-            if driver == '' and not 'gz' in logPath:
-                # Open the log file
-                lines = []
-                with open(logPath, 'rb') as f:
-                    log = f.read().decode(encoding='utf-8', errors='replace')
-                    lines = list(log.splitlines())
-
-                for line in reversed(lines):
-                    # First check for Network Manager entry
-                    # Search for wlan0 in each line and get the listed driver
-                    matchObj = re.search('\(wlan\d\):.*driver:\s*\'([a-zA-Z0-9\-]*)', line, flags=re.IGNORECASE)
-                    if matchObj:
-                        driver = matchObj.group(1)
-                        self.log.write("Network Manager driver={}".format(driver))
-                        break
-                    else:
-                        # Wicd
-                        # Search for ieee in each line and get the listed driver
-                        matchObj = re.search('ieee.*implement', line, flags=re.IGNORECASE)
-                        if matchObj:
-                            driver = matchObj.group(0)
-                            self.log.write("Wicd driver={}".format(driver))
-                            break
-
-        return driver
-
     def show_message(self, cmdOutput):
         try:
             self.log.write("Command output: {}".format(cmdOutput), 'show_message')
@@ -648,14 +470,20 @@ class DDM(object):
                     ErrorDialog(self.btnSave.get_label(), _("DDM cannot purge the driver."))
                 elif ret == 7:
                     ErrorDialog(self.btnSave.get_label(), _("This card is not supported."))
+                elif ret == 9:
+                    ErrorDialog(self.btnSave.get_label(), _("The preflight check failed.\n"
+                                                            "Please, check the log for the reason."))
+                elif ret == 8:
+                    ErrorDialog(self.btnSave.get_label(), _("Another program is installing software.\n"
+                                                            "Please, try again when it is done."))
                 else:
                     msg = _("There was an error during the installation.\n"
                     "Please, run 'sudo apt-get -f install' in a terminal.\n"
                     "Visit our forum for support: http://forums.solydxk.com")
-                    ErrorDialog(self.btnSave.get_label(), msg)
+                    ErrorDialog(self.btnSave.get_label(), msg + self.get_dkms_report())
             else:
                 msg = _("The software has been successfully installed.")
                 msg_restart = _("You will need to restart your system.")
-                MessageDialog(self.btnSave.get_label(), "{}\n\n{}".format(msg, msg_restart))
+                MessageDialog(self.btnSave.get_label(), "{}\n\n{}{}".format(msg, msg_restart, self.get_dkms_report()))
         except:
             ErrorDialog(self.btnSave.get_label(), cmdOutput)
@@ -0,0 +1,169 @@
+#! /usr/bin/env python3
+
+# Build the modules of DKMS packages for all installed kernels at the same time
+#
+# The DKMS source is taken from the packages before they are installed. Every
+# kernel is built in its own DKMS tree, so builds of the same module do not
+# share a build directory. At most one build per CPU runs at a time and the
+# CPUs are divided between the builds for make (dkms -j).
+#
+# The builds are loaded into the DKMS tree as binaries-only tarballs (like the
+# module cache of /usr/bin/ddm): the package's DKMS postinst then finds the
+# module built and only installs it.
+#
+# Every build prints a line (see DKMS_BUILD in patterns.py):
+#   DKMS build nvidia-current/390.87 for 4.9.0-8-amd64: ok (41 s)
+#
+# Usage: dkmsbuild.py [-j CPUS] package.deb...
+#
+# Exit codes
+# 0 - All modules are built
+# 1 - One or more builds failed: the package's postinst tries again
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from glob import glob
+from os.path import join, basename, dirname, isdir
+from shlex import quote
+from subprocess import run, DEVNULL, PIPE
+from executor import CommandExecutor
+
+MODULES_DIR = '/lib/modules'
+# Output lines of a failed build written to the log
+FAILED_LINES = 20
+EXIT_OK = 0
+EXIT_FAILED = 1
+
+
+# A module to build for a kernel
+class DkmsBuild(object):
+    __slots__ = ('module', 'version', 'kernel', 'sourceTree', 'tree', 'archive', 'ok')
+
+    def __init__(self, module, version, kernel, sourceTree, workDir):
+        self.module = module
+        self.version = version
+        self.kernel = kernel
+        self.sourceTree = sourceTree
+        name = "{}-{}-{}".format(module, version, kernel)
+        self.tree = join(workDir, 'dkms', name)
+        self.archive = join(workDir, name + '.tar.gz')
+        self.ok = False
+
+    def get_command(self, makeJobs):
+        options = "-m {} -v {} --dkmstree {} --sourcetree {}".format(
+            quote(self.module), quote(self.version), quote(self.tree), quote(self.sourceTree))
+        return ("mkdir -p {tree} && dkms add {options} && "
+                "dkms build {options} -k {kernel} -j {jobs} && "
+                "dkms mktarball {options} -k {kernel} --binaries-only --archive={archive}").format(
+                    tree=quote(self.tree), options=options, kernel=quote(self.kernel),
+                    jobs=makeJobs, archive=quote(self.archive))
+
+
+# Return the kernel releases that have headers to build modules with
+def get_kernels():
+    return sorted(basename(path) for path in glob(join(MODULES_DIR, '*')) if isdir(join(path, 'build')))
+
+
+# Unpack a package and return [(module, version, source tree)] of its DKMS sources
+def extract_sources(deb, workDir):
+    target = tempfile.mkdtemp(dir=workDir)
+    if run(['dpkg-deb', '-x', deb, target], stdout=DEVNULL, stderr=DEVNULL).returncode != 0:
+        return []
+    sources = []
+    sourceTree = join(target, 'usr', 'src')
+    for conf in glob(join(sourceTree, '*', 'dkms.conf')):
+        # /usr/src/<module>-<version>/dkms.conf
+        module, _, version = basename(dirname(conf)).rpartition('-')
+        if module:
+            sources.append((module, version, sourceTree))
+    return sources
+
+
+# The module is already built or installed in the DKMS tree (e.g. from the module cache)
+def is_built(module, version, kernel):
+    result = run(['dkms', 'status', '-m', module, '-v', version, '-k', kernel],
+                 stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+    return 'built' in result.stdout or 'installed' in result.stdout
+
+
+# Build all modules for all kernels: returns the DkmsBuilds
+def build_all(debs, workDir, cpus):
+    builds = []
+    kernels = get_kernels()
+    for deb in debs:
+        for module, version, sourceTree in extract_sources(deb, workDir):
+            for kernel in kernels:
+                if is_built(module, version, kernel):
+                    print("DKMS build {}/{} for {}: ok (already built)".format(module, version, kernel))
+                else:
+                    builds.append(DkmsBuild(module, version, kernel, sourceTree, workDir))
+    if not builds:
+        return builds
+
+    workers = min(len(builds), cpus)
+    makeJobs = max(1, cpus // workers)
+    print("DKMS: {} builds, {} at a time with make -j{}".format(len(builds), workers, makeJobs))
+    sys.stdout.flush()
+    printLock = threading.Lock()
+    executor = CommandExecutor(maxWorkers=workers)
+
+    def report(build, future):
+        result = future.result()
+        build.ok = result.returncode == 0
+        with printLock:
+            status = 'ok' if build.ok else 'failed'
+            print("DKMS build {}/{} for {}: {} ({:.0f} s)".format(build.module, build.version, build.kernel,
+                                                                  status, result.seconds))
+            if not build.ok:
+                print('\n'.join(result.output[-FAILED_LINES:]))
+            sys.stdout.flush()
+
+    for build in builds:
+        executor.submit(build.get_command(makeJobs), callback=lambda f, b=build: report(b, f))
+    executor.shutdown(wait=True)
+    return builds
+
+
+# Load the builds into the DKMS tree, one at a time
+def load_builds(builds):
+    for build in builds:
+        if build.ok:
+            result = run(['dkms', 'ldtarball', '--archive={}'.format(build.archive)],
+                         stdin=DEVNULL, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+            if result.returncode != 0:
+                build.ok = False
+                print("DKMS build {}/{} for {}: failed to load: {}".format(build.module, build.version, build.kernel,
+                                                                          result.stderr.strip()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build DKMS modules for all installed kernels")
+    parser.add_argument('-j', '--cpus', type=int, default=os.cpu_count() or 1, help='CPUs to use (default: all)')
+    parser.add_argument('debs', nargs='+', help='DKMS packages')
+    args = parser.parse_args()
+
+    if shutil.which('dkms') is None:
+        print("DKMS: dkms is not installed")
+        return EXIT_FAILED
+    workDir = tempfile.mkdtemp(prefix='ddm-dkms.')
+    try:
+        start = time.monotonic()
+        builds = build_all(args.debs, workDir, max(1, args.cpus))
+        load_builds(builds)
+        failed = [b for b in builds if not b.ok]
+        if builds:
+            print("DKMS: {} of {} builds ok in {:.0f} s".format(len(builds) - len(failed), len(builds),
+                                                              time.monotonic() - start))
+        sys.stdout.flush()
+        return EXIT_FAILED if failed else EXIT_OK
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#! /usr/bin/env python3
+
+import re
+from patterns import ATI_CARD
+
+# i18n: http://docs.python.org/3/library/gettext.html
+import gettext
+from gettext import gettext as _
+gettext.textdomain('ddm')
+
+# PCI classes
+VGA = '0300'
+DISPLAY_3D = '0302'
+
+# Declarative driver rules
+# Adding support for hardware means adding a rule, not code.
+#
+# vendor:    PCI manufacturer id (required)
+# classes:   PCI class ids the device must have (default: any class)
+# devices:   device ids, or the name of a device id list in the backend script (/usr/bin/ddm)
+# ranges:    device id ranges: [('0a60', '0a7f')]
+# names:     regular expression the device description must match
+# minSeries: lowest Radeon HD series that is supported (older HD cards are not listed)
+# warning:   (names, title, message): warn the user when the description matches names
+# driver:    driver shown to the user
+# package:   package that is installed with the driver (default: driver)
+# resolver:  HardwareDetector method that returns the driver (e.g. nvidia-detect)
+# backend:   driver argument of the backend: ddm -i <backend>
+# logo:      image in /usr/share/ddm/images
+# loaded:    'graphical' or 'wireless': which loaded driver to compare with module
+# module:    loaded module when the driver is in use
+# supported: False: list matching devices as not supported
+#
+# Rules with device ids or ranges are checked first, then the rules for the
+# device's class and finally the rules without classes, each in table order.
+RULES = [
+    # ATI/AMD
+    # Debian Wiki: https://wiki.debian.org/ATIProprietary
+    # Supported devices 14.9 (Jessie): http://support.amd.com/en-us/kb-articles/Pages/AMDCatalyst14-9LINReleaseNotes.aspx
+    {'vendor': '1002', 'classes': [VGA],
+     'names': ATI_CARD.pattern, 'minSeries': 5000,
+     'warning': ('fire', _("ATI FirePro/Gl card found"),
+                 _("Installing the proprietary driver for an ATI FirePro/Gl card may render your system unbootable.\n\n"
+                   "Proceed at your own risk.")),
+     'driver': 'fglrx', 'package': 'fglrx-driver', 'backend': 'ati', 'logo': 'ati.png',
+     'loaded': 'graphical', 'module': 'fglrx'},
+    {'vendor': '1002', 'classes': [VGA], 'supported': False},
+
+    # Nvidia
+    {'vendor': '10de', 'classes': [VGA, DISPLAY_3D],
+     'resolver': 'get_nvidia_driver', 'backend': 'nvidia', 'logo': 'nvidia.png',
+     'loaded': 'graphical', 'module': 'nvidia'},
+
+    # Broadcom
+    # Hardware list (device ids): http://linuxwireless.org/en/users/Drivers/b43
+    {'vendor': '14e4', 'devices': 'B43', 'driver': 'b43', 'package': 'firmware-b43-installer',
+     'backend': 'broadcom', 'logo': 'broadcom.png', 'loaded': 'wireless', 'module': 'b43'},
+    {'vendor': '14e4', 'devices': 'B43LEGACY', 'driver': 'b43legacy', 'package': 'firmware-b43legacy-installer',
+     'backend': 'broadcom', 'logo': 'broadcom.png', 'loaded': 'wireless', 'module': 'b43legacy'},
+    {'vendor': '14e4', 'devices': 'WLDEBIAN', 'driver': 'wldebian', 'package': 'broadcom-sta-dkms',
+     'backend': 'broadcom', 'logo': 'broadcom.png', 'loaded': 'wireless', 'module': 'wl'},
+    {'vendor': '14e4', 'devices': 'BRCMDEBIAN', 'driver': 'brcmdebian', 'package': 'firmware-brcm80211',
+     'backend': 'broadcom', 'logo': 'broadcom.png', 'loaded': 'wireless', 'module': 'brcmsmac'},
+    {'vendor': '14e4', 'devices': 'UNKNOWN', 'supported': False},
+]
+
+# Backend arguments for hardware that is not on the PCI bus
+OTHER_BACKENDS = {'pae': 'pae'}
+
+
+# Compiled rule table: an index on (vendor, device id) and (vendor, class)
+class DriverRules(object):
+
+    def __init__(self, rules=RULES, idLists=None):
+        idLists = idLists or {}
+        self.byDevice = {}
+        self.byClass = {}
+        self.packages = {}
+        self.backends = dict(OTHER_BACKENDS)
+        for rule in rules:
+            rule = self.compile_rule(rule, idLists)
+            if rule['driver'] and rule['package']:
+                self.packages[rule['driver']] = rule['package']
+            if rule['backend']:
+                self.backends[rule['vendor']] = rule['backend']
+            if rule['devices']:
+                for deviceId in rule['devices']:
+                    # First rule wins
+                    self.byDevice.setdefault((rule['vendor'], deviceId), rule)
+            else:
+                for cls in rule['classes'] or [None]:
+                    self.byClass.setdefault((rule['vendor'], cls), []).append(rule)
+
+    def compile_rule(self, rule, idLists):
+        rule = dict(rule)
+        devices = rule.get('devices', [])
+        if isinstance(devices, str):
+            # Name of a device id list in the backend script: |4307|4311|
+            devices = idLists.get(devices, '').split('|')
+        devices = [d.lower() for d in devices if d]
+        for first, last in rule.get('ranges', []):
+            devices.extend('{:04x}'.format(i) for i in range(int(first, 16), int(last, 16) + 1))
+        rule['devices'] = devices
+        rule['classes'] = rule.get('classes', [])
+        if rule.get('names'):
+            rule['names'] = re.compile(rule['names'], re.IGNORECASE)
+        warning = rule.get('warning')
+        if warning:
+            rule['warning'] = (re.compile(warning[0], re.IGNORECASE), warning[1], warning[2])
+        for key in ['names', 'minSeries', 'warning', 'driver', 'package', 'resolver',
+                    'backend', 'logo', 'loaded', 'module']:
+            rule.setdefault(key, None)
+        rule.setdefault('supported', True)
+        return rule
+
+    # Return the first matching rule and the match object of its names pattern
+    # device: [description, manufacturer id, device id, class id]
+    def match(self, device):
+        description, vendor, deviceId, cls = device[:4]
+        rule = self.byDevice.get((vendor, deviceId))
+        if rule is not None and (not rule['classes'] or cls in rule['classes']):
+            return rule, None
+        for rule in self.byClass.get((vendor, cls), []) + self.byClass.get((vendor, None), []):
+            if rule['names'] is None:
+                return rule, None
+            matchObj = rule['names'].search(description)
+            if matchObj:
+                return rule, matchObj
+        return None, None
+
+    # Return the backend argument for a manufacturer id
+    def get_backend(self, manufacturerId):
+        return self.backends.get(manufacturerId, '')
+
+    # Return the package that is installed with a driver
+    # Resolved drivers (Nvidia) are package names themselves
+    def get_package(self, driver):
+        return self.packages.get(driver, driver)
+
+    # Return the backend arguments to get from the current to the wanted state
+    # changes: [(current state, wanted state, manufacturer id)]
+    def get_arguments(self, changes):
+        arguments = []
+        for current, wanted, manufacturerId in changes:
+            option = ''
+            if current and not wanted:
+                option = '-p'
+            elif not current and wanted:
+                option = '-i'
+            if option:
+                # Backend argument for the manufacturer: ati, nvidia, broadcom or pae
+                driver = self.get_backend(manufacturerId)
+                argument = "{} {}".format(option, driver)
+                if driver and argument not in arguments:
+                    arguments.append(argument)
+        return arguments
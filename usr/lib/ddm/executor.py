@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+
+# Shared executor for shell commands
+#
+# Commands run on a bounded pool of worker threads and every command gets a
+# future with a CommandResult. Each command runs in its own process group, so
+# a timeout or cancel kills the whole pipeline (ddm -> apt-get -> dpkg).
+#
+# Callbacks are called through dispatch: pass GLib.idle_add to get them on
+# the GLib main loop.
+
+import os
+import time
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from logger import tracer
+
+MAX_WORKERS = 4
+# Seconds between SIGTERM and SIGKILL
+KILL_DELAY = 5
+
+
+# The outcome of a command
+class CommandResult(object):
+    __slots__ = ('command', 'returncode', 'output', 'timedOut', 'cancelled', 'seconds')
+
+    def __init__(self, command, returncode=None, output=None, timedOut=False, cancelled=False, seconds=0):
+        self.command = command
+        self.returncode = returncode
+        self.output = output or []
+        self.timedOut = timedOut
+        self.cancelled = cancelled
+        # Run time of the command (not the time it waited for a worker)
+        self.seconds = seconds
+
+
+# A submitted command and its running process
+class CommandJob(object):
+
+    def __init__(self, command, timeout, onLine, dispatch):
+        self.command = command
+        self.timeout = timeout
+        self.onLine = onLine
+        self.dispatch = dispatch
+        self.process = None
+        self.timedOut = False
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+
+class CommandExecutor(object):
+
+    def __init__(self, maxWorkers=MAX_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=maxWorkers)
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    # Run a command; returns a future with a CommandResult
+    # timeout:  seconds before the command is killed
+    # callback: called with the future when the command is done
+    # onLine:   called with every output line (stdout and stderr)
+    # dispatch: calls the callbacks, e.g. GLib.idle_add (default: directly, in the worker thread)
+    def submit(self, command, timeout=None, callback=None, onLine=None, dispatch=None):
+        dispatch = dispatch or call
+        job = CommandJob(command, timeout, onLine, dispatch)
+        future = self.pool.submit(self.run, job)
+        with self.lock:
+            self.jobs[future] = job
+        future.add_done_callback(self.forget)
+        if callback is not None:
+            future.add_done_callback(lambda f: dispatch(callback, f))
+        return future
+
+    # Call a function on a worker thread; returns its future
+    # callback: called with the future when the function is done (through dispatch)
+    def submit_call(self, func, *args, callback=None, dispatch=None):
+        dispatch = dispatch or call
+        future = self.pool.submit(func, *args)
+        if callback is not None:
+            future.add_done_callback(lambda f: dispatch(callback, f))
+        return future
+
+    # Run independent commands, at most maxWorkers at a time
+    # Returns the CommandResults in the order of the commands
+    def map(self, commands, timeout=None):
+        futures = [self.submit(command, timeout) for command in commands]
+        return [future.result() for future in futures]
+
+    # Cancel a command that is waiting or kill the process group of a running command
+    def cancel(self, future):
+        if future.cancel():
+            return True
+        with self.lock:
+            job = self.jobs.get(future)
+        if job is None:
+            return False
+        job.cancelled = True
+        self.kill(job)
+        return True
+
+    def cancel_all(self):
+        with self.lock:
+            futures = list(self.jobs)
+        for future in futures:
+            self.cancel(future)
+
+    # cancel: also kill the running commands
+    def shutdown(self, wait=True, cancel=False):
+        if cancel:
+            self.cancel_all()
+        self.pool.shutdown(wait=wait)
+
+    def forget(self, future):
+        with self.lock:
+            self.jobs.pop(future, None)
+
+    def run(self, job):
+        output = []
+        with tracer.span(job.command, 'executor') as span:
+            span.forks += 1
+            with job.lock:
+                if job.cancelled:
+                    return CommandResult(job.command, cancelled=True)
+                # New session: the command is the leader of its own process group
+                start = time.monotonic()
+                job.process = subprocess.Popen(job.command, shell=True, stdout=subprocess.PIPE,
+                                               stderr=subprocess.STDOUT, start_new_session=True)
+            timer = None
+            if job.timeout is not None:
+                timer = threading.Timer(job.timeout, self.on_timeout, (job,))
+                timer.daemon = True
+                timer.start()
+            try:
+                for line in job.process.stdout:
+                    span.bytesRead += len(line)
+                    line = line.decode('utf-8', errors='replace').rstrip('\n')
+                    output.append(line)
+                    if job.onLine is not None:
+                        job.dispatch(job.onLine, line)
+                returncode = job.process.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                job.process.stdout.close()
+        return CommandResult(job.command, returncode, output, job.timedOut, job.cancelled,
+                             time.monotonic() - start)
+
+    def on_timeout(self, job):
+        job.timedOut = True
+        self.kill(job)
+
+    # SIGTERM the process group, SIGKILL when it is still running after KILL_DELAY
+    def kill(self, job):
+        with job.lock:
+            process = job.process
+        if process is None or process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            return
+        timer = threading.Timer(KILL_DELAY, self.force_kill, (process,))
+        timer.daemon = True
+        timer.start()
+
+    # Also when the leader is gone: its children may still run in the process group
+    def force_kill(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def call(func, *args):
+    func(*args)
+
+
+_executor = None
+_executorLock = threading.Lock()
+
+
+# Return the executor shared by the whole process
+def get_executor():
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = CommandExecutor()
+        return _executor
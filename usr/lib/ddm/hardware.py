@@ -0,0 +1,360 @@
+#! /usr/bin/env python3
+
+from os.path import join, abspath, dirname, isdir
+from drivers import DriverRules, VGA, DISPLAY_3D
+from nvidia import NvidiaResolver, CACHE_PATH
+from utils import getoutput, getPackageVersion, get_config_dict, getHypervisor
+from logger import tracer
+from journal import WIRELESS_COMMS, get_journal_command, get_message
+from logsearch import LogSearch
+import os
+from glob import glob
+from shlex import quote
+from patterns import LSPCI_DEVICE, ATI_SERIES, XORG_MODULE, WIRELESS_DRIVER
+
+# i18n: http://docs.python.org/3/library/gettext.html
+import gettext
+from gettext import gettext as _
+gettext.textdomain('ddm')
+
+# Devices for testing (-t): [description, manufacturer id, device id, class id, slot]
+TEST_DEVICES = [
+    #['Advanced Micro Devices [AMD] nee ATI Manhattan [Mobility Radeon HD 5400 Series]', '1002', '68e0', '0300', '01:00.0'],
+    #['Advanced Micro Devices, Inc. [AMD/ATI] RV710 [Radeon HD 4350/4550]', '1002', '68e0', '0300', '01:00.0'],
+    #['Advanced Micro Devices [AMD/ATI] RS880 [Radeon HD 4290]', '1002', '68e0', '0300', '01:00.0'],
+    #['Advanced Micro Devices, Inc. [AMD/ATI] Tonga PRO [Radeon R9 285]', '1002', '6939', '0300', '01:00.0'],
+    ['Advanced Micro Devices, Inc. [AMD/ATI] Bonaire [FirePro W5100]', '1002', '6649', '0300', '01:00.0'],
+    ['NVIDIA Corporation GT218 [GeForce G210M]', '10de', '0a74', '0300', '02:00.0'],
+    ['Broadcom Corporation BCM43142 802.11a/b/g', '14e4', '4365', '0280', '03:00.0'],
+]
+# Set test_optimus to True for testing Optimus
+TEST_OPTIMUS_DEVICES = [
+    TEST_DEVICES[0],
+    ['Intel Corporation Haswell-ULT Integrated Graphics Controller', '8086', '0a16', '0300', '00:02.0'],
+    ['NVIDIA Corporation GK107M [GeForce GT 750M]', '10de', '0fe4', '0302', '02:00.0'],
+    TEST_DEVICES[2],
+]
+
+
+# A detected device and its driver
+class HardwareEntry(object):
+    __slots__ = ('selected', 'logo', 'description', 'driver', 'manufacturerId', 'deviceId', 'slot')
+
+    def __init__(self, selected, logo, description, driver, manufacturerId, deviceId, slot=''):
+        self.selected = selected
+        self.logo = logo
+        self.description = description
+        self.driver = driver
+        self.manufacturerId = manufacturerId
+        self.deviceId = deviceId
+        self.slot = slot
+
+    # Unique key: the PCI slot, or the manufacturer id for hardware that is not on the PCI bus (pae)
+    @property
+    def key(self):
+        return self.slot or self.manufacturerId
+
+
+# Class to detect supported hardware and the loaded drivers
+# It does not depend on Gtk so it can also be used without a display
+class HardwareDetector(object):
+
+    def __init__(self, log, test=False, test_optimus=False, rootDir='/'):
+        # Testing
+        self.test = test
+        self.test_optimus = test_optimus
+
+        self.log = log
+        self.scriptDir = abspath(dirname(__file__))
+        self.mediaDir = join(self.scriptDir, '../../share/ddm')
+        self.backendPath = join(self.scriptDir, '../../bin/ddm')
+        self.driverRules = None
+        self.nvidiaResolver = None
+        self.loadedDrivers = {}
+        self.optimus = False
+
+        # All system files are read relative to rootDir
+        self.rootDir = rootDir
+        self.logDir = join(rootDir, 'var/log')
+        # Results of rotated logs are kept between scans
+        self.logSearch = LogSearch()
+        self.dmiDir = join(rootDir, 'sys/class/dmi/id')
+
+        # Initiate variables
+        self.hardware = []
+        self.hardwareIndex = {}
+        self.notSupported = []
+        self.warnings = []
+        self.paeBooted = False
+
+    # Return the output lines of a command
+    # Override to replay recorded output
+    def run(self, command):
+        return getoutput(command)
+
+    # Return the installed version of a package
+    # Override to replay recorded package states
+    def get_package_version(self, package, candidate=False):
+        return getPackageVersion(package, candidate)
+
+    # Return {package: installed version} for all packages with one dpkg-query call
+    # Packages that are not installed have an empty version
+    def get_installed_versions(self, packages):
+        versions = dict((package, '') for package in packages)
+        if versions:
+            output = self.run("env LANG=C dpkg-query -W -f='${{Package}} ${{db:Status-Abbrev}} ${{Version}}\\n' {} 2>/dev/null; true".format(' '.join(sorted(versions))))
+            for line in output:
+                parts = line.split()
+                if len(parts) == 3 and parts[1] == 'ii' and parts[0] in versions:
+                    versions[parts[0]] = parts[2]
+        return versions
+
+    def get_supported_hardware(self):
+        # Fill self.hardware
+        self.hardware = []
+        self.hardwareIndex = {}
+        self.notSupported = []
+        self.warnings = []
+
+        # Log the hypervisor: virtual hardware rarely needs proprietary drivers
+        hypervisor = getHypervisor(self.dmiDir)
+        if hypervisor:
+            self.log.write("Running in virtual machine: {}".format(hypervisor), 'get_supported_hardware')
+
+        # Get hardware information
+        self.loadedDrivers = {}
+        self.get_pci_drivers()
+        self.get_pae()
+
+        return self.hardware
+
+    # Match the PCI devices against the driver rules and fill self.hardware
+    @tracer.trace('detector')
+    def get_pci_drivers(self):
+        rules = self.get_driver_rules()
+        devices = self.get_pci_devices()
+
+        # Optimus: Intel and Nvidia graphics
+        displayVendors = [d[1] for d in devices if d[3] in (VGA, DISPLAY_3D)]
+        self.optimus = '8086' in displayVendors and '10de' in displayVendors
+
+        for device in devices:
+            self.add_device(device, rules)
+
+    # Match a PCI device against the driver rules and add it to self.hardware
+    # Returns the new entry or None when there is no driver for the device
+    def add_device(self, device, rules):
+        rule, matchObj = rules.match(device)
+        if rule is None:
+            return None
+
+        self.log.write("Device found: {} ({}:{})".format(device[0], device[1], device[2]), 'get_pci_drivers')
+
+        if not rule['supported']:
+            self.notSupported.append(device[0])
+            self.log.write("Device not supported: {}".format(device[0]), 'get_pci_drivers')
+            return None
+
+        if matchObj and rule['minSeries'] and " hd " in matchObj.group(0).lower():
+            # Don't show older (Radeon) HD cards
+            matchObjSeries = ATI_SERIES.search(matchObj.group(0))
+            if matchObjSeries and int(matchObjSeries.group(0)) < rule['minSeries']:
+                self.log.write("Series not supported: {}".format(matchObj.group(0)), 'get_pci_drivers')
+                return None
+
+        if rule['warning'] and rule['warning'][0].search(device[0]):
+            self.log.write(rule['warning'][2], 'get_pci_drivers')
+            self.warnings.append(rule['warning'][1:])
+
+        # Check if the available driver is already loaded
+        # If it is: checkbox is selected
+        loadedDrv = self.get_loaded_driver(rule['loaded'])
+        selected = rule['module'] is not None and loadedDrv == rule['module']
+        driver = rule['driver']
+        description = device[0]
+        if rule['resolver']:
+            driver, selected, description = getattr(self, rule['resolver'])(device, selected, loadedDrv)
+
+        self.log.write("Driver to use: {} (loaded: {})".format(driver, loadedDrv), 'get_pci_drivers')
+
+        # Fill self.hardware
+        if not driver:
+            return None
+        logo = join(self.mediaDir, 'images', rule['logo'])
+        entry = HardwareEntry(selected, logo, description, driver, device[1], device[2], device[4])
+        self.add_hardware(entry)
+        return entry
+
+    # Rescan a single PCI device, e.g. after it was plugged in (hot-plug)
+    # Returns the new entry or None when the device is gone or has no driver
+    @tracer.trace('detector')
+    def scan_device(self, slot):
+        self.remove_device(slot)
+        # The device may have changed the loaded drivers
+        self.loadedDrivers = {}
+        entry = None
+        for device in self.get_pci_devices(slot):
+            entry = self.add_device(device, self.get_driver_rules())
+        return entry
+
+    # Remove the entry of a PCI device from self.hardware
+    def remove_device(self, slot):
+        entry = self.hardwareIndex.pop(slot, None)
+        if entry is not None:
+            self.hardware.remove(entry)
+        return entry
+
+    # Add an entry to self.hardware and its index
+    def add_hardware(self, entry):
+        self.hardware.append(entry)
+        self.hardwareIndex[entry.key] = entry
+
+    # Return the compiled driver rules
+    def get_driver_rules(self):
+        if self.driverRules is None:
+            # Device id lists are kept in the backend script
+            self.driverRules = DriverRules(idLists=get_config_dict(self.backendPath))
+        return self.driverRules
+
+    # Return the loaded graphical or wireless driver (once per scan)
+    def get_loaded_driver(self, kind):
+        if kind not in self.loadedDrivers:
+            if kind == 'graphical':
+                self.loadedDrivers[kind] = self.get_loaded_graphical_driver()
+            elif kind == 'wireless':
+                self.loadedDrivers[kind] = self.get_loaded_wireless_driver()
+            else:
+                self.loadedDrivers[kind] = ''
+        return self.loadedDrivers[kind]
+
+    # Resolver for Nvidia devices: returns driver, selected, description
+    def get_nvidia_driver(self, device, selected, loadedDrv):
+        if self.optimus:
+            selected = False
+            if loadedDrv == 'nvidia' or loadedDrv == 'intel':
+                bbversion = self.get_package_version("bumblebee-nvidia")
+                self.log.write("bumblebee-nvidia version: {}".format(bbversion), 'get_nvidia_driver')
+                selected = bbversion != ''
+            return "bumblebee-nvidia", selected, "(Optimus) {}".format(device[0])
+
+        if self.test:
+            return 'nvidia-driver', selected, device[0]
+        if self.nvidiaResolver is None:
+            # Never write the cache into a replayed tree (benchmark fixtures, snapshots)
+            cachePath = CACHE_PATH if abspath(self.rootDir) == '/' else None
+            self.nvidiaResolver = NvidiaResolver(self.log, join(self.rootDir, 'usr/share/nvidia'),
+                                                 cachePath, self.run)
+        return self.nvidiaResolver.get_driver(device[2]), selected, device[0]
+
+    @tracer.trace('detector')
+    def get_pae(self):
+        machine = self.run('uname -m')[0]
+        release = self.run('uname -r')[0]
+
+        if self.test:
+            machine = 'i686'
+            release = '3.16.0-4-586'
+
+        self.log.write("PAE check: machine={} / release={}".format(machine, release), 'get_pae')
+
+        if machine == 'i686':
+            # Check if PAE is installed and running
+            selected = False
+            if 'pae' in release:
+                self.paeBooted = True
+                selected = True
+            else:
+                if self.get_package_version('linux-image-686-pae') != '':
+                    selected = True
+
+            # Get the logo
+            logo = join(self.mediaDir, 'images/pae.png')
+
+            # Fill self.hardware
+            paeDescription = _("PAE capable system")
+            self.add_hardware(HardwareEntry(selected, logo, paeDescription, 'linux-image-686-pae', 'pae', ''))
+
+    # Return all PCI devices, or the device in slot: [description, manufacturer id, device id, class id, slot]
+    def get_pci_devices(self, slot=None):
+        if self.test:
+            devices = TEST_OPTIMUS_DEVICES if self.test_optimus else TEST_DEVICES
+            return [d for d in devices if slot is None or d[4] == slot]
+
+        deviceArray = []
+        output = self.run("lspci -nn -s {}".format(quote(slot)) if slot else "lspci -nn")
+        for line in output:
+            matchObj = LSPCI_DEVICE.search(line)
+            if matchObj:
+                slot, cls, description, manufacturerId, deviceId = matchObj.groups()
+                deviceArray.append([description, manufacturerId.lower(), deviceId.lower(), cls, slot])
+        return deviceArray
+
+    def shorten_long_string(self, longString, charLen, breakOnWord=True):
+        tmpArr = []
+        if breakOnWord:
+            stringArr = longString.split(' ')
+            nrChrs = 0
+            for s in stringArr:
+                nrChrs += len(s) + 1
+                if nrChrs < charLen:
+                    tmpArr.append(s)
+                else:
+                    break
+        else:
+            if len(longString) > charLen:
+                tmpArr.append("{}...".format(longString[0:charLen]))
+            else:
+                tmpArr.append(longString)
+        return ' '.join(tmpArr)
+
+    # Return graphics module used by X.org
+    # TODO: is lsmod an alternative?
+    @tracer.trace('logscan')
+    def get_loaded_graphical_driver(self):
+        # Most recent X.org log first
+        module = ''
+        matchObj = self.logSearch.search(XORG_MODULE, glob(os.path.join(self.logDir, 'Xorg.*.log*')))
+        if matchObj:
+            module = matchObj.group(1).lower()
+            self.log.write("Log module={}".format(module))
+        return module
+
+    # Return used wireless driver
+    # The journal is searched first: journald-only systems have no syslog
+    @tracer.trace('logscan')
+    def get_loaded_wireless_driver(self):
+        driver = ''
+        if self.has_journal():
+            driver = self.get_journal_wireless_driver()
+        if driver == '':
+            driver = self.get_syslog_wireless_driver()
+        return driver
+
+    # Override to replay a recorded journal
+    def has_journal(self):
+        return isdir(join(self.rootDir, 'run/systemd/journal'))
+
+    # Newest Network Manager and Wicd messages first
+    def get_journal_wireless_driver(self):
+        for line in self.run(get_journal_command(WIRELESS_COMMS)):
+            matchObj = WIRELESS_DRIVER.search(get_message(line))
+            if matchObj:
+                return self.get_wireless_driver_name(matchObj)
+        return ''
+
+    # Most recent line of the newest syslog generation that has one
+    def get_syslog_wireless_driver(self):
+        matchObj = self.logSearch.search(WIRELESS_DRIVER, glob(os.path.join(self.logDir, 'syslog*')), last=True)
+        if matchObj:
+            return self.get_wireless_driver_name(matchObj)
+        return ''
+
+    # One search for both Network Manager (wlan0) and Wicd (ieee) entries
+    def get_wireless_driver_name(self, matchObj):
+        if matchObj.group('networkmanager') is not None:
+            driver = matchObj.group('networkmanager')
+            self.log.write("Network Manager driver={}".format(driver))
+        else:
+            driver = matchObj.group('wicd')
+            self.log.write("Wicd driver={}".format(driver))
+        return driver
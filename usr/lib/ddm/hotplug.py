@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+
+# Kernel uevents of PCI and network devices (hot-plug)
+#
+# The uevents are read from a netlink socket that can be watched by the
+# GLib main loop: GLib.io_add_watch(monitor.fileno(), GLib.IO_IN, callback)
+# Every event is mapped to the PCI slot of the device as shown by lspci,
+# so only that device needs to be rescanned.
+
+import re
+import socket
+
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group of the kernel (not udev)
+KERNEL_GROUP = 1
+SUBSYSTEMS = ['pci', 'net']
+PCI_SLOT = re.compile(r'^([0-9a-f]{4}:)?[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]$', re.IGNORECASE)
+
+
+# Return the lspci slot for a PCI slot name: 0000:02:00.0 -> 02:00.0
+def normalize_slot(slot):
+    slot = slot.lower()
+    if slot.startswith('0000:'):
+        slot = slot[5:]
+    return slot
+
+
+# Return the slot of the PCI device a sysfs device belongs to
+# /devices/pci0000:00/0000:00:1c.0/0000:02:00.0/net/wlan0 -> 02:00.0
+def get_pci_slot(devpath):
+    slot = ''
+    for part in devpath.split('/'):
+        if PCI_SLOT.match(part):
+            # The last PCI device in the path (bridges come first)
+            slot = part
+    return normalize_slot(slot)
+
+
+# Return a uevent as dict: action@devpath\0KEY=VALUE\0...
+def parse_uevent(data):
+    fields = data.decode('utf-8', errors='replace').split('\0')
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition('=')
+        if sep:
+            event[key] = value
+    if 'ACTION' not in event and '@' in fields[0]:
+        event['ACTION'], event['DEVPATH'] = fields[0].split('@', 1)
+    event['slot'] = get_pci_slot(event.get('DEVPATH', ''))
+    return event
+
+
+class UeventMonitor(object):
+
+    def __init__(self, subsystems=SUBSYSTEMS):
+        self.subsystems = subsystems
+        self.sock = None
+
+    # Raises OSError when netlink is not available
+    def open(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.sock.bind((0, KERNEL_GROUP))
+        self.sock.setblocking(False)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    # Return the pending events of the watched subsystems that belong to a PCI device
+    def read_events(self):
+        events = []
+        while True:
+            try:
+                data = self.sock.recv(16384)
+            except (BlockingIOError, InterruptedError):
+                break
+            event = parse_uevent(data)
+            if event.get('SUBSYSTEM') in self.subsystems and event['slot']:
+                events.append(event)
+        return events
@@ -0,0 +1,33 @@
+#! /usr/bin/env python3
+
+# Read log messages from the systemd journal
+#
+# journalctl looks up the entries of a process through the indexed _COMM field
+# and returns the newest first (-r), so only the messages of the network daemons
+# are read instead of the whole syslog.
+
+import json
+
+# Processes that log the wireless driver
+WIRELESS_COMMS = ['NetworkManager', 'wicd']
+# Search window
+MAX_ENTRIES = 5000
+SINCE = '30 days ago'
+
+
+# Return the journalctl command for the newest messages of the given processes
+def get_journal_command(comms, maxEntries=MAX_ENTRIES, since=SINCE):
+    matches = ' '.join("_COMM={}".format(comm) for comm in comms)
+    return "journalctl -r -q --no-pager -o json -n {} --since '{}' {}".format(maxEntries, since, matches)
+
+
+# Return the message of a journal entry (one line of journalctl -o json)
+def get_message(line):
+    try:
+        message = json.loads(line).get('MESSAGE')
+    except ValueError:
+        return ''
+    # Messages that are not valid utf-8 are a list of bytes
+    if isinstance(message, list):
+        message = bytes(message).decode('utf-8', errors='replace')
+    return message or ''
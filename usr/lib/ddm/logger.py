@@ -3,11 +3,14 @@
 import os
 import pwd
 import logging
-import re
 import sys
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
 from shutil import move
-from dialogs import ErrorDialog
-from treeview import TreeViewHandler
+from patterns import TYPE_NAME
 
 
 class Logger():
@@ -72,17 +75,17 @@ class Logger():
                 myLogger.error(message)
                 self.rtobjectWrite(message)
                 if showErrorDialog:
-                    ErrorDialog('Error', message)
+                    self.showDialog('Error', message)
             elif logLevel == 'critical':
                 myLogger.critical(message)
                 self.rtobjectWrite(message)
                 if showErrorDialog:
-                    ErrorDialog('Critical', message)
+                    self.showDialog('Critical', message)
             elif logLevel == 'exception':
                 myLogger.exception(message)
                 self.rtobjectWrite(message)
                 if showErrorDialog:
-                    ErrorDialog('Exception', message)
+                    self.showDialog('Exception', message)
             # Flush now
             sys.stdout.flush()
 
@@ -92,6 +95,8 @@ class Logger():
             if 'label' in self.typeString.lower():
                 self.rtobject.set_text(message)
             elif 'treeview' in self.typeString.lower():
+                # Gtk is only imported when there is a Gtk object to write to
+                from treeview import TreeViewHandler
                 tvHandler = TreeViewHandler(self.rtobject)
                 tvHandler.fillTreeview([message], ['str'], [-1], 0, 400, False, True, True, fontSize=10000)
             elif 'statusbar' in self.typeString.lower():
@@ -100,11 +105,20 @@ class Logger():
                 # For obvious reasons: do not log this...
                 print(('Return object type not implemented: %s' % self.typeString))
 
+    # Show an error dialog when Gtk is available
+    def showDialog(self, title, message):
+        try:
+            from dialogs import ErrorDialog
+        except (ImportError, ValueError):
+            # Running without Gtk (headless): log only
+            return
+        ErrorDialog(title, message)
+
     # Return the type string of a object
     def getTypeString(self, object):
         tpString = ''
         tp = str(type(object))
-        matchObj = re.search("'(.*)'", tp)
+        matchObj = TYPE_NAME.search(tp)
         if matchObj:
             tpString = matchObj.group(1)
         return tpString
@@ -115,6 +129,130 @@ class Logger():
             self.rtobject.push(context, message)
 
 
+# A traced stage: duration, bytes read and subprocesses spawned
+class TraceSpan():
+    __slots__ = ('name', 'category', 'args', 'start', 'duration', 'bytesRead', 'forks', 'threadId')
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = time.monotonic()
+        self.duration = 0.0
+        self.bytesRead = 0
+        self.forks = 0
+        self.threadId = threading.get_ident()
+
+
+# Lightweight tracing of the hardware scan
+# Usage:
+# with tracer.span('lspci -nn', 'getoutput') as span:
+#     span.forks += 1
+#
+# @tracer.trace('detector')
+# def get_ati(self):
+#
+# tracer.finish(log)  # Write a one-line summary (and optionally a Chrome trace)
+class Tracer():
+
+    def __init__(self, chromeTracePath=None):
+        self.chromeTracePath = chromeTracePath
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    # Start a new trace
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.start = time.monotonic()
+
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        span = TraceSpan(name, category, args)
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span.duration = time.monotonic() - span.start
+            with self.lock:
+                self.spans.append(span)
+
+    # Decorator: trace each call of a function
+    def trace(self, category='stage', name=None):
+        def decorator(func):
+            spanName = name or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(spanName, category):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Return the innermost span of the current thread
+    def current(self):
+        stack = self.local.__dict__.get('stack')
+        return stack[-1] if stack else None
+
+    # Add bytes read to the current span
+    def add_bytes(self, nrBytes):
+        span = self.current()
+        if span is not None:
+            span.bytesRead += nrBytes
+
+    # Return a one-line summary of the trace
+    def summary(self):
+        with self.lock:
+            spans = list(self.spans)
+        if not spans:
+            return 'Trace: nothing traced'
+        categories = []
+        totals = {}
+        for span in sorted(spans, key=lambda s: s.start):
+            if span.category not in totals:
+                categories.append(span.category)
+                totals[span.category] = [0.0, 0]
+            totals[span.category][0] += span.duration
+            totals[span.category][1] += 1
+        wall = max(s.start + s.duration for s in spans) - min(s.start for s in spans)
+        parts = ["{} {:.3f}s/{}".format(c, totals[c][0], totals[c][1]) for c in categories]
+        forks = sum(s.forks for s in spans)
+        mb = sum(s.bytesRead for s in spans) / (1024 * 1024)
+        return "Trace: {:.3f}s wall | {} | {} forks | {:.1f} MB read".format(wall, ' | '.join(parts), forks, mb)
+
+    # Write the trace in Chrome trace event format (chrome://tracing)
+    def write_chrome_trace(self, path):
+        pid = os.getpid()
+        with self.lock:
+            spans = list(self.spans)
+        events = []
+        for span in spans:
+            args = dict(span.args)
+            args.update({'bytesRead': span.bytesRead, 'forks': span.forks})
+            events.append({'name': span.name, 'cat': span.category, 'ph': 'X',
+                           'ts': int((span.start - self.start) * 1000000),
+                           'dur': int(span.duration * 1000000),
+                           'pid': pid, 'tid': span.threadId, 'args': args})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+    # Log the summary and write the Chrome trace if requested
+    def finish(self, log, loggerName='trace'):
+        log.write(self.summary(), loggerName, 'info')
+        if self.chromeTracePath:
+            try:
+                self.write_chrome_trace(self.chromeTracePath)
+            except (IOError, OSError) as detail:
+                log.write("Cannot write trace file: {}".format(detail), loggerName, 'warning')
+
+
+# Process wide tracer
+tracer = Tracer()
+
+
 # Test
 #log = Logger('myapp.log') # Log file and console
 #log = Logger() # Console only
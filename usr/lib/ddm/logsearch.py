@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+
+# Search a log and its rotated generations, newest first:
+#   syslog, syslog.1, syslog.2.gz, ...    Xorg.0.log, Xorg.1.log, Xorg.0.log.old
+#
+# Compressed generations (.gz, .xz) are decompressed in chunks while they are
+# searched and the search stops at the first generation with a match.
+# The result of a generation is cached by inode and mtime: logrotate renames
+# syslog.1 without changing either, so a generation is never read twice.
+
+import os
+import re
+import gzip
+import lzma
+from logger import tracer
+
+OPENERS = {'.gz': gzip.open, '.xz': lzma.open}
+CHUNK_SIZE = 256 * 1024
+# Rotated generation: syslog.1, syslog.2.gz, Xorg.0.log.old
+GENERATION = re.compile(r'\.(\d+|old)(\.gz|\.xz)?$')
+
+
+# Return the generation of a log file: 0 for the current log
+def get_generation(path):
+    matchObj = GENERATION.search(path)
+    if matchObj is None:
+        return 0
+    if matchObj.group(1) == 'old':
+        return 1
+    return int(matchObj.group(1))
+
+
+# Return the match again on its own line(s): the match object then does not keep the whole block
+def get_line_match(pattern, text, matchObj):
+    start = text.rfind('\n', 0, matchObj.start()) + 1
+    end = text.find('\n', matchObj.end())
+    if end < 0:
+        end = len(text)
+    return pattern.match(text[start:end], matchObj.start() - start)
+
+
+# Yield blocks of whole lines from the start of a (decompressing) file object
+def read_blocks(f, chunkSize=CHUNK_SIZE):
+    rest = b''
+    while True:
+        chunk = f.read(chunkSize)
+        if not chunk:
+            break
+        tracer.add_bytes(len(chunk))
+        block, sep, rest = (rest + chunk).rpartition(b'\n')
+        if sep:
+            yield block
+    yield rest
+
+
+# Yield blocks of whole lines from the end of a plain file
+def read_blocks_reversed(f, chunkSize=CHUNK_SIZE):
+    position = f.seek(0, os.SEEK_END)
+    rest = b''
+    while position > 0:
+        size = min(chunkSize, position)
+        position -= size
+        f.seek(position)
+        chunk = f.read(size)
+        tracer.add_bytes(size)
+        rest, sep, block = (chunk + rest).partition(b'\n')
+        if sep:
+            yield block
+    yield rest
+
+
+class LogSearch(object):
+
+    def __init__(self):
+        # {(device, inode, mtime, pattern, last): match object of the matched line or None}
+        self.cache = {}
+
+    # Return the match in the newest generation that has one, or None
+    # last: the last match in a generation (most recent line) instead of the first
+    def search(self, pattern, paths, last=False):
+        for path in sorted(paths, key=lambda p: (get_generation(p), p)):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, pattern.pattern, last)
+            if key not in self.cache:
+                # The log changed: forget the results of its older contents
+                for old in [k for k in self.cache if k[:2] == key[:2] and k[2] != key[2]]:
+                    del self.cache[old]
+                self.cache[key] = self.search_file(pattern, path, last)
+            if self.cache[key] is not None:
+                return self.cache[key]
+        return None
+
+    def search_file(self, pattern, path, last):
+        opener = OPENERS.get(os.path.splitext(path)[1])
+        try:
+            if opener is None:
+                # Plain files are read from the end when looking for the last match
+                with open(path, 'rb') as f:
+                    if last:
+                        return self.search_blocks(pattern, read_blocks_reversed(f), True, True)
+                    return self.search_blocks(pattern, read_blocks(f), False, True)
+            # Compressed files can only be read forward
+            with opener(path, 'rb') as f:
+                return self.search_blocks(pattern, read_blocks(f), last, not last)
+        except (IOError, OSError, EOFError, lzma.LZMAError):
+            return None
+
+    # Search blocks of lines: the patterns do not match across lines
+    # last: take the last match of a block instead of the first
+    # stop: return the match of the first block that has one
+    def search_blocks(self, pattern, blocks, last, stop):
+        found = None
+        for block in blocks:
+            # Some logs contain binary data: replace utf-8 errors (with ?)
+            text = block.decode(encoding='utf-8', errors='replace')
+            matchObj = None
+            if last:
+                for matchObj in pattern.finditer(text):
+                    pass
+            else:
+                matchObj = pattern.search(text)
+            if matchObj is not None:
+                found = get_line_match(pattern, text, matchObj)
+                if stop:
+                    break
+        return found
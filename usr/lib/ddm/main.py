@@ -9,6 +9,7 @@ sys.path.insert(1, '/usr/lib/ddm')
 from dialogs import MessageDialog, ErrorDialog, WarningDialog
 from gi.repository import Gtk, GObject
 from ddm import DDM
+from logger import tracer
 import os
 import argparse
 
@@ -23,9 +24,15 @@ gettext.textdomain('ddm')
 parser = argparse.ArgumentParser(description="DDM")
 parser.add_argument('-t', action="store_true", help='Testing only: install drivers for pre-defined hardware')
 parser.add_argument('-f', action="store_true", help='Force DDM to start even in a live environment')
+parser.add_argument('--trace', metavar='FILE', help='Write a Chrome trace (JSON) of the hardware scan to FILE')
+parser.add_argument('--replay', metavar='FILE', help='Show the hardware of a snapshot (ddm -c) instead of this system')
+parser.add_argument('--bus', metavar='ADDRESS', help='Use the helper service on the D-Bus at ADDRESS (testing)')
 args, extra = parser.parse_known_args()
 test = args.t
 force = args.f
+replay = args.replay
+bus = args.bus
+tracer.chromeTracePath = args.trace
 
 
 # Warn for the use of proprietary drivers
@@ -97,7 +104,7 @@ if __name__ == "__main__":
         # Debian Jessie: 3.4.2
         GObject.threads_init()
 
-        DDM(test)
+        DDM(test, replay, bus)
         Gtk.main()
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,308 @@
+#! /usr/bin/env python3
+
+# Select the fastest mirror for every source in the sources lists
+#
+# The candidates are the mirrors of the sources lists plus an optional list
+# of mirrors. They are timed in parallel: the connect latency and the speed
+# of downloading dists/<suite>/Release. A candidate replaces the configured
+# mirror of a source only when its Release has the same Origin and Label and
+# has all components of the source.
+#
+# The ranking is cached for --ttl seconds. With -o DIR a sources list with the
+# fastest mirrors and an apt.conf that uses it are written to DIR: point
+# APT_CONFIG to DIR/apt.conf to use them without changing the sources lists.
+# deb822 style sources (.sources) are not ranked: they are copied unchanged.
+#
+# Usage: mirrors.py [-m "http://deb.debian.org/debian ..."] [--ttl 86400] [-o DIR]
+#
+# Exit codes
+# 0 - The override is written (or the ranking is printed without -o)
+# 1 - The configured mirrors are the fastest: nothing is written
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import http.client
+from glob import glob
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, exists, dirname
+
+SOURCES_LIST = '/etc/apt/sources.list'
+SOURCES_PARTS = '/etc/apt/sources.list.d'
+LISTS_DIR = '/var/lib/apt/lists'
+CACHE_FILE = '/var/cache/ddm/mirrors.json'
+CACHE_TTL = 86400
+MAX_WORKERS = 8
+# Seconds to connect and download the sample of a mirror
+PROBE_TIMEOUT = 3
+# Bytes of the Release file to download
+SAMPLE_BYTES = 262144
+# Mirrors are ranked by the estimated seconds to download this many bytes
+ESTIMATE_BYTES = 50 * 1024 * 1024
+EXIT_WRITTEN = 0
+EXIT_UNCHANGED = 1
+
+
+# A deb or deb-src line of a sources list
+class Source(object):
+    __slots__ = ('path', 'line', 'words', 'uriIndex', 'uri', 'suite', 'components')
+
+    def __init__(self, path, line, words, uriIndex):
+        self.path = path
+        self.line = line
+        self.words = words
+        self.uriIndex = uriIndex
+        self.uri = words[uriIndex].rstrip('/')
+        self.suite = words[uriIndex + 1] if len(words) > uriIndex + 1 else ''
+        self.components = words[uriIndex + 2:]
+
+    # Return the line with another mirror
+    def with_uri(self, uri):
+        words = list(self.words)
+        words[self.uriIndex] = uri
+        return ' '.join(words)
+
+
+# The timing of a mirror for a source
+class Probe(object):
+    __slots__ = ('uri', 'latency', 'throughput', 'release')
+
+    def __init__(self, uri, latency=None, throughput=None, release=None):
+        self.uri = uri
+        self.latency = latency
+        self.throughput = throughput
+        self.release = release or {}
+
+    def ok(self):
+        return self.latency is not None and self.throughput
+
+    # Estimated seconds to download ESTIMATE_BYTES
+    def score(self):
+        if not self.ok():
+            return float('inf')
+        return self.latency + ESTIMATE_BYTES / self.throughput
+
+
+# Return the paths of the one-line style sources lists
+def get_sources_paths():
+    return [SOURCES_LIST] + sorted(glob(join(SOURCES_PARTS, '*.list')))
+
+
+# Return the deb and deb-src lines of the sources lists as Source objects
+def get_sources(sourcesPaths=None):
+    if sourcesPaths is None:
+        sourcesPaths = get_sources_paths()
+    sources = []
+    for path in sourcesPaths:
+        try:
+            with open(path) as f:
+                lines = f.read().splitlines()
+        except (IOError, OSError):
+            continue
+        for line in lines:
+            words = line.split('#', 1)[0].split()
+            if not words or words[0] not in ('deb', 'deb-src'):
+                continue
+            # Skip options: deb [arch=amd64 signed-by=...] http://...
+            for i, word in enumerate(words[1:], 1):
+                if '://' in word or word.startswith(('file:', 'cdrom:')):
+                    sources.append(Source(path, line, words, i))
+                    break
+    return sources
+
+
+def is_remote(uri):
+    return urlparse(uri).scheme in ('http', 'https')
+
+
+# Return the fields of a Release file that identify an archive
+def parse_release(text):
+    release = {}
+    for line in text.splitlines():
+        if not line or line[0] == ' ':
+            # The checksum lists follow the header
+            if release:
+                break
+            continue
+        key, sep, value = line.partition(':')
+        if sep and key in ('Origin', 'Label', 'Suite', 'Codename', 'Components'):
+            release[key] = value.strip()
+    return release
+
+
+# Return the fields of the Release of a source from apt's lists
+def get_local_release(uri, suite):
+    url = urlparse(uri)
+    prefix = "{}{}_dists_{}_".format(url.netloc, url.path, suite).replace('/', '_')
+    for name in ('InRelease', 'Release'):
+        path = join(LISTS_DIR, prefix + name)
+        if exists(path):
+            with open(path, errors='replace') as f:
+                return parse_release(f.read(SAMPLE_BYTES))
+    return {}
+
+
+# Time a mirror: connect and download the Release of the suite
+def probe(uri, suite):
+    url = urlparse(uri)
+    connection = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+    conn = connection(url.hostname, url.port, timeout=PROBE_TIMEOUT)
+    try:
+        start = time.monotonic()
+        conn.connect()
+        latency = time.monotonic() - start
+        conn.request('GET', "{}/dists/{}/Release".format(url.path.rstrip('/'), suite),
+                     headers={'User-Agent': 'ddm'})
+        start = time.monotonic()
+        response = conn.getresponse()
+        if response.status != 200:
+            return Probe(uri)
+        data = b''
+        while len(data) < SAMPLE_BYTES and time.monotonic() - start < PROBE_TIMEOUT:
+            chunk = response.read(16384)
+            if not chunk:
+                break
+            data += chunk
+        seconds = max(time.monotonic() - start, 0.001)
+        release = parse_release(data.decode('utf-8', errors='replace'))
+        return Probe(uri, latency, len(data) / seconds, release)
+    except (OSError, socket.timeout, http.client.HTTPException):
+        return Probe(uri)
+    finally:
+        conn.close()
+
+
+# A candidate carries the same archive as the source
+def is_same_archive(release, expected, components):
+    if not release or not expected:
+        return False
+    for key in ('Origin', 'Label'):
+        if release.get(key) != expected.get(key):
+            return False
+    return set(components) <= set(release.get('Components', '').split())
+
+
+# Return {(uri, suite): [uri]} with the usable mirrors of every remote source, fastest first
+def rank_mirrors(sources, mirrors=[]):
+    targets = []
+    for source in sources:
+        if is_remote(source.uri) and source.suite and (source.uri, source.suite) not in targets:
+            targets.append((source.uri, source.suite))
+    candidates = []
+    for uri in [uri for uri, suite in targets] + [m.rstrip('/') for m in mirrors]:
+        if is_remote(uri) and uri not in candidates:
+            candidates.append(uri)
+    components = {}
+    for source in sources:
+        components.setdefault((source.uri, source.suite), set()).update(source.components)
+
+    suites = sorted(set(suite for uri, suite in targets))
+    jobs = [(uri, suite) for suite in suites for uri in candidates]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        probes = dict(zip(jobs, pool.map(lambda job: probe(*job), jobs)))
+
+    ranking = {}
+    for uri, suite in targets:
+        # Compare with the configured mirror, or with apt's copy when it cannot be reached
+        expected = probes[(uri, suite)].release or get_local_release(uri, suite)
+        usable = [probes[(candidate, suite)] for candidate in candidates
+                  if probes[(candidate, suite)].ok()
+                  and (candidate == uri or is_same_archive(probes[(candidate, suite)].release,
+                                                           expected, components[(uri, suite)]))]
+        usable.sort(key=Probe.score)
+        ranking[(uri, suite)] = [p.uri for p in usable]
+        for p in usable:
+            print("{} {}: {:.0f} ms, {:.0f} KB/s".format(p.uri, suite, p.latency * 1000, p.throughput / 1024))
+    return ranking
+
+
+# Return the cached ranking when it is younger than ttl and made for the same mirrors
+def load_ranking(cacheFile, ttl, key):
+    try:
+        with open(cacheFile) as f:
+            cache = json.load(f)
+        if cache['key'] != key or time.time() - cache['created'] > ttl:
+            return None
+        return dict(((uri, suite), uris) for uri, suite, uris in cache['ranking'])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_ranking(cacheFile, key, ranking):
+    try:
+        os.makedirs(dirname(cacheFile), exist_ok=True)
+        tmp = cacheFile + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'created': time.time(), 'key': key,
+                       'ranking': [[uri, suite, uris] for (uri, suite), uris in ranking.items()]}, f)
+        os.replace(tmp, cacheFile)
+    except (IOError, OSError):
+        pass
+
+
+# Return the ranking from the cache or by timing the mirrors
+def get_ranking(sources, mirrors=[], ttl=CACHE_TTL, cacheFile=CACHE_FILE):
+    key = sorted(set("{} {}".format(s.uri, s.suite) for s in sources)) + sorted(mirrors)
+    ranking = load_ranking(cacheFile, ttl, key)
+    if ranking is None:
+        ranking = rank_mirrors(sources, mirrors)
+        save_ranking(cacheFile, key, ranking)
+    return ranking
+
+
+# Write DIR/sources.list with the fastest mirrors and DIR/apt.conf that uses it
+# The .sources files are copied to DIR/sources.list.d: apt reads no other sources
+# Returns False when no source changes
+def write_override(directory, sources, ranking):
+    lines = []
+    changed = False
+    for source in sources:
+        uris = ranking.get((source.uri, source.suite))
+        if uris and uris[0] != source.uri:
+            print("Use {} instead of {} for {}".format(uris[0], source.uri, source.suite))
+            lines.append(source.with_uri(uris[0]))
+            changed = True
+        else:
+            lines.append(source.line.strip())
+    if not changed:
+        return False
+    sourcesList = join(directory, 'sources.list')
+    with open(sourcesList, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    sourcesParts = join(directory, 'sources.list.d')
+    shutil.rmtree(sourcesParts, ignore_errors=True)
+    os.makedirs(sourcesParts)
+    for path in glob(join(SOURCES_PARTS, '*.sources')):
+        shutil.copy2(path, sourcesParts)
+    with open(join(directory, 'apt.conf'), 'w') as f:
+        f.write('Dir::Etc::SourceList "{}";\n'.format(sourcesList))
+        # Our sources, and keep the lists of the configured mirrors
+        f.write('Dir::Etc::SourceParts "{}";\n'.format(sourcesParts))
+        f.write('APT::Get::List-Cleanup "false";\n')
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Select the fastest mirror for every source")
+    parser.add_argument('-m', '--mirrors', default='', help='Other mirrors to try (space separated)')
+    parser.add_argument('--ttl', type=int, default=CACHE_TTL, help='Seconds to keep the ranking (default: 86400)')
+    parser.add_argument('-o', '--output', help='Write sources.list and apt.conf to this directory')
+    args = parser.parse_args()
+
+    if glob(join(SOURCES_PARTS, '*.sources')):
+        print("Mirror selection skips the .sources files: their mirrors are used as configured")
+    sources = get_sources()
+    ranking = get_ranking(sources, args.mirrors.split(), args.ttl)
+    sys.stdout.flush()
+    if args.output is None:
+        return EXIT_WRITTEN
+    return EXIT_WRITTEN if write_override(args.output, sources, ranking) else EXIT_UNCHANGED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
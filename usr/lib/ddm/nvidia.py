@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+
+# Select the Nvidia driver package for a PCI device id without running nvidia-detect
+#
+# The Debian Nvidia packages ship the device ids each driver series supports
+# in /usr/share/nvidia/<series>.ids (e.g. nvidia-legacy-340xx.ids).
+# These lists are compiled into one index {device id: package}, which is cached
+# in /var/cache/ddm together with the resolved devices.
+# The cache is rebuilt when one of the id lists changes. Without a cache path
+# (e.g. when replaying a snapshot) the index is only kept in memory.
+# nvidia-detect is only run for device ids that are not in any list.
+#
+# Usage: nvidia.py 0a65 [0be3 ...]
+# Prints the package for the first device id that has one.
+
+import os
+import sys
+import json
+from glob import glob
+from os.path import join, basename, dirname
+from utils import getoutput
+
+IDS_DIR = '/usr/share/nvidia'
+CACHE_PATH = '/var/cache/ddm/nvidia.json'
+CURRENT_SERIES = 'nvidia'
+
+
+# Return the package name for an id list: nvidia-legacy-340xx.ids -> nvidia-legacy-340xx-driver
+def get_package_name(idsPath):
+    return "{}-driver".format(basename(idsPath)[:-len('.ids')])
+
+
+# Sort key for id lists: current driver first, then the newest legacy series
+def series_order(idsPath):
+    series = basename(idsPath)[:-len('.ids')]
+    if series == CURRENT_SERIES:
+        return (0, 0)
+    digits = ''.join(c for c in series if c.isdigit())
+    return (1, -int(digits) if digits else 0)
+
+
+# Return the 4 digit device id from an id list entry: 10de0a65, 10DE:0A65 or 0a65
+def normalize_id(entry):
+    entry = ''.join(c for c in entry.lower() if c in '0123456789abcdef')
+    if len(entry) == 8 and entry.startswith('10de'):
+        return entry[4:]
+    if len(entry) == 4:
+        return entry
+    return ''
+
+
+class NvidiaResolver(object):
+
+    def __init__(self, log=None, idsDir=IDS_DIR, cachePath=CACHE_PATH, run=getoutput):
+        self.log = log
+        self.idsDir = idsDir
+        self.cachePath = cachePath
+        self.run = run
+        self.cache = None
+
+    def write_log(self, message):
+        if self.log is not None:
+            self.log.write(message, 'NvidiaResolver')
+
+    # Id lists and their modification times: the cache is only valid for these
+    def get_signature(self):
+        signature = []
+        for idsPath in sorted(glob(join(self.idsDir, '*.ids'))):
+            try:
+                signature.append([basename(idsPath), os.path.getmtime(idsPath)])
+            except OSError:
+                pass
+        return signature
+
+    # Compile the id lists into {device id: package}
+    def build_index(self):
+        index = {}
+        for idsPath in sorted(glob(join(self.idsDir, '*.ids')), key=series_order):
+            package = get_package_name(idsPath)
+            try:
+                with open(idsPath) as f:
+                    for line in f:
+                        deviceId = normalize_id(line.split('#')[0])
+                        if deviceId:
+                            # The first (newest) series wins
+                            index.setdefault(deviceId, package)
+            except (IOError, OSError) as detail:
+                self.write_log("Cannot read {}: {}".format(idsPath, detail))
+        return index
+
+    def load_cache(self):
+        signature = self.get_signature()
+        if self.cachePath is not None:
+            try:
+                with open(self.cachePath) as f:
+                    cache = json.load(f)
+                if cache.get('signature') == signature:
+                    self.cache = cache
+                    return
+            except (IOError, OSError, ValueError):
+                pass
+        self.write_log("Build Nvidia device index from {}".format(self.idsDir))
+        self.cache = {'signature': signature, 'index': self.build_index(), 'detected': {}}
+        self.save_cache()
+
+    def save_cache(self):
+        if self.cachePath is None:
+            return
+        try:
+            os.makedirs(dirname(self.cachePath), exist_ok=True)
+            tmpPath = "{}.tmp".format(self.cachePath)
+            with open(tmpPath, 'w') as f:
+                json.dump(self.cache, f)
+            os.rename(tmpPath, self.cachePath)
+        except (IOError, OSError) as detail:
+            # Not fatal: e.g. not running as root
+            self.write_log("Cannot save Nvidia cache: {}".format(detail))
+
+    # Return the driver package for a device id or an empty string
+    def get_driver(self, deviceId):
+        deviceId = deviceId.lower()
+        if self.cache is None:
+            self.load_cache()
+
+        driver = self.cache['index'].get(deviceId)
+        if driver is None:
+            driver = self.cache['detected'].get(deviceId)
+        if driver is None:
+            # Unknown device id: ask nvidia-detect once and remember the answer
+            nvidiaDetect = self.run("nvidia-detect | grep nvidia- | tr -d ' '")
+            driver = nvidiaDetect[0] if nvidiaDetect else ''
+            self.write_log("nvidia-detect for {}: {}".format(deviceId, driver))
+            if driver:
+                self.cache['detected'][deviceId] = driver
+                self.save_cache()
+        return driver
+
+
+if __name__ == '__main__':
+    resolver = NvidiaResolver()
+    for deviceId in sys.argv[1:]:
+        driver = resolver.get_driver(deviceId)
+        if driver:
+            print(driver)
+            break
@@ -0,0 +1,39 @@
+#! /usr/bin/env python3
+
+import re
+
+# Regular expressions for device and log parsing
+# All patterns are compiled (and thereby validated) once, on import
+
+# lspci -nn line, e.g.:
+# 01:00.0 VGA compatible controller [0300]: NVIDIA Corporation GT218 [GeForce 210] [10de:0a65] (rev a2)
+# Groups: slot, class id, description, manufacturer id, device id
+LSPCI_DEVICE = re.compile(r'^(\S+)\s.*?\[([0-9a-f]{4})\]:\s(.*)\s\[([0-9a-f]{4}):([0-9a-f]{4})\]', re.IGNORECASE)
+
+# Radeon HD series number
+ATI_SERIES = re.compile(r'[0-9]{4}')
+
+# ATI cards the backend can install a driver for (detect_ati in /usr/bin/ddm, the ati rule in drivers.py)
+ATI_CARD = re.compile(r'radeon\s+[0-9a-z ]+|fire[a-z]+\s+[0-9a-z -]+', re.IGNORECASE)
+
+# apt-config dump: the proxy of a scheme, or the command that finds it (auto-apt-proxy), e.g.:
+# Acquire::http::Proxy "http://proxy.example:3142/";
+# Groups: scheme, -Auto-Detect (or None), value
+APT_PROXY = re.compile(r'^Acquire::(https?)::Proxy(-?Auto-?Detect)?\s+"(.*)";$', re.IGNORECASE)
+
+# dkmsbuild.py: the result of a module build, e.g.:
+# DKMS build nvidia-current/390.87 for 4.9.0-8-amd64: ok (41 s)
+# Groups: module/version, kernel release, ok or failed
+DKMS_BUILD = re.compile(r'^DKMS build (\S+) for (\S+): (ok|failed)')
+
+# Xorg log: the module that draws the framebuffer, e.g.:
+# (**) NVIDIA(0): Depth 24, (--) framebuffer bpp 32
+XORG_MODULE = re.compile(r'([a-zA-Z]*)\(\d+\):\s+depth.*framebuffer', re.IGNORECASE)
+
+# Syslog: wireless driver reported by Network Manager or Wicd
+# Only one of the named groups is set: networkmanager (driver name) or wicd
+WIRELESS_DRIVER = re.compile(r"\(wlan\d\):.*driver:\s*'(?P<networkmanager>[a-zA-Z0-9\-]*)"
+                             r"|(?P<wicd>ieee.*implement)", re.IGNORECASE)
+
+# Class name in the string representation of a type: <class 'gi.repository.Gtk.Label'>
+TYPE_NAME = re.compile(r"'(.*)'")
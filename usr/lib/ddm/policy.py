@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+
+# Apply a declarative driver policy without user interaction (ddm -P policy)
+#
+# The policy file is a key=value file with the backend driver as key:
+#   nvidia=install
+#   broadcom=purge
+#   ati=keep
+#   pae=install
+#   backports=false
+#
+# install: install the driver when the hardware is found and the driver is not installed
+# purge:   purge the driver when it is installed or loaded
+# keep:    leave the driver as it is (default for drivers not in the policy)
+#
+# A driver counts as installed when its module is loaded or its package is installed,
+# so running the policy again before a reboot does not reinstall anything.
+#
+# Exit codes
+# 0  - Compliant: nothing to do
+# 1  - Not root
+# 2  - Invalid policy or parameters
+# 3-9 - Error from the backend (see /usr/bin/ddm)
+# 10 - Changes applied (--dry-run: changes needed)
+
+import os
+import sys
+import argparse
+import subprocess
+from os.path import join, abspath, dirname, exists
+sys.path.insert(1, abspath(dirname(__file__)))
+
+from hardware import HardwareDetector
+from logger import Logger, tracer
+from utils import get_config_dict, logCacheStats
+
+BACKEND_PATH = join(abspath(dirname(__file__)), '../../bin/ddm')
+ACTIONS = ['install', 'purge', 'keep']
+EXIT_COMPLIANT = 0
+EXIT_NOT_ROOT = 1
+EXIT_INVALID = 2
+EXIT_CHANGED = 10
+
+
+# Return the policy as dict: {backend: action}, backports
+# Raises ValueError for unknown keys or actions
+def read_policy(policyPath, backends):
+    if not exists(policyPath):
+        raise ValueError("Policy file not found: {}".format(policyPath))
+    policy = {}
+    backports = False
+    for key, value in get_config_dict(policyPath).items():
+        key = key.lower()
+        value = value.strip().lower()
+        if key == 'backports':
+            if value not in ['true', 'false']:
+                raise ValueError("backports must be true or false: {}".format(value))
+            backports = value == 'true'
+        elif key not in backends:
+            raise ValueError("Unknown driver: {} (known: {})".format(key, ', '.join(sorted(backends))))
+        elif value not in ACTIONS:
+            raise ValueError("Unknown action for {}: {} (known: {})".format(key, value, ', '.join(ACTIONS)))
+        else:
+            policy[key] = value
+    return policy, backports
+
+
+# Compare the detected hardware with the policy
+# Returns [(current state, wanted state, manufacturer id)] for DriverRules.get_arguments
+def get_changes(detector, hardware, policy):
+    rules = detector.get_driver_rules()
+    packages = [rules.get_package(hw.driver) for hw in hardware]
+    versions = detector.get_installed_versions(packages)
+
+    changes = []
+    for hw, package in zip(hardware, packages):
+        backend = rules.get_backend(hw.manufacturerId)
+        installed = hw.selected or versions.get(package, '') != ''
+        action = policy.get(backend, 'keep')
+        wanted = installed
+        if action == 'install':
+            wanted = True
+        elif action == 'purge':
+            wanted = False
+        detector.log.write("{}: {} ({}, installed: {})".format(action, hw.description, package, installed), 'policy')
+        changes.append((installed, wanted, hw.manufacturerId))
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply a DDM driver policy")
+    parser.add_argument('policy', help='Policy file')
+    parser.add_argument('-n', '--dry-run', action="store_true", help='Only show the changes')
+    parser.add_argument('-t', action="store_true", help='Testing only: use pre-defined hardware')
+    parser.add_argument('--log', default='', help='Log file (default: LOG in /usr/bin/ddm)')
+    try:
+        args = parser.parse_args()
+    except SystemExit as detail:
+        return EXIT_INVALID if detail.code else EXIT_COMPLIANT
+
+    if not args.dry_run and os.geteuid() != 0:
+        print("Run as root")
+        return EXIT_NOT_ROOT
+
+    # Log to the backend's log file when possible, else to the console only
+    logPath = args.log or get_config_dict(BACKEND_PATH).get('LOG', '')
+    if logPath and not os.access(logPath if exists(logPath) else dirname(logPath), os.W_OK):
+        logPath = ''
+    log = Logger(logPath, addLogTime=False, maxSizeKB=5120)
+
+    tracer.reset()
+    detector = HardwareDetector(log, args.t)
+
+    rules = detector.get_driver_rules()
+    try:
+        policy, backports = read_policy(args.policy, set(rules.backends.values()))
+    except ValueError as detail:
+        log.write(str(detail), 'policy', 'error', False)
+        return EXIT_INVALID
+
+    # Headless scan
+    hardware = detector.get_supported_hardware()
+    arguments = rules.get_arguments(get_changes(detector, hardware, policy))
+    tracer.finish(log)
+    logCacheStats(log)
+
+    if not arguments:
+        log.write("Compliant with {}".format(args.policy), 'policy', 'info')
+        return EXIT_COMPLIANT
+
+    if backports:
+        arguments.append('-b')
+    if args.t:
+        arguments.append('-t')
+    command = "{} {}".format(detector.backendPath, ' '.join(arguments))
+    log.write("Command to execute: {}".format(command), 'policy', 'info')
+    if args.dry_run:
+        return EXIT_CHANGED
+
+    # The backend checks the mirrors or the proxy of apt before it downloads (preflight, exit code 9)
+    ret = subprocess.call(command, shell=True)
+    if ret != 0:
+        log.write("{} exited with code {}".format(command, ret), 'policy', 'error', False)
+        return ret
+    return EXIT_CHANGED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,303 @@
+#! /usr/bin/env python3
+
+# Check whether an install can succeed before anything is downloaded
+#
+# All checks run at the same time and the report is ready within DEADLINE
+# seconds. A check returns one of:
+#   ok       Nothing wrong
+#   warning  The install continues (e.g. the dpkg lock is held: ddm waits)
+#   error    The install is blocked
+#
+# Usage: preflight.py -i "nvidia pae" -p broadcom [-t]
+#
+# Exit codes
+# 0 - No errors
+# 9 - The install is blocked
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+from urllib.parse import urlparse
+from os.path import abspath, dirname, exists
+sys.path.insert(1, abspath(dirname(__file__)))
+
+from aptlock import get_lock_holders, get_process_name
+from mirrors import get_sources
+from drivers import RULES, VGA
+from patterns import APT_PROXY, ATI_CARD, ATI_SERIES, LSPCI_DEVICE
+from utils import getoutput, getPackageVersion
+
+OK = 'ok'
+WARNING = 'warning'
+ERROR = 'error'
+# Seconds to wait for all checks
+DEADLINE = 0.9
+# Seconds to connect to a mirror
+MIRROR_TIMEOUT = 0.5
+# Seconds to resolve the names of the mirrors and connect to them
+MIRROR_DEADLINE = 0.8
+# Drivers that build a kernel module with DKMS
+DKMS_DRIVERS = ['nvidia', 'ati', 'broadcom']
+# Free space needed in MB for the downloads and the kernel modules of a driver
+SPACE_PATHS = ['/var/cache/apt/archives', '/lib/modules']
+DRIVER_SPACE_MB = {'nvidia': (300, 50), 'ati': (200, 20), 'broadcom': (10, 5), 'pae': (80, 250)}
+DEFAULT_SPACE_MB = (100, 0)
+EXIT_OK = 0
+EXIT_BLOCKED = 9
+
+
+# A function called in a daemon thread: a call that hangs (e.g. a name lookup, which has
+# no timeout) neither delays the report nor keeps the process alive at exit
+class Call(threading.Thread):
+
+    def __init__(self, func, *args):
+        super(Call, self).__init__(daemon=True)
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as detail:
+            self.error = detail
+
+
+# Start the calls at the same time and wait at most timeout seconds for all of them
+def call_all(calls, timeout):
+    for call in calls:
+        call.start()
+    deadline = time.monotonic() + timeout
+    for call in calls:
+        call.join(max(0, deadline - time.monotonic()))
+    return calls
+
+
+# The result of a check
+class CheckResult(object):
+    __slots__ = ('name', 'status', 'message')
+
+    def __init__(self, name, status, message):
+        self.name = name
+        self.status = status
+        self.message = message
+
+
+# Return the installs and purges of backend arguments: ['-i nvidia', '-p broadcom', '-b']
+def parse_arguments(arguments):
+    install = []
+    purge = []
+    for argument in arguments:
+        option, _, drivers = argument.partition(' ')
+        if option == '-i':
+            install.extend(drivers.split())
+        elif option == '-p':
+            purge.extend(drivers.split())
+    return install, purge
+
+
+# Return (host, port) of the mirrors in the sources lists
+def get_mirrors(sourcesPaths=None):
+    mirrors = []
+    for source in get_sources(sourcesPaths):
+        url = urlparse(source.uri)
+        if url.scheme in ('http', 'https', 'ftp') and url.hostname:
+            port = url.port or {'http': 80, 'https': 443, 'ftp': 21}[url.scheme]
+            if (url.hostname, port) not in mirrors:
+                mirrors.append((url.hostname, port))
+    return mirrors
+
+
+# Return ([(host, port)] of the proxies apt uses, whether apt finds its proxy with a command)
+# Per host settings (Acquire::http::Proxy::host) are ignored
+def get_proxies():
+    uris = []
+    autoDetect = False
+    for line in getoutput("apt-config dump Acquire"):
+        matchObj = APT_PROXY.search(line)
+        if matchObj and matchObj.group(2):
+            autoDetect = autoDetect or bool(matchObj.group(3))
+        elif matchObj:
+            uris.append(matchObj.group(3))
+    # apt only uses the environment when the proxy is not configured
+    if not uris:
+        uris = [os.environ.get(name, '') for name in ('http_proxy', 'https_proxy')]
+    proxies = []
+    for uri in uris:
+        url = urlparse(uri)
+        if url.scheme in ('http', 'https') and url.hostname:
+            port = url.port or {'http': 80, 'https': 443}[url.scheme]
+            if (url.hostname, port) not in proxies:
+                proxies.append((url.hostname, port))
+    return proxies, autoDetect
+
+
+def can_connect(mirror):
+    try:
+        socket.create_connection(mirror, MIRROR_TIMEOUT).close()
+        return True
+    except (OSError, socket.timeout):
+        return False
+
+
+# Connect to the hosts at the same time: returns the hosts that can be reached and
+# the hosts without an answer in time (the name lookup is part of the call)
+def get_reachable(hosts):
+    calls = call_all([Call(can_connect, host) for host in hosts], MIRROR_DEADLINE)
+    return ([host for host, call in zip(hosts, calls) if call.result],
+            [host for host, call in zip(hosts, calls) if call.is_alive()])
+
+
+# Return the first existing directory of path and its parents
+def get_existing_dir(path):
+    while not exists(path) and path != '/':
+        path = dirname(path)
+    return path
+
+
+# Return the descriptions of the ATI/AMD graphics cards (like detect_ati in /usr/bin/ddm)
+def get_ati_cards():
+    cards = []
+    for line in getoutput("lspci -nn -d 1002:"):
+        matchObj = LSPCI_DEVICE.search(line)
+        if matchObj and matchObj.group(2) == VGA:
+            cards.append(matchObj.group(3))
+    return cards
+
+
+class Preflight(object):
+
+    def __init__(self, install, purge, test=False):
+        self.install = install
+        self.purge = purge
+        self.test = test
+
+    # Return the checks for this transaction: [(name, function)]
+    def get_checks(self):
+        checks = [('lock', self.check_lock)]
+        if self.install:
+            checks.append(('space', self.check_space))
+            checks.append(('mirror', self.check_mirrors))
+        if any(driver in DKMS_DRIVERS for driver in self.install):
+            checks.append(('headers', self.check_headers))
+        if 'ati' in self.install:
+            checks.append(('card', self.check_ati_card))
+        return checks
+
+    # Run all checks at the same time: returns [CheckResult]
+    def run(self):
+        checks = self.get_checks()
+        calls = call_all([Call(func) for name, func in checks], DEADLINE)
+
+        results = []
+        for (name, func), call in zip(checks, calls):
+            if call.is_alive():
+                results.append(CheckResult(name, WARNING, "Check did not finish in time"))
+            elif call.error is not None:
+                results.append(CheckResult(name, WARNING, "Check failed: {}".format(call.error)))
+            else:
+                status, message = call.result
+                results.append(CheckResult(name, status, message))
+        return results
+
+    def check_lock(self):
+        holders = get_lock_holders()
+        if holders:
+            path, pid = holders[0]
+            return WARNING, "{} (pid {}) holds {}: the install waits for it".format(get_process_name(pid), pid, path)
+        return OK, "The package manager is not locked"
+
+    # The drivers to install add up; directories on the same file system share its free space
+    def check_space(self):
+        needed = {}
+        for driver in self.install:
+            for path, size in zip(SPACE_PATHS, DRIVER_SPACE_MB.get(driver, DEFAULT_SPACE_MB)):
+                directory = get_existing_dir(path)
+                device = os.stat(directory).st_dev
+                needed.setdefault(device, [directory, 0])[1] += size
+        for directory, minFree in needed.values():
+            st = os.statvfs(directory)
+            free = st.f_bavail * st.f_frsize // (1024 * 1024)
+            if free < minFree:
+                return ERROR, "Not enough free space in {}: {} MB free, {} MB needed".format(directory, free, minFree)
+        return OK, "Enough free space"
+
+    # With a proxy apt only connects to the proxy: the mirrors may not be reachable directly
+    def check_mirrors(self):
+        proxies, autoDetect = get_proxies()
+        if proxies:
+            reachable, pending = get_reachable(proxies)
+            if not reachable:
+                message = "The proxy cannot be reached: {}".format(', '.join(host for host, port in proxies))
+                return (WARNING if pending else ERROR), message
+            return OK, "The proxy can be reached"
+        mirrors = get_mirrors()
+        if not mirrors:
+            return WARNING, "No mirrors found in the sources lists"
+        reachable, pending = get_reachable(mirrors)
+        if not reachable:
+            message = "No mirror can be reached: {}".format(', '.join(host for host, port in mirrors))
+            # A slow name lookup, or the proxy that apt detects, may still reach them
+            return (WARNING if pending or autoDetect else ERROR), message
+        if len(reachable) < len(mirrors):
+            unreachable = [host for host, port in mirrors if (host, port) not in reachable]
+            return WARNING, "Mirrors that cannot be reached: {}".format(', '.join(unreachable))
+        return OK, "All mirrors can be reached"
+
+    def check_headers(self):
+        package = "linux-headers-{}".format(os.uname().release)
+        if getPackageVersion(package) or getPackageVersion(package, candidate=True):
+            return OK, "{} is available".format(package)
+        return ERROR, "{} is not available: the driver module cannot be built".format(package)
+
+    # The card must match the ati driver rule, including its lowest Radeon HD series
+    def check_ati_card(self):
+        minSeries = [rule for rule in RULES if rule.get('backend') == 'ati'][0]['minSeries']
+        if self.test:
+            cards = ['Advanced Micro Devices, Inc. [AMD/ATI] Bonaire [FirePro W5100]']
+        else:
+            cards = get_ati_cards()
+        if not cards:
+            # The backend skips the ati driver without a card (exit code 0)
+            return WARNING, "No ATI card found: the ati driver is not installed"
+        for card in cards:
+            matchObj = ATI_CARD.search(card)
+            if not matchObj:
+                return ERROR, "This card is not supported: {}".format(card)
+            if " hd " in matchObj.group(0).lower():
+                matchObjSeries = ATI_SERIES.search(matchObj.group(0))
+                if matchObjSeries and int(matchObjSeries.group(0)) < minSeries:
+                    return ERROR, "Radeon HD {} cards are not supported: {}".format(matchObjSeries.group(0), card)
+        return OK, "The ATI card is supported"
+
+
+# Return the report as text: one line per check
+def get_report(results):
+    return '\n'.join("{:8} {:8} {}".format(r.status.upper(), r.name, r.message) for r in results)
+
+
+def has_errors(results):
+    return any(r.status == ERROR for r in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check whether DDM can install or purge the drivers")
+    parser.add_argument('-i', action='append', default=[], help='Drivers to install')
+    parser.add_argument('-p', action='append', default=[], help='Drivers to purge')
+    parser.add_argument('-t', action="store_true", help='Testing only: use pre-defined hardware')
+    args = parser.parse_args()
+
+    install = ' '.join(args.i).split()
+    purge = ' '.join(args.p).split()
+    results = Preflight(install, purge, args.t).run()
+    print(get_report(results))
+    sys.stdout.flush()
+    return EXIT_BLOCKED if has_errors(results) else EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
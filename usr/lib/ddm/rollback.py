@@ -0,0 +1,345 @@
+#! /usr/bin/env python3
+
+# Rollback snapshots of the packages a DDM transaction changes
+#
+# Before a transaction the backend starts a snapshot (begin) and exports its
+# directory as DDM_ROLLBACK. apt runs rollback-hook before every dpkg run
+# (DPkg::Pre-Install-Pkgs, version 3): the version of every package dpkg is
+# about to install, upgrade, downgrade or remove is recorded, and the .deb of
+# a replaced version is kept in the snapshot. Only the first version seen of a
+# package is recorded: the state before the whole transaction.
+#
+# ddm --rollback restores that state from the snapshot without network: the
+# kept packages are installed and the packages the transaction added are
+# purged in one apt-get transaction (plan), then the driver configuration
+# files are restored (finish).
+#
+# Usage: rollback.py begin [--deb-cache DIR] [--description TEXT]
+#        rollback.py hook < apt hook information
+#        rollback.py save-debs package.deb...
+#        rollback.py plan | finish | list
+#
+# Exit codes
+# 0  - Done
+# 11 - Nothing to roll back or a package of the snapshot is missing
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from glob import glob
+from os.path import join, basename, exists, isdir
+from subprocess import run, DEVNULL, PIPE
+from utils import memoize
+
+ROLLBACK_DIR = '/var/lib/ddm/rollback'
+ARCHIVES = '/var/cache/apt/archives'
+# Snapshots to keep
+KEEP = 3
+# Driver configuration written by the backend
+CONFIG_FILES = ['/etc/X11/xorg.conf', '/etc/modprobe.d/blacklist-nouveau.conf',
+                '/etc/modprobe.d/blacklist-broadcom.conf']
+CONFIG_PATTERNS = ['/etc/modprobe.d/nvidia*']
+RESTORED = '.restored'
+EXIT_OK = 0
+EXIT_NOTHING = 11
+
+
+@memoize
+def get_native_arch():
+    return run(['dpkg', '--print-architecture'], stdout=PIPE, universal_newlines=True).stdout.strip()
+
+
+# Return the package name as dpkg and apt show it: with the architecture only for foreign packages
+def get_key(package, arch):
+    if arch in ('all', get_native_arch()):
+        return package
+    return "{}:{}".format(package, arch)
+
+
+class Snapshot(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.debsDir = join(path, 'debs')
+        self.filesDir = join(path, 'files')
+        self.infoPath = join(path, 'snapshot.json')
+        # packages: {package: version before the transaction or None when it was not installed}
+        # debs: {package: kept package file}
+        # Foreign packages are named package:arch
+        self.info = {'created': time.time(), 'description': '', 'debCache': '',
+                     'packages': {}, 'debs': {}, 'files': {}}
+        if exists(self.infoPath):
+            with open(self.infoPath) as f:
+                self.info.update(json.load(f))
+
+    def save(self):
+        tmp = self.infoPath + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.info, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.infoPath)
+
+    # Keep the driver configuration files: {path: kept copy or None when it did not exist}
+    def save_files(self):
+        os.makedirs(self.filesDir, exist_ok=True)
+        paths = list(CONFIG_FILES)
+        for pattern in CONFIG_PATTERNS:
+            paths.extend(sorted(glob(pattern)))
+        for i, path in enumerate(paths):
+            if exists(path):
+                copy = join(self.filesDir, "{}-{}".format(i, basename(path)))
+                shutil.copy2(path, copy)
+                self.info['files'][path] = copy
+            else:
+                self.info['files'][path] = None
+
+    def restore_files(self):
+        for path, copy in self.info['files'].items():
+            if copy is None:
+                if exists(path):
+                    os.remove(path)
+                    print("Removed {}".format(path))
+            elif exists(copy):
+                shutil.copy2(copy, path)
+                print("Restored {}".format(path))
+        # Configuration of the drivers installed by the transaction
+        for pattern in CONFIG_PATTERNS:
+            for path in glob(pattern):
+                if path not in self.info['files']:
+                    os.remove(path)
+                    print("Removed {}".format(path))
+
+    # Record the version of a package before it changes and keep the replaced package file
+    def record(self, package, arch, oldVersion, newVersion):
+        key = get_key(package, arch)
+        if key in self.info['packages']:
+            return
+        self.info['packages'][key] = oldVersion
+        if oldVersion is not None and oldVersion != newVersion:
+            deb = self.keep_deb(package, arch, oldVersion)
+            if deb:
+                self.info['debs'][key] = deb
+            else:
+                print("Rollback: no package file for {} {}".format(key, oldVersion))
+
+    # Copy the package file of an installed version into the snapshot
+    # Looks in apt's archive and the package cache, then rebuilds it with dpkg-repack
+    # and downloads it as the last resort
+    def keep_deb(self, package, arch, version):
+        key = get_key(package, arch)
+        os.makedirs(self.debsDir, exist_ok=True)
+        # apt shows the native architecture for architecture independent packages
+        names = ["{}_{}_{}.deb".format(package, version.replace(':', '%3a'), a) for a in (arch, 'all')]
+        target = join(self.debsDir, names[0])
+        for path in [join(ARCHIVES, name) for name in names] + self.get_cached_debs(package, version):
+            if exists(path):
+                shutil.copy2(path, target)
+                return target
+        # Build and download in an empty directory: only the file of this package shows up there
+        workDir = tempfile.mkdtemp(dir=self.debsDir)
+        try:
+            if shutil.which('dpkg-repack'):
+                run(['dpkg-repack', key], cwd=workDir, stdout=DEVNULL, stderr=DEVNULL)
+            if not glob(join(workDir, '*.deb')):
+                run(['apt-get', 'download', '-qq', "{}={}".format(key, version)],
+                    cwd=workDir, stdout=DEVNULL, stderr=DEVNULL)
+            # The file is named after the version without epoch
+            debs = glob(join(workDir, '*.deb'))
+            if debs:
+                os.replace(debs[0], target)
+                return target
+            return None
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    # Return the files of a package version in the package cache of the backend (DEB_CACHE)
+    def get_cached_debs(self, package, version):
+        debCache = self.info['debCache']
+        if not debCache or not exists(join(debCache, 'index')):
+            return []
+        paths = []
+        with open(join(debCache, 'index')) as f:
+            for line in f:
+                fields = line.split()
+                if fields[:2] == [package, version] and len(fields) == 4:
+                    paths.append(join(debCache, fields[3] + '.deb'))
+        return paths
+
+
+# Return the snapshot directories, newest first
+def get_snapshot_paths(includeRestored=False):
+    paths = sorted(glob(join(ROLLBACK_DIR, '*')), reverse=True)
+    return [p for p in paths if isdir(p) and (includeRestored or not p.endswith(RESTORED))]
+
+
+# Return the newest snapshot that recorded packages
+def get_last_snapshot():
+    for path in get_snapshot_paths():
+        snapshot = Snapshot(path)
+        if snapshot.info['packages']:
+            return snapshot
+    return None
+
+
+# Return {package: version} of the installed packages
+def get_installed(keys):
+    if not keys:
+        return {}
+    # ${binary:Package} adds the architecture to all Multi-Arch: same packages: name them like get_key
+    result = run(['dpkg-query', '-W', '-f=${Package} ${Architecture} ${Version} ${db:Status-Abbrev}\n'] + list(keys),
+                 stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+    installed = {}
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        # Installed, also when held
+        if len(fields) == 4 and fields[3][1:2] == 'i':
+            installed[get_key(fields[0], fields[1])] = fields[2]
+    return installed
+
+
+# Start a snapshot and print its directory
+def begin(debCache, description):
+    paths = get_snapshot_paths(includeRestored=True)
+    # Drop snapshots without packages and the oldest
+    for i, path in enumerate(paths):
+        if i >= KEEP - 1 or not Snapshot(path).info['packages']:
+            shutil.rmtree(path, ignore_errors=True)
+    path = join(ROLLBACK_DIR, time.strftime('%Y%m%d-%H%M%S'))
+    while exists(path):
+        path += '-1'
+    os.makedirs(path)
+    snapshot = Snapshot(path)
+    snapshot.info['debCache'] = debCache
+    snapshot.info['description'] = description
+    snapshot.save_files()
+    snapshot.save()
+    print(path)
+
+
+# Read the apt hook information (version 2 or 3) and record the packages
+# Version 3 line: package old-version old-arch old-multiarch direction new-version new-arch new-multiarch action
+def hook(snapshot, lines):
+    inPackages = False
+    for line in lines:
+        line = line.strip()
+        if not inPackages:
+            # The configuration ends with an empty line
+            inPackages = line == ''
+            continue
+        fields = line.split()
+        if len(fields) == 9:
+            package, oldVersion, oldArch, _, _, newVersion, newArch, _, action = fields
+        elif len(fields) == 5:
+            package, oldVersion, _, newVersion, action = fields
+            oldArch = newArch = get_native_arch()
+        else:
+            continue
+        if action == '**CONFIGURE**':
+            continue
+        arch = oldArch if oldVersion != '-' else newArch
+        if arch == 'none' or arch == '-':
+            continue
+        oldVersion = None if oldVersion == '-' else oldVersion
+        newVersion = None if newVersion == '-' or action == '**REMOVE**' else newVersion
+        snapshot.record(package, arch, oldVersion, newVersion)
+    snapshot.save()
+
+
+# Record the packages that dpkg -i is about to replace
+def save_debs(snapshot, debs):
+    for deb in debs:
+        result = run(['dpkg-deb', '-W', '--showformat=${Package} ${Version} ${Architecture}', deb],
+                     stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+        fields = result.stdout.split()
+        if len(fields) != 3:
+            continue
+        package, version, arch = fields
+        key = get_key(package, arch)
+        snapshot.record(package, arch, get_installed([key]).get(key), version)
+    snapshot.save()
+
+
+# Print the apt-get install arguments that restore the snapshot: package files and package- to purge
+def plan(snapshot):
+    packages = snapshot.info['packages']
+    installed = get_installed(packages)
+    arguments = []
+    missing = []
+    for key, version in sorted(packages.items()):
+        current = installed.get(key)
+        if version is None:
+            if current is not None:
+                arguments.append(key + '-')
+        elif current != version:
+            deb = snapshot.info['debs'].get(key)
+            if deb and exists(deb):
+                arguments.append(deb)
+            else:
+                missing.append("{} {}".format(key, version))
+    if missing:
+        print("Packages missing in {}: {}".format(snapshot.path, ', '.join(missing)))
+        return EXIT_NOTHING
+    print('\n'.join(arguments))
+    return EXIT_OK
+
+
+# Restore the configuration files and mark the snapshot as restored
+def finish(snapshot):
+    snapshot.restore_files()
+    os.rename(snapshot.path, snapshot.path + RESTORED)
+    print("Rolled back: {}".format(snapshot.info['description'] or basename(snapshot.path)))
+
+
+def list_snapshots():
+    for path in get_snapshot_paths(includeRestored=True):
+        snapshot = Snapshot(path)
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.info['created']))
+        print("{}  {}  {} packages  {}".format(created, snapshot.info['description'],
+                                               len(snapshot.info['packages']), path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rollback snapshots of DDM transactions")
+    parser.add_argument('action', choices=['begin', 'hook', 'save-debs', 'plan', 'finish', 'list'])
+    parser.add_argument('debs', nargs='*', help='Package files (save-debs)')
+    parser.add_argument('--deb-cache', default='', help='Package cache of the backend (begin)')
+    parser.add_argument('--description', default='', help='Description of the transaction (begin)')
+    args = parser.parse_args()
+
+    if args.action == 'begin':
+        begin(args.deb_cache, args.description)
+        return EXIT_OK
+    if args.action == 'list':
+        list_snapshots()
+        return EXIT_OK
+
+    if args.action in ('hook', 'save-debs'):
+        # Only during a transaction of the backend, and never stop apt or dpkg
+        path = os.environ.get('DDM_ROLLBACK', '')
+        lines = sys.stdin.readlines() if args.action == 'hook' else []
+        if not path or not isdir(path):
+            return EXIT_OK
+        try:
+            if args.action == 'hook':
+                hook(Snapshot(path), lines)
+            else:
+                save_debs(Snapshot(path), args.debs)
+        except Exception as detail:
+            print("Rollback: cannot record the packages: {}".format(detail))
+        return EXIT_OK
+
+    snapshot = get_last_snapshot()
+    if snapshot is None:
+        print("Nothing to roll back")
+        return EXIT_NOTHING
+    if args.action == 'plan':
+        return plan(snapshot)
+    finish(snapshot)
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
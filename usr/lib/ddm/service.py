@@ -0,0 +1,395 @@
+#! /usr/bin/env python3
+
+# Privileged helper service on D-Bus, so the GUI does not have to run as root
+#
+# The helper is started by D-Bus activation (org.solydxk.DDM on the system bus)
+# and keeps the hardware scan, the package version cache and the log search
+# cache in memory until it has been idle for IDLE_TIMEOUT seconds.
+# Scanning is allowed for everybody, installing and purging needs the polkit
+# authorization org.solydxk.ddm.install.
+#
+# Usage:
+#   service.py                        System bus (D-Bus activation)
+#   service.py --address ADDRESS -t   Private bus for testing (no polkit)
+#   ddm --bus ADDRESS -t              GUI on that private bus
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import Future
+from os.path import join, abspath, dirname
+sys.path.insert(1, abspath(dirname(__file__)))
+
+from gi.repository import Gio, GLib
+
+from drivers import DriverRules
+from executor import get_executor, CommandResult
+from hardware import HardwareDetector, HardwareEntry
+from hotplug import PCI_SLOT
+from logger import Logger, tracer
+from utils import get_config_dict, mtimes, logCacheStats
+
+BUS_NAME = 'org.solydxk.DDM'
+OBJECT_PATH = '/org/solydxk/DDM'
+INTERFACE = 'org.solydxk.DDM'
+ERROR_NAME = 'org.solydxk.DDM.Error'
+POLKIT_ACTION = 'org.solydxk.ddm.install'
+BACKEND_PATH = join(abspath(dirname(__file__)), '../../bin/ddm')
+# Seconds without requests or running jobs before the helper exits
+IDLE_TIMEOUT = 600
+# Milliseconds to wait for a scan
+SCAN_TIMEOUT = 120000
+# Backend arguments the helper accepts: -b, -d, -i driver(s), -p driver(s)
+ARGUMENT = re.compile(r'^-([bd]|[ip] [a-z]+( [a-z]+)*)$')
+# Drivers for the pre-defined test hardware: only on a private bus, never as root for this machine
+TEST_ARGUMENT = '-t'
+
+INTROSPECTION = """
+<node>
+  <interface name="org.solydxk.DDM">
+    <method name="Scan">
+      <arg name="rescan" type="b" direction="in"/>
+      <arg name="scan" type="s" direction="out"/>
+    </method>
+    <method name="ScanDevice">
+      <arg name="slot" type="s" direction="in"/>
+      <arg name="entry" type="s" direction="out"/>
+    </method>
+    <method name="Run">
+      <arg name="arguments" type="as" direction="in"/>
+      <arg name="job" type="u" direction="out"/>
+    </method>
+    <method name="Cancel">
+      <arg name="job" type="u" direction="in"/>
+    </method>
+    <signal name="Output">
+      <arg name="job" type="u"/>
+      <arg name="line" type="s"/>
+    </signal>
+    <signal name="Finished">
+      <arg name="job" type="u"/>
+      <arg name="returncode" type="i"/>
+      <arg name="cancelled" type="b"/>
+    </signal>
+  </interface>
+</node>
+"""
+
+
+# Return a HardwareEntry as dict (JSON)
+def entry_to_dict(entry):
+    return dict((name, getattr(entry, name)) for name in HardwareEntry.__slots__)
+
+
+def dict_to_entry(d):
+    return HardwareEntry(d['selected'], d['logo'], d['description'], d['driver'],
+                         d['manufacturerId'], d['deviceId'], d['slot'])
+
+
+# Return a connection to the system bus, or to the bus at address (private bus)
+def connect(address=None):
+    if address:
+        flags = Gio.DBusConnectionFlags.AUTHENTICATION_CLIENT | Gio.DBusConnectionFlags.MESSAGE_BUS_CONNECTION
+        return Gio.DBusConnection.new_for_address_sync(address, flags, None, None)
+    return Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+
+
+class DDMService(object):
+
+    def __init__(self, log, connection, test=False, usePolkit=True):
+        self.log = log
+        self.connection = connection
+        self.usePolkit = usePolkit
+        self.detector = HardwareDetector(log, test)
+        self.executor = get_executor()
+        # The scan is done again when dpkg changed something
+        self.scan = None
+        self.scanKey = None
+        self.scanInvalidate = mtimes('/var/lib/dpkg/status')
+        # One scan at a time: the scans share the detector
+        self.scanLock = threading.Lock()
+        # {job: (future, sender)}
+        self.jobs = {}
+        self.nextJob = 1
+        self.lastRequest = time.monotonic()
+
+        nodeInfo = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION)
+        connection.register_object(OBJECT_PATH, nodeInfo.interfaces[0], self.on_method_call, None, None)
+
+    def on_method_call(self, connection, sender, path, interface, method, parameters, invocation):
+        self.lastRequest = time.monotonic()
+        try:
+            if method == 'Scan':
+                self.submit_scan(invocation, self.get_scan, *parameters.unpack())
+            elif method == 'ScanDevice':
+                self.submit_scan(invocation, self.scan_device, *parameters.unpack())
+            elif method in ('Run', 'Cancel'):
+                self.authorize(sender, lambda: self.on_authorized(sender, method, parameters.unpack(), invocation), invocation)
+            else:
+                invocation.return_dbus_error(ERROR_NAME, "Unknown method: {}".format(method))
+        except Exception as detail:
+            self.log.write("{} failed: {}".format(method, detail), 'DDMService', 'error', False)
+            invocation.return_dbus_error(ERROR_NAME, str(detail))
+
+    def on_authorized(self, sender, method, args, invocation):
+        try:
+            if method == 'Run':
+                invocation.return_value(GLib.Variant('(u)', (self.run(sender, *args),)))
+            else:
+                self.cancel(sender, *args)
+                invocation.return_value(None)
+        except Exception as detail:
+            self.log.write("{} failed: {}".format(method, detail), 'DDMService', 'error', False)
+            invocation.return_dbus_error(ERROR_NAME, str(detail))
+
+    # Scan on a worker thread: the main loop keeps serving Cancel and the output of the jobs
+    def submit_scan(self, invocation, func, *args):
+        def scan():
+            with self.scanLock:
+                return func(*args)
+
+        def on_done(future):
+            try:
+                invocation.return_value(GLib.Variant('(s)', (future.result(),)))
+            except Exception as detail:
+                self.log.write("Scan failed: {}".format(detail), 'DDMService', 'error', False)
+                invocation.return_dbus_error(ERROR_NAME, str(detail))
+
+        self.executor.submit_call(scan, callback=on_done, dispatch=GLib.idle_add)
+
+    # Ask polkit whether the caller may change the drivers (asynchronously: polkit may ask a password)
+    # Only on the system bus: on a private bus the helper runs as the user itself
+    def authorize(self, sender, onAuthorized, invocation):
+        if not self.usePolkit:
+            onAuthorized()
+            return
+
+        def on_reply(connection, res):
+            try:
+                isAuthorized = connection.call_finish(res).unpack()[0][0]
+            except GLib.Error as detail:
+                self.log.write("Polkit: {}".format(detail), 'DDMService', 'error', False)
+                isAuthorized = False
+            if isAuthorized:
+                onAuthorized()
+            else:
+                invocation.return_dbus_error(ERROR_NAME, "Not authorized")
+
+        subject = ('system-bus-name', {'name': GLib.Variant('s', sender)})
+        # Flag 1: allow user interaction (ask a password)
+        self.connection.call('org.freedesktop.PolicyKit1', '/org/freedesktop/PolicyKit1/Authority',
+                             'org.freedesktop.PolicyKit1.Authority', 'CheckAuthorization',
+                             GLib.Variant('((sa{sv})sa{ss}us)', (subject, POLKIT_ACTION, {}, 1, '')),
+                             GLib.VariantType('((bba{ss}))'), Gio.DBusCallFlags.NONE, GLib.MAXINT, None, on_reply)
+
+    # Return the scan as JSON, from memory unless a rescan is asked or dpkg changed
+    def get_scan(self, rescan=False):
+        scanKey = self.scanInvalidate()
+        if self.scan is None or rescan or scanKey != self.scanKey:
+            tracer.reset()
+            hardware = self.detector.get_supported_hardware()
+            self.scan = {'hardware': [entry_to_dict(entry) for entry in hardware],
+                         'notSupported': self.detector.notSupported,
+                         'warnings': self.detector.warnings,
+                         'paeBooted': self.detector.paeBooted,
+                         'graphical': self.detector.get_loaded_driver('graphical'),
+                         'wireless': self.detector.get_loaded_driver('wireless')}
+            self.scanKey = scanKey
+            tracer.finish(self.log)
+            logCacheStats(self.log)
+        return json.dumps(self.scan)
+
+    # Rescan a single device: returns the entry as JSON or an empty string
+    def scan_device(self, slot):
+        # Any user may call ScanDevice: only a PCI slot reaches lspci
+        if not PCI_SLOT.fullmatch(slot):
+            raise ValueError("Invalid PCI slot: {}".format(slot))
+        entry = self.detector.scan_device(slot)
+        if self.scan is not None:
+            self.scan['hardware'] = [entry_to_dict(e) for e in self.detector.hardware]
+        return json.dumps(entry_to_dict(entry)) if entry is not None else ''
+
+    # Start the backend; output and result are sent to the caller as signals
+    def run(self, sender, arguments):
+        for argument in arguments:
+            if argument == TEST_ARGUMENT and not self.usePolkit:
+                continue
+            if not ARGUMENT.match(argument):
+                raise ValueError("Invalid argument: {}".format(argument))
+        job = self.nextJob
+        self.nextJob += 1
+        command = "{} {}".format(BACKEND_PATH, ' '.join(arguments))
+        self.log.write("Job {} for {}: {}".format(job, sender, command), 'DDMService', 'info')
+        future = self.executor.submit(command, callback=lambda f: self.on_job_done(job, f),
+                                      onLine=lambda line: self.emit(sender, 'Output', '(us)', (job, line)),
+                                      dispatch=GLib.idle_add)
+        self.jobs[job] = (future, sender)
+        return job
+
+    def cancel(self, sender, job):
+        future, owner = self.jobs.get(job, (None, None))
+        if future is None or owner != sender:
+            raise ValueError("Unknown job: {}".format(job))
+        self.log.write("Cancel job {}".format(job), 'DDMService', 'info')
+        self.executor.cancel(future)
+
+    def on_job_done(self, job, future):
+        future, sender = self.jobs.pop(job)
+        try:
+            result = future.result()
+            returncode, cancelled = result.returncode, result.cancelled
+        except Exception:
+            returncode, cancelled = -1, True
+        self.log.write("Job {} done: {}".format(job, returncode), 'DDMService', 'info')
+        # Packages changed: scan again on the next request
+        self.scan = None
+        self.emit(sender, 'Finished', '(uib)', (job, returncode, cancelled))
+
+    def emit(self, destination, signal, signature, args):
+        self.connection.emit_signal(destination, OBJECT_PATH, INTERFACE, signal, GLib.Variant(signature, args))
+
+    def is_idle(self):
+        return not self.jobs and time.monotonic() - self.lastRequest > IDLE_TIMEOUT
+
+
+# Detector for the GUI: the scan is done by the helper service
+class ServiceDetector(object):
+
+    def __init__(self, log, connection):
+        self.log = log
+        self.proxy = Gio.DBusProxy.new_sync(connection, Gio.DBusProxyFlags.DO_NOT_LOAD_PROPERTIES, None,
+                                            BUS_NAME, OBJECT_PATH, INTERFACE, None)
+        self.proxy.connect('g-signal', self.on_signal)
+        self.hardware = []
+        self.hardwareIndex = {}
+        self.notSupported = []
+        self.warnings = []
+        self.paeBooted = False
+        self.loadedDrivers = {}
+        self.driverRules = None
+        # {job: (future, onLine, arguments)}
+        self.jobs = {}
+
+    def call(self, method, signature, args, timeout=SCAN_TIMEOUT):
+        return self.proxy.call_sync(method, GLib.Variant(signature, args), Gio.DBusCallFlags.NONE, timeout, None).unpack()
+
+    def get_supported_hardware(self, rescan=False):
+        scan = json.loads(self.call('Scan', '(b)', (rescan,))[0])
+        self.hardware = [dict_to_entry(d) for d in scan['hardware']]
+        self.hardwareIndex = dict((entry.key, entry) for entry in self.hardware)
+        self.notSupported = scan['notSupported']
+        self.warnings = [tuple(warning) for warning in scan['warnings']]
+        self.paeBooted = scan['paeBooted']
+        self.loadedDrivers = {'graphical': scan['graphical'], 'wireless': scan['wireless']}
+        return self.hardware
+
+    def scan_device(self, slot):
+        entry = self.hardwareIndex.pop(slot, None)
+        if entry is not None:
+            self.hardware.remove(entry)
+        result = self.call('ScanDevice', '(s)', (slot,))[0]
+        if not result:
+            return None
+        entry = dict_to_entry(json.loads(result))
+        self.hardware.append(entry)
+        self.hardwareIndex[entry.key] = entry
+        return entry
+
+    def get_loaded_driver(self, kind):
+        return self.loadedDrivers.get(kind, '')
+
+    def get_loaded_graphical_driver(self):
+        return self.get_loaded_driver('graphical')
+
+    def get_loaded_wireless_driver(self):
+        return self.get_loaded_driver('wireless')
+
+    # The rules only read the device id lists of the backend script
+    def get_driver_rules(self):
+        if self.driverRules is None:
+            self.driverRules = DriverRules(idLists=get_config_dict(BACKEND_PATH))
+        return self.driverRules
+
+    # Run the backend with arguments in the helper; returns a future with a CommandResult
+    # Callbacks are called in the GLib main loop
+    def submit(self, arguments, callback=None, onLine=None):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        future.job = None
+        future.cancelRequested = False
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        def on_reply(proxy, res):
+            try:
+                future.job = proxy.call_finish(res).unpack()[0]
+            except GLib.Error as detail:
+                # Remove the D-Bus error name: GDBus.Error:org.solydxk.DDM.Error: Not authorized
+                future.set_exception(Exception(detail.message.split(': ', 1)[-1]))
+                return
+            self.jobs[future.job] = (future, onLine, ' '.join(arguments))
+            if future.cancelRequested:
+                self.cancel(future)
+
+        # No timeout: polkit may ask a password first
+        self.proxy.call('Run', GLib.Variant('(as)', (arguments,)), Gio.DBusCallFlags.NONE, GLib.MAXINT, None, on_reply)
+        return future
+
+    def cancel(self, future):
+        if future.job is None:
+            future.cancelRequested = True
+            return
+        self.proxy.call('Cancel', GLib.Variant('(u)', (future.job,)), Gio.DBusCallFlags.NONE, -1, None, None)
+
+    def on_signal(self, proxy, sender, signal, parameters):
+        args = parameters.unpack()
+        if args[0] not in self.jobs:
+            return
+        future, onLine, command = self.jobs[args[0]]
+        if signal == 'Output' and onLine is not None:
+            onLine(args[1])
+        elif signal == 'Finished':
+            del self.jobs[args[0]]
+            future.set_result(CommandResult(command, args[1], cancelled=args[2]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DDM helper service")
+    parser.add_argument('--address', help='Connect to the bus at ADDRESS (private bus for testing, no polkit)')
+    parser.add_argument('-t', action="store_true", help='Testing only: use pre-defined hardware')
+    args = parser.parse_args()
+
+    logPath = get_config_dict(BACKEND_PATH).get('LOG', '')
+    if logPath and not os.access(logPath if os.path.exists(logPath) else dirname(logPath), os.W_OK):
+        logPath = ''
+    log = Logger(logPath, maxSizeKB=5120)
+
+    # Nobody can answer debconf questions
+    os.environ['DEBIAN_FRONTEND'] = 'noninteractive'
+
+    loop = GLib.MainLoop()
+    connection = connect(args.address)
+    service = DDMService(log, connection, args.t, usePolkit=not args.address)
+
+    def on_name_lost(connection, name):
+        log.write("Lost bus name {}".format(name), 'DDMService', 'error', False)
+        loop.quit()
+
+    def check_idle():
+        if service.is_idle():
+            log.write("Idle: exit", 'DDMService')
+            loop.quit()
+            return False
+        return True
+
+    Gio.bus_own_name_on_connection(connection, BUS_NAME, Gio.BusNameOwnerFlags.NONE, None, on_name_lost)
+    GLib.timeout_add_seconds(60, check_idle)
+    loop.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#! /usr/bin/env python3
+
+# Capture the input of the hardware detection in a snapshot and replay it
+#
+# A snapshot is a tar.gz that looks like the root of the captured system,
+# the same layout as the benchmark fixtures (bench/fixtures):
+#   commands.json      Output of the commands the detection ran (lspci, uname, ...)
+#   sys/               PCI device attributes and DMI information
+#   var/log/           Start of the Xorg logs and end of the syslog
+#   var/lib/dpkg/      dpkg status of the driver related packages
+#   etc/apt/           Sources lists
+#   usr/share/nvidia/  Nvidia device id lists
+#
+# Usage:
+#   snapshot.py capture ddm-snapshot.tar.gz     (ddm -c ddm-snapshot.tar.gz)
+#   snapshot.py replay ddm-snapshot.tar.gz      Print the detected hardware
+#   ddm --replay ddm-snapshot.tar.gz            Show the snapshot in the GUI
+
+import io
+import os
+import sys
+import json
+import time
+import tarfile
+import tempfile
+from glob import glob
+from os.path import join, abspath, dirname, basename, isdir, islink, normpath
+sys.path.insert(1, abspath(dirname(__file__)))
+
+from hardware import HardwareDetector
+from journal import WIRELESS_COMMS, get_journal_command
+from logger import Logger, tracer
+from utils import getoutput, getDmiInfo
+
+# Log files are cut to this size: the Xorg modules are logged at the start,
+# the wireless driver is searched from the end of the syslog
+MAX_LOG_SIZE = 512 * 1024
+PCI_ATTRIBUTES = ['vendor', 'device', 'class', 'subsystem_vendor', 'subsystem_device', 'revision', 'modalias']
+DPKG_PACKAGES = ['nvidia', 'fglrx', 'broadcom', 'firmware', 'bumblebee', 'primus',
+                 'linux-image', 'linux-headers', 'xserver-xorg-video', 'dkms']
+EXTRA_COMMANDS = ['lspci -vnn', 'uname -a']
+
+
+# Return the dpkg status paragraphs of the driver related packages
+def get_dpkg_status_subset(statusPath='/var/lib/dpkg/status'):
+    paragraphs = []
+    try:
+        with open(statusPath, encoding='utf-8', errors='replace') as f:
+            for paragraph in f.read().split('\n\n'):
+                if paragraph.startswith('Package:'):
+                    package = paragraph.split('\n', 1)[0].split(':', 1)[1].strip()
+                    if any(name in package for name in DPKG_PACKAGES):
+                        paragraphs.append(paragraph.strip())
+    except (IOError, OSError):
+        pass
+    return '\n\n'.join(paragraphs) + '\n'
+
+
+# Return {package: installed version} from a dpkg status file
+def read_dpkg_status(statusPath):
+    versions = {}
+    try:
+        with open(statusPath, encoding='utf-8', errors='replace') as f:
+            for paragraph in f.read().split('\n\n'):
+                fields = dict(line.split(':', 1) for line in paragraph.splitlines() if ':' in line and not line[0].isspace())
+                if 'install ok installed' in fields.get('Status', ''):
+                    versions[fields['Package'].strip()] = fields.get('Version', '').strip()
+    except (IOError, OSError):
+        pass
+    return versions
+
+
+# Return the installed or candidate version from apt-cache policy output
+def parse_policy(lines, candidate=False):
+    field = 'Candidate:' if candidate else 'Installed:'
+    for line in lines:
+        if line.strip().startswith(field):
+            version = line.split(':', 1)[1].strip()
+            return '' if 'none' in version else version
+    return ''
+
+
+# Detector that records the output of every command it runs
+class CaptureDetector(HardwareDetector):
+
+    def __init__(self, log):
+        super(CaptureDetector, self).__init__(log)
+        self.commands = {}
+
+    def run(self, command):
+        output = getoutput(command)
+        self.commands[command] = '\n'.join(output)
+        return output
+
+    def get_package_version(self, package, candidate=False):
+        return parse_policy(self.run("env LANG=C apt-cache policy {}".format(package)), candidate)
+
+
+# Detector that reads everything from a snapshot (tar.gz or directory)
+class ReplayDetector(HardwareDetector):
+
+    def __init__(self, log, snapshotPath):
+        self.tmpDir = None
+        rootDir = abspath(snapshotPath)
+        if not isdir(rootDir):
+            self.tmpDir = tempfile.TemporaryDirectory(prefix='ddm-replay-')
+            rootDir = self.tmpDir.name
+            extract_snapshot(snapshotPath, rootDir)
+        super(ReplayDetector, self).__init__(log, rootDir=rootDir)
+        self.snapshotPath = snapshotPath
+        try:
+            with open(join(rootDir, 'commands.json')) as f:
+                self.commands = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.commands = {}
+        self.packages = read_dpkg_status(join(rootDir, 'var/lib/dpkg/status'))
+
+    # Commands that were not captured have no output
+    def run(self, command):
+        output = self.commands.get(command)
+        if output is None:
+            self.log.write("Not in snapshot: {}".format(command), 'ReplayDetector')
+            return []
+        return output.strip().split('\n')
+
+    def get_package_version(self, package, candidate=False):
+        command = "env LANG=C apt-cache policy {}".format(package)
+        if command in self.commands:
+            return parse_policy(self.run(command), candidate)
+        return self.packages.get(package, '')
+
+    def get_installed_versions(self, packages):
+        return dict((package, self.packages.get(package, '')) for package in packages)
+
+    # The journal was captured when the capturing system had one
+    def has_journal(self):
+        return get_journal_command(WIRELESS_COMMS) in self.commands
+
+
+# Extract a snapshot: only plain files and directories inside targetDir
+def extract_snapshot(snapshotPath, targetDir):
+    with tarfile.open(snapshotPath, 'r:*') as tar:
+        members = []
+        for member in tar.getmembers():
+            path = normpath(member.name)
+            if path.startswith(('/', '..')) or not (member.isfile() or member.isdir()):
+                continue
+            member.name = path
+            members.append(member)
+        tar.extractall(targetDir, members=members)
+
+
+class SnapshotWriter(object):
+
+    def __init__(self, tar):
+        self.tar = tar
+
+    def add_bytes(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = time.time()
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def add_text(self, name, text):
+        self.add_bytes(name, text.encode('utf-8'))
+
+    # Add a file; head or tail of at most maxSize bytes
+    def add_file(self, path, name=None, maxSize=None, tail=False):
+        try:
+            with open(path, 'rb') as f:
+                if maxSize is not None and tail:
+                    f.seek(max(0, os.fstat(f.fileno()).st_size - maxSize))
+                data = f.read() if maxSize is None else f.read(maxSize)
+        except (IOError, OSError):
+            return
+        self.add_bytes(name or path.lstrip('/'), data)
+
+
+# Write a snapshot of this system to snapshotPath
+def capture(snapshotPath, log):
+    detector = CaptureDetector(log)
+    detector.get_supported_hardware()
+    detector.get_loaded_graphical_driver()
+    detector.get_loaded_wireless_driver()
+    for command in EXTRA_COMMANDS:
+        detector.run(command)
+
+    with tarfile.open(snapshotPath, 'w:gz') as tar:
+        writer = SnapshotWriter(tar)
+        writer.add_text('commands.json', json.dumps(detector.commands, indent=2, sort_keys=True))
+
+        # PCI devices: attributes and the bound driver
+        for deviceDir in sorted(glob('/sys/bus/pci/devices/*')):
+            name = deviceDir.lstrip('/')
+            for attribute in PCI_ATTRIBUTES:
+                writer.add_file(join(deviceDir, attribute), join(name, attribute))
+            driverLink = join(deviceDir, 'driver')
+            if islink(driverLink):
+                writer.add_text(join(name, 'driver'), basename(os.readlink(driverLink)) + '\n')
+
+        # DMI: write all keys, so the replay never falls back to dmidecode
+        for key, value in getDmiInfo().items():
+            writer.add_text(join('sys/class/dmi/id', key), value + '\n')
+
+        for path in glob('/var/log/Xorg.*.log'):
+            writer.add_file(path, maxSize=MAX_LOG_SIZE)
+        for path in ['/var/log/syslog', '/var/log/syslog.1']:
+            writer.add_file(path, maxSize=MAX_LOG_SIZE, tail=True)
+
+        writer.add_text('var/lib/dpkg/status', get_dpkg_status_subset())
+        for path in ['/etc/apt/sources.list', '/etc/lsb-release'] + glob('/etc/apt/sources.list.d/*.list'):
+            writer.add_file(path)
+        for path in glob('/usr/share/nvidia/*.ids'):
+            writer.add_file(path)
+
+
+# Print the hardware detected in a snapshot
+def replay(snapshotPath, log):
+    tracer.reset()
+    detector = ReplayDetector(log, snapshotPath)
+    hardware = detector.get_supported_hardware()
+    graphical = detector.get_loaded_graphical_driver()
+    wireless = detector.get_loaded_wireless_driver()
+    tracer.finish(log)
+
+    for hw in hardware:
+        print("[{}] {} ({}:{}, slot {}): {}".format('x' if hw.selected else ' ', hw.description,
+              hw.manufacturerId, hw.deviceId, hw.slot or '-', hw.driver))
+    for device in detector.notSupported:
+        print("Not supported: {}".format(device))
+    for title, msg in detector.warnings:
+        print("Warning: {}".format(title))
+    print("Loaded graphical driver: {}".format(graphical or '-'))
+    print("Loaded wireless driver: {}".format(wireless or '-'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ['capture', 'replay']:
+        print("Usage: {} capture|replay snapshot.tar.gz".format(basename(sys.argv[0])))
+        sys.exit(2)
+    log = Logger(defaultLogLevel='info')
+    if sys.argv[1] == 'capture':
+        capture(sys.argv[2], log)
+        print("Snapshot written to {}".format(sys.argv[2]))
+    else:
+        replay(sys.argv[2], log)
@@ -1,10 +1,15 @@
 #! /usr/bin/env python3
 
+import os
 import subprocess
 import urllib.request
 import urllib.error
 import re
+import time
+import functools
 import threading
+from collections import OrderedDict
+from logger import tracer
 
 
 def shell_exec_popen(command, kwargs={}):
@@ -15,15 +20,21 @@ def shell_exec_popen(command, kwargs={}):
 
 def shell_exec(command):
     print(('Executing:', command))
-    return subprocess.call(command, shell=True)
+    with tracer.span(command, 'shell_exec') as span:
+        span.forks += 1
+        return subprocess.call(command, shell=True)
 
 
 def getoutput(command):
     #return shell_exec(command).stdout.read().strip()
-    try:
-        output = subprocess.check_output(command, shell=True).decode('utf-8').strip().split('\n')
-    except:
-        output = []
+    with tracer.span(command, 'getoutput') as span:
+        span.forks += 1
+        try:
+            output = subprocess.check_output(command, shell=True)
+            span.bytesRead += len(output)
+            output = output.decode('utf-8').strip().split('\n')
+        except:
+            output = []
     return output
 
 
@@ -32,31 +43,109 @@ def chroot_exec(command):
     return shell_exec('chroot /target/ /bin/sh -c "%s"' % command)
 
 
-def memoize(func):
-    """ Caches expensive function calls.
+# Memoized functions, for logCacheStats
+MEMOIZED = []
 
-    Use as:
 
-        c = Cache(lambda arg: function_to_call_if_yet_uncached(arg))
-        c('some_arg')  # returns evaluated result
-        c('some_arg')  # returns *same* (non-evaluated) result
+def memoize(func=None, maxsize=None, ttl=None, invalidate=None):
+    """ Caches expensive function calls.
 
-    or as a decorator:
+    Use as a decorator:
 
         @memoize
         def some_expensive_function(args [, ...]):
             [...]
 
+        @memoize(maxsize=64, ttl=300, invalidate=mtimes('/var/lib/dpkg/status'))
+        def some_probe(args [, ...]):
+            [...]
+
+    maxsize:    number of results to keep, least recently used are dropped first
+    ttl:        seconds a result is kept
+    invalidate: function that returns a key (e.g. the mtime of a file):
+                all results are dropped when the key changes
+
+    The cache is thread-safe and keyword arguments are part of the key.
+    The wrapped function has cache_info() and cache_clear().
+
     See also: http://en.wikipedia.org/wiki/Memoization
     """
-    class memodict(dict):
-        def __call__(self, *args):
-            return self[args]
+    if func is None:
+        return lambda f: memoize(f, maxsize, ttl, invalidate)
+
+    cache = OrderedDict()
+    lock = threading.Lock()
+    stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+    state = {'key': None}
+
+    def wrapper(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        invalidateKey = invalidate() if invalidate is not None else None
+        with lock:
+            if invalidateKey != state['key']:
+                if cache:
+                    stats['invalidations'] += 1
+                cache.clear()
+                state['key'] = invalidateKey
+            if key in cache:
+                expires, value = cache[key]
+                if expires is None or expires > now:
+                    cache.move_to_end(key)
+                    stats['hits'] += 1
+                    return value
+                del cache[key]
+            stats['misses'] += 1
+
+        # Run outside the lock: other arguments do not have to wait
+        value = func(*args, **kwargs)
+
+        with lock:
+            cache[key] = (None if ttl is None else now + ttl, value)
+            cache.move_to_end(key)
+            if maxsize is not None and len(cache) > maxsize:
+                cache.popitem(last=False)
+        return value
+
+    def cache_info():
+        with lock:
+            info = dict(stats)
+            info['size'] = len(cache)
+        return info
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+
+    functools.update_wrapper(wrapper, func)
+    wrapper.cache_info = cache_info
+    wrapper.cache_clear = cache_clear
+    MEMOIZED.append(wrapper)
+    return wrapper
+
+
+# Return an invalidation function for memoize: the mtimes of the given paths
+def mtimes(*paths):
+    def get_mtimes():
+        times = []
+        for path in paths:
+            try:
+                times.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                times.append(None)
+        return tuple(times)
+    return get_mtimes
 
-        def __missing__(self, key):
-            ret = self[key] = func(*key)
-            return ret
-    return memodict()
+
+# Log the hits and misses of the memoized functions that were called
+def logCacheStats(log):
+    stats = []
+    for func in MEMOIZED:
+        info = func.cache_info()
+        if info['hits'] or info['misses']:
+            stats.append("{} {}/{}".format(func.__name__, info['hits'], info['misses']))
+    if stats:
+        log.write("Cache hits/misses: {}".format(' | '.join(stats)), 'cache', 'info')
 
 
 def get_config_dict(file, key_value=re.compile(r'^\s*(\w+)\s*=\s*["\']?(.*?)["\']?\s*(#.*)?$')):
@@ -83,17 +172,71 @@ def hasInternetConnection(testUrl='http://google.com'):
     return False
 
 
+# Known hypervisors and the DMI strings that identify them
+HYPERVISORS = [
+    ('VirtualBox', ['virtualbox', 'innotek']),
+    ('VMware', ['vmware']),
+    ('KVM', ['kvm']),
+    ('QEMU', ['qemu', 'bochs']),
+    ('Xen', ['xen']),
+    ('Hyper-V', ['virtual machine', 'hyper-v']),
+    ('Parallels', ['parallels']),
+    ('bhyve', ['bhyve']),
+]
+
+
+# Return DMI information (bios_version, product_name, board_name, sys_vendor)
+# Read from sysfs and only fall back to dmidecode when sysfs is not available
+@memoize
+def getDmiInfo(dmiDir='/sys/class/dmi/id'):
+    keys = ['bios_version', 'product_name', 'board_name', 'sys_vendor']
+    dmi = {}
+    for key in keys:
+        try:
+            with open(os.path.join(dmiDir, key)) as f:
+                dmi[key] = f.read().strip()
+        except (IOError, OSError):
+            pass
+
+    if not dmi:
+        # Map dmidecode sections and fields to the sysfs names
+        fields = {('bios', 'Version'): 'bios_version',
+                  ('system', 'Product Name'): 'product_name',
+                  ('system', 'Manufacturer'): 'sys_vendor',
+                  ('base board', 'Product Name'): 'board_name'}
+        section = ''
+        for line in getoutput("dmidecode -t bios -t system -t baseboard"):
+            if line and not line[0].isspace():
+                # Section header, e.g.: "BIOS Information"
+                section = line.replace('Information', '').strip().lower()
+            elif ':' in line:
+                name, value = line.split(':', 1)
+                key = fields.get((section, name.strip()))
+                if key and key not in dmi:
+                    dmi[key] = value.strip()
+
+    for key in keys:
+        dmi.setdefault(key, '')
+    return dmi
+
+
+# Return the name of the hypervisor or an empty string on bare metal
+def getHypervisor(dmiDir='/sys/class/dmi/id'):
+    dmiValues = ' '.join(getDmiInfo(dmiDir).values()).lower()
+    for name, ids in HYPERVISORS:
+        for hvId in ids:
+            if hvId in dmiValues:
+                return name
+    return ''
+
+
 # Check if running in VB
 def runningInVirtualBox():
-    dmiBIOSVersion = getoutput("dmidecode -t0 | grep 'Version:' | awk -F ': ' '{print $2}'")
-    dmiSystemProduct = getoutput("dmidecode -t1 | grep 'Product Name:' | awk -F ': ' '{print $2}'")
-    dmiBoardProduct = getoutput("dmidecode -t2 | grep 'Product Name:' | awk -F ': ' '{print $2}'")
-    if dmiBIOSVersion != "VirtualBox" and dmiSystemProduct != "VirtualBox" and dmiBoardProduct != "VirtualBox":
-        return False
-    return True
+    return getHypervisor() == 'VirtualBox'
 
 
 # Check if is 64-bit system
+@memoize
 def isAmd64():
     machine = getoutput("uname -m")[0]
     if machine == "x86_64":
@@ -102,6 +245,7 @@ def isAmd64():
 
 
 # Check for backports
+@memoize(ttl=600, invalidate=mtimes('/etc/apt/sources.list', '/etc/apt/sources.list.d'))
 def has_backports():
     try:
         bp = getoutput("grep backports /etc/apt/sources.list | grep -v ^#")[0]
@@ -117,37 +261,19 @@ def has_backports():
     return False
 
 
+# Return the installed (or candidate) version of a package
+# Cached until dpkg or the package lists change
+@memoize(maxsize=256, ttl=600, invalidate=mtimes('/var/lib/dpkg/status', '/var/lib/apt/lists'))
 def getPackageVersion(package, candidate=False):
     cmd = "env LANG=C bash -c 'apt-cache policy %s | grep \"Installed:\"'" % package
     if candidate:
         cmd = "env LANG=C bash -c 'apt-cache policy %s | grep \"Candidate:\"'" % package
-    lst = getoutput(cmd)[0].strip().split(' ')
+    output = getoutput(cmd)
+    if not output:
+        # Unknown package or no apt-cache
+        return ''
+    lst = output[0].strip().split(' ')
     version = lst[-1]
     if 'none' in version:
         version = ''
     return version
-
-
-# Class to run commands in a thread and return the output in a queue
-class ExecuteThreadedCommands(threading.Thread):
-
-    def __init__(self, commandList, theQueue=None, returnOutput=False):
-        super(ExecuteThreadedCommands, self).__init__()
-        self.commands = commandList
-        self.queue = theQueue
-        self.returnOutput = returnOutput
-
-    def run(self):
-        if isinstance(self.commands, (list, tuple)):
-            for cmd in self.commands:
-                self.exec_cmd(cmd)
-        else:
-            self.exec_cmd(self.commands)
-
-    def exec_cmd(self, cmd):
-        if self.returnOutput:
-            ret = getoutput(cmd)
-        else:
-            ret = shell_exec(cmd)
-        if self.queue is not None:
-            self.queue.put(ret)